@@ -26,6 +26,15 @@ class Settings(BaseSettings):
     APP_VERSION: str = "1.0.0"
     DEBUG: bool = True
 
+    # IoT（プレスイベントの保持期間とアーカイブ先）
+    IOT_RETENTION_ENABLED: bool = True
+    IOT_RETENTION_MONTHS: int = 3  # 当月を除いて iot_press_events に残す月数
+    IOT_ARCHIVE_DIR: str = "data/iot_archive"
+
+    # 実績（ショット数）による生産計画の補正
+    SCHEDULE_FEEDBACK_ENABLED: bool = True
+    SCHEDULE_FEEDBACK_DRIFT_MINUTES: int = 30  # 加工中タスクの終了見込みのずれ（稼働分）がこれ以上なら補正
+
     class Config:
         env_file = ".env"
         case_sensitive = True
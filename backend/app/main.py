@@ -1,8 +1,22 @@
+import logging
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .config import settings
+from .database import SessionLocal
+from .utils.conditional_get import register_change_tracking
+from .services.iot_ingest import press_ingestor
+from .services.iot_press_monitor import press_monitor
+from .services.iot_retention import start_retention_task, stop_retention_task
+from .services.schedule_feedback import start_feedback_task, stop_feedback_task
 from .routers import auth, dashboard, sales, press, master, warehouse, mold, schedule, process, trace, admin, iot, material_mgmt
 
+# ログ設定（モジュール側ではロガーの取得のみ行う）
+logging.basicConfig(level=logging.INFO)
+
+# 条件付きGET用の変更カウンター（コミット時に変更テーブルのバージョンを加算）
+register_change_tracking(SessionLocal)
+
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
@@ -19,6 +33,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # ページングのカーソル（/api/schedule/production-schedule/detailed）をブラウザから読めるようにする
+    expose_headers=["X-Next-Cursor"],
 )
 
 # ルーター登録
@@ -37,6 +53,27 @@ app.include_router(iot.router, prefix="/api/iot", tags=["iot"])
 app.include_router(material_mgmt.router, prefix="/api/material", tags=["material"])
 
 
+@app.on_event("startup")
+async def start_background_tasks():
+    # プレスイベント受信キューの書き込みタスク
+    await press_ingestor.start()
+    # プレスの稼働状態（停止・速度低下）の判定タスク
+    await press_monitor.start()
+    # プレスイベントの保持期間処理（古い月のアーカイブと削除）
+    start_retention_task()
+    # 実績（ショット数）による生産計画の補正
+    start_feedback_task()
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await stop_retention_task()
+    await stop_feedback_task()
+    # 未書き込みのプレスイベントを書き込んでから終了
+    await press_ingestor.stop()
+    await press_monitor.stop()
+
+
 @app.get("/")
 async def root():
     return {
@@ -12,6 +12,8 @@ from .finished_product import FinishedProduct
 from .material import MaterialRate
 from .cycletime import Cycletime
 from .production_schedule import ProductionSchedule
+from .production_plan import ProductionPlanVersion, PressWeeklyBoard
+from .change_counter import TableChangeCounter
 from .trace import StampTrace, OutsourceTrace
 from .material_management import (
     MaterialType,
@@ -44,6 +46,9 @@ __all__ = [
     "MaterialRate",
     "Cycletime",
     "ProductionSchedule",
+    "ProductionPlanVersion",
+    "PressWeeklyBoard",
+    "TableChangeCounter",
     "StampTrace",
     "OutsourceTrace",
     "MaterialType",
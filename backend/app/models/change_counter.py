@@ -0,0 +1,11 @@
+from sqlalchemy import Column, String, BigInteger, DateTime
+from ..database import Base
+
+
+class TableChangeCounter(Base):
+    """テーブルごとの変更カウンター（条件付きGETのETag / Last-Modified 用）"""
+    __tablename__ = "table_change_counters"
+
+    table_name = Column(String(64), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, comment="最終更新日時（UTC）")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Text, UniqueConstraint
 from sqlalchemy.sql import func
 from ..database import Base
 
@@ -12,3 +12,20 @@ class IotButtonEvent(Base):
     pressed_at = Column(DateTime, nullable=False, server_default=func.now())
     note = Column(Text, nullable=True)
     user = Column(String(100), default='raspi')
+    # 再送の重複排除キー（バッチ受信のみ、services/iot_button_ingest.button_dedupe_key）
+    dedupe_key = Column(String(40), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("dedupe_key", name="uq_iot_button_events_dedupe"),
+    )
+
+
+class IotButtonCounter(Base):
+    """ラズパイ・ボタンごとの押下件数（受信時に加算、全件COUNTの代わり）"""
+    __tablename__ = "iot_button_counters"
+
+    # raspi_no なしのイベントは空文字で集計
+    raspi_no = Column(String(100), primary_key=True, default="")
+    button_name = Column(String(100), primary_key=True)
+    event_count = Column(BigInteger, nullable=False, default=0)
+    last_pressed_at = Column(DateTime, nullable=True)
@@ -1,15 +1,70 @@
-from sqlalchemy import Column, Integer, BigInteger, String, Index
+from sqlalchemy import Column, Integer, BigInteger, String, Index, ForeignKey, DateTime, Numeric
+from sqlalchemy.sql import func
 from ..database import Base
 
 
 class IotPressEvent(Base):
+    """プレスショットイベント（ts_ms で月ごとにパーティション化、古い月は iot_retention でアーカイブ）"""
     __tablename__ = "iot_press_events"
 
-    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    ts_ms = Column(BigInteger, nullable=False)
+    # パーティションのキー（ts_ms）を含めるため主キーは (id, ts_ms)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ts_ms = Column(BigInteger, primary_key=True, autoincrement=False)
     raspi_no = Column(String(50), nullable=False, default="unknown")
 
     __table_args__ = (
         Index("idx_iot_press_ts_ms", "ts_ms"),
-        Index("idx_iot_press_raspi_no", "raspi_no"),
+        Index("idx_iot_press_raspi_ts", "raspi_no", "ts_ms"),
+    )
+
+
+class IotPressCounter(Base):
+    """ラズパイごとのプレスイベント件数（受信時に加算、全件COUNTの代わり）"""
+    __tablename__ = "iot_press_counters"
+
+    raspi_no = Column(String(50), primary_key=True)
+    event_count = Column(BigInteger, nullable=False, default=0)
+    last_ts_ms = Column(BigInteger, nullable=True)
+
+
+class IotPressShotRollup(Base):
+    """ラズパイごと・時間帯ごとのショット数（受信キューの書き込み時に加算）"""
+    __tablename__ = "iot_press_shot_rollups"
+
+    resolution = Column(String(10), primary_key=True)  # minute, hour, day
+    raspi_no = Column(String(50), primary_key=True)
+    bucket_start_ms = Column(BigInteger, primary_key=True)
+    shot_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("idx_iot_rollup_resolution_bucket", "resolution", "bucket_start_ms"),
+    )
+
+
+class IotRaspiMachine(Base):
+    """ラズパイと機械の対応（プレスの計画と実績の突き合わせ用）"""
+    __tablename__ = "iot_raspi_machines"
+
+    raspi_no = Column(String(50), primary_key=True)
+    machine_list_id = Column(Integer, ForeignKey("machine_list.machine_list_id", ondelete="CASCADE"), nullable=False, index=True)
+    timestamp = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    user = Column(String(100))
+
+
+class IotPressState(Base):
+    """プレスの稼働状態の変化（running / slow / stopped、変化した時だけ記録）"""
+    __tablename__ = "iot_press_states"
+
+    state_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    raspi_no = Column(String(50), nullable=False)
+    state = Column(String(10), nullable=False)
+    started_ts_ms = Column(BigInteger, nullable=False)
+    ended_ts_ms = Column(BigInteger, nullable=True)  # 次の状態の開始（継続中は NULL）
+    spm = Column(Integer, nullable=True, comment="変化時の直近1分間のショット数")
+    planned_spm = Column(Numeric(10, 2), nullable=True, comment="計画工程のSPM")
+    schedule_id = Column(Integer, nullable=True, comment="変化時の計画（production_schedule）")
+
+    __table_args__ = (
+        Index("idx_iot_press_states_raspi_started", "raspi_no", "started_ts_ms"),
+        Index("idx_iot_press_states_ended", "ended_ts_ms"),
     )
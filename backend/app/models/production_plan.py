@@ -0,0 +1,38 @@
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, JSON, UniqueConstraint
+from sqlalchemy.sql import func
+from ..database import Base
+
+
+class ProductionPlanVersion(Base):
+    """生産計画の公開履歴（計画を生成・削除するたびに1件追加）"""
+    __tablename__ = "production_plan_versions"
+
+    plan_version_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    strategy = Column(String(50), nullable=True)
+    working_hours = Column(Integer, nullable=False, default=8)
+    schedules_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+    user = Column(String(100), nullable=True)
+
+
+class PressWeeklyBoard(Base):
+    """計画公開時に作成するプレス週間予定表（機械×日付のタスク一覧）"""
+    __tablename__ = "press_weekly_boards"
+
+    board_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    plan_version_id = Column(
+        Integer,
+        ForeignKey("production_plan_versions.plan_version_id", ondelete="CASCADE"),
+        nullable=False,
+        index=True
+    )
+    working_hours = Column(Integer, nullable=False)
+    start_date = Column(Date, nullable=False)
+    # 作成時のマスタの変更カウンター（変わっていれば表示時に作り直す）
+    source_version = Column(String(500), nullable=True)
+    board = Column(JSON, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("plan_version_id", "working_hours", name="uq_press_weekly_board_version_hours"),
+    )
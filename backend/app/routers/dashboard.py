@@ -8,10 +8,10 @@ from ..models.mold import BrokenMold
 from ..models.customer import Customer
 from ..models.product import Product
 from ..models.process import Process
-from ..models.iot_button_event import IotButtonEvent
 from ..models.employee import Employee
 from ..models.factory import MachineList
 from ..models.material import MaterialRate
+from ..services.iot_button_ingest import total_button_events
 
 router = APIRouter()
 
@@ -30,8 +30,8 @@ async def get_dashboard_cards(db: Session = Depends(get_db)):
     # Processes
     processes = db.query(func.count(Process.process_id)).scalar() or 0
 
-    # Count (IoT Events from Raspi)
-    count = db.query(func.count(IotButtonEvent.event_id)).scalar() or 0
+    # Count (IoT Events from Raspi) 受信時に加算した件数（iot_button_counters）
+    count = total_button_events(db)
 
     # Employees
     employees = db.query(func.count(Employee.employee_id)).scalar() or 0
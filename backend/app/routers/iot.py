@@ -1,21 +1,55 @@
-from typing import Optional
-from fastapi import APIRouter, Depends, Query
+import asyncio
+from datetime import date
+from typing import Optional, Union
+from pydantic import ValidationError
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, func
 from ..database import get_db
+from .auth import get_current_user
 from ..models.iot_button_event import IotButtonEvent
-from ..models.iot_press_event import IotPressEvent
+from ..models.factory import MachineList
+from ..models.iot_press_event import IotPressEvent, IotRaspiMachine
 from ..schemas.iot import (
     IotButtonEventCreate,
     IotButtonEvent as IotButtonEventSchema,
+    IotButtonEventBatchIn,
+    IotButtonEventBatchOut,
+    IotButtonCounter as IotButtonCounterSchema,
     IotPressEventIn,
     IotPressEventOut,
     IotPressEventsResponse,
     IotPressEventRaw,
+    IotPressTimelineResponse,
+)
+from ..utils.columnar import columnar_response, validate_response_format
+from ..utils.press_batch import PRESS_BATCH_CONTENT_TYPE, decode_press_batch
+from ..services.iot_ingest import press_ingestor, IngestQueueFull
+from ..services.iot_button_ingest import (
+    ingest_button_events, increment_button_counters, query_button_counters, ButtonIngestConflict
+)
+from ..services.iot_rollup import query_shot_counts
+from ..services.iot_stream import press_broadcaster, TooManySubscribers
+from ..services.press_oee import compute_press_oee
+from ..services.iot_press_monitor import press_monitor, query_press_states, STATE_RUNNING, STATE_SLOW, STATE_STOPPED
+from ..services.iot_retention import (
+    list_partitions, run_retention, RetentionBusy, RetentionError, MIN_MANUAL_KEEP_MONTHS
 )
 
 router = APIRouter()
 
+# タイムライン集計の1系列あたりの最大点数
+MAX_TIMELINE_POINTS = 10000
+
+# 列形式レスポンスの列（/events/raw?format=columnar）
+PRESS_EVENT_COLUMNS = [
+    ("id", lambda r: r.id),
+    ("ts_ms", lambda r: r.ts_ms),
+    ("raspi_no", lambda r: r.raspi_no),
+]
+
 
 @router.post("/events", response_model=IotButtonEventSchema)
 async def create_iot_event(event: IotButtonEventCreate, db: Session = Depends(get_db)):
@@ -28,60 +62,391 @@ async def create_iot_event(event: IotButtonEventCreate, db: Session = Depends(ge
         note=event.note
     )
     db.add(db_event)
-    db.commit()
+    db.flush()
     db.refresh(db_event)
+    increment_button_counters(db, {(db_event.raspi_no or "", db_event.button_name): (1, db_event.pressed_at)})
+    db.commit()
     return db_event
 
 
-@router.post("/events/press", response_model=IotPressEventOut)
-async def create_press_events(payload: IotPressEventIn, db: Session = Depends(get_db)):
+@router.post("/events/batch", response_model=IotButtonEventBatchOut)
+async def create_iot_events_batch(payload: IotButtonEventBatchIn, db: Session = Depends(get_db)):
     """
-    プレスショットイベントをバッチ受信する (Press-raspi互換)
+    IoTボタン押下イベントをまとめて記録する（再送しても重複しない）
+
+    イベントごとに event_id（クライアントが付けるID）または pressed_at が必要
+    既に受信済みのイベントは無視し、duplicates に件数を返す
     """
-    objects = [
-        IotPressEvent(ts_ms=ev.ts_ms, raspi_no=payload.raspi_no)
-        for ev in payload.events
+    events = [
+        {**event.model_dump(), "raspi_no": event.raspi_no or payload.raspi_no}
+        for event in payload.events
     ]
-    db.add_all(objects)
-    db.commit()
-    total = db.query(IotPressEvent).count()
+    try:
+        result = ingest_button_events(db, events)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except ButtonIngestConflict as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e),
+            headers={"Retry-After": "1"}
+        )
+    return IotButtonEventBatchOut(status="ok", **result)
+
+
+@router.get("/events/counters", response_model=list[IotButtonCounterSchema])
+async def get_iot_event_counters(
+    raspi_no: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    ラズパイ・ボタンごとの押下件数（受信時に加算した値）
+    """
+    return query_button_counters(db, raspi_no)
+
+
+@router.post(
+    "/events/press",
+    response_model=IotPressEventOut,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": IotPressEventIn.model_json_schema()},
+                PRESS_BATCH_CONTENT_TYPE: {"schema": {"type": "string", "format": "binary"}},
+            },
+        }
+    },
+)
+async def create_press_events(request: Request):
+    """
+    プレスショットイベントをバッチ受信する (Press-raspi互換)
+
+    Content-Type が application/x-press-events の場合はバイナリ形式（utils/press_batch.py）、
+    それ以外は従来のJSON（IotPressEventIn）
+
+    イベントは受信キューに積み、バックグラウンドでまとめて書き込む
+    未書き込みのイベントが上限を超えている場合は429（Retry-After後に再送）
+    """
+    body = await request.body()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    try:
+        if content_type == PRESS_BATCH_CONTENT_TYPE:
+            raspi_no, ts_list = decode_press_batch(body)
+        else:
+            payload = IotPressEventIn.model_validate_json(body)
+            raspi_no, ts_list = payload.raspi_no, [ev.ts_ms for ev in payload.events]
+    except ValidationError as e:
+        # JSONの検証エラーは従来と同じ422の形式で返す
+        raise RequestValidationError(e.errors())
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    try:
+        total = press_ingestor.enqueue(raspi_no, ts_list)
+    except IngestQueueFull:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Press event queue is full, retry later",
+            headers={"Retry-After": "1"}
+        )
     return IotPressEventOut(status="ok", total=total)
 
 
-@router.get("/events", response_model=IotPressEventsResponse)
+@router.get("/events/press/queue")
+async def get_press_event_queue():
+    """
+    プレスイベント受信キューの状態（未書き込み件数など）
+    """
+    return press_ingestor.stats()
+
+
+@router.get("/events/stream")
+async def stream_press_events(
+    request: Request,
+    raspi_no: Optional[list[str]] = Query(None, description="ラズパイ番号でフィルタ（複数指定可）"),
+):
+    """
+    プレスイベントとラズパイごとのSPMのライブ配信（Server-Sent Events）
+
+    - event: press  受信したイベント {raspi_no, events: [ts_ms, ...], spm, last_ts_ms}
+    - event: spm    現在のSPMと状態（接続時と5秒ごと） {spm: {raspi_no: {spm, last_ts_ms, state, state_since_ms, planned_spm}}}
+    - event: state  稼働状態の変化 {raspi_no, state: running|slow|stopped, started_ts_ms, spm, planned_spm}
+    - event: lagged 送信が追いつかずイベントを捨てた（/events で取り直す）
+    """
+    try:
+        messages = press_broadcaster.stream(raspi_no, request.is_disconnected)
+    except TooManySubscribers:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many stream subscribers"
+        )
+    return StreamingResponse(
+        messages,
+        media_type="text/event-stream",
+        # nginx のバッファリングを無効にして即時に送る
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/events", response_model=Union[IotPressEventsResponse, IotPressTimelineResponse])
 async def get_press_events(
     start_ms: int = Query(..., description="開始タイムスタンプ (ms)"),
     end_ms: int = Query(..., description="終了タイムスタンプ (ms)"),
     raspi_no: Optional[str] = Query(None, description="ラズパイ番号でフィルタ"),
+    resolution: Optional[int] = Query(None, description="集計する時間幅 (ms)", ge=1),
+    max_points: Optional[int] = Query(None, description="1系列あたりの最大点数", ge=1, le=MAX_TIMELINE_POINTS),
     db: Session = Depends(get_db),
 ):
     """
     プレスイベントを時間範囲で取得する (タイムライングラフ用)
+
+    resolution または max_points を指定した場合は、サーバー側で時間幅ごとのショット数に集計し、
+    ラズパイごとに固定長の系列を返す（期間の長さに関係なくレスポンスサイズは一定）
     """
+    if resolution is None and max_points is None:
+        stmt = (
+            select(IotPressEvent.ts_ms)
+            .where(IotPressEvent.ts_ms >= start_ms)
+            .where(IotPressEvent.ts_ms <= end_ms)
+        )
+        if raspi_no:
+            stmt = stmt.where(IotPressEvent.raspi_no == raspi_no)
+        stmt = stmt.order_by(IotPressEvent.ts_ms.asc())
+        rows = db.execute(stmt).scalars().all()
+        return IotPressEventsResponse(events=list(rows))
+
+    if end_ms < start_ms:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end_ms must be on or after start_ms")
+
+    span = end_ms - start_ms + 1
+    bucket_ms = resolution or -(-span // max_points)
+    if max_points is not None:
+        # 点数が max_points を超えないよう時間幅を広げる
+        bucket_ms = max(bucket_ms, -(-span // max_points))
+    points = -(-span // bucket_ms)
+    if points > MAX_TIMELINE_POINTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many points ({points}); use a larger resolution or max_points"
+        )
+
+    # ts_ms の整数除算で時間幅ごとに集計
+    bucket = ((IotPressEvent.ts_ms - start_ms).op("DIV")(bucket_ms)).label("bucket")
     stmt = (
-        select(IotPressEvent.ts_ms)
+        select(IotPressEvent.raspi_no, bucket, func.count().label("shot_count"))
         .where(IotPressEvent.ts_ms >= start_ms)
         .where(IotPressEvent.ts_ms <= end_ms)
     )
     if raspi_no:
         stmt = stmt.where(IotPressEvent.raspi_no == raspi_no)
-    stmt = stmt.order_by(IotPressEvent.ts_ms.asc())
-    rows = db.execute(stmt).scalars().all()
-    return IotPressEventsResponse(events=list(rows))
+    stmt = stmt.group_by(IotPressEvent.raspi_no, bucket)
+
+    series: dict[str, list[int]] = {}
+    for row in db.execute(stmt):
+        counts = series.setdefault(row.raspi_no, [0] * points)
+        counts[int(row.bucket)] = int(row.shot_count)
+
+    return IotPressTimelineResponse(start_ms=start_ms, bucket_ms=bucket_ms, points=points, series=series)
+
+
+@router.get("/events/rollup")
+async def get_press_event_rollup(
+    start_ms: int = Query(..., description="開始タイムスタンプ (ms)"),
+    end_ms: int = Query(..., description="終了タイムスタンプ (ms)"),
+    bucket_ms: int = Query(3_600_000, description="集計する時間幅 (ms、60000の倍数)", ge=60_000),
+    raspi_no: Optional[str] = Query(None, description="ラズパイ番号でフィルタ"),
+    db: Session = Depends(get_db),
+):
+    """
+    ショット数を時間幅ごとに集計して返す (長期間のタイムライングラフ用)
+
+    時間幅を割り切れる最も粗いロールアップ（分/時/日）から集計する
+    """
+    try:
+        return query_shot_counts(db, start_ms, end_ms, bucket_ms, raspi_no)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.get("/events/partitions")
+async def get_press_event_partitions(db: Session = Depends(get_db)):
+    """
+    プレスイベントの月ごとのパーティション一覧（件数は概算）
+    """
+    return {"partitions": list_partitions(db)}
+
+
+@router.post("/events/retention")
+async def run_press_event_retention(
+    request: dict,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    保持期間を過ぎたプレスイベントのパーティションをアーカイブして削除（通常は定期実行）
+
+    Request:
+        keep_months: 当月を除いて残す月数（省略時は設定値、手動実行は MIN_MANUAL_KEEP_MONTHS 以上）
+        dry_run: true の場合は対象の確認のみ
+    """
+    keep_months = request.get("keep_months")
+    if keep_months is not None:
+        if not isinstance(keep_months, int) or isinstance(keep_months, bool):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="keep_months must be an integer")
+        if keep_months < MIN_MANUAL_KEEP_MONTHS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"keep_months must be {MIN_MANUAL_KEEP_MONTHS} or more"
+            )
+    dry_run = bool(request.get("dry_run", False))
+    try:
+        return await asyncio.to_thread(run_retention, keep_months=keep_months, dry_run=dry_run)
+    except RetentionBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except RetentionError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.get("/press-states/current")
+async def get_current_press_states(
+    raspi_no: Optional[list[str]] = Query(None, description="ラズパイ番号でフィルタ（複数指定可）"),
+):
+    """
+    ラズパイごとの現在のSPMと稼働状態（running / slow / stopped）
+    """
+    return press_monitor.snapshot(raspi_no)
+
+
+@router.get("/press-states")
+async def get_press_states(
+    start_ms: int = Query(..., description="開始時刻 (ms)"),
+    end_ms: int = Query(..., description="終了時刻 (ms)"),
+    raspi_no: Optional[str] = Query(None, description="ラズパイ番号でフィルタ"),
+    state: Optional[str] = Query(None, description="状態でフィルタ: running, slow, stopped（停止の一覧は stopped）"),
+    db: Session = Depends(get_db),
+):
+    """
+    期間に重なる稼働状態の一覧（停止・速度低下の期間）
+    """
+    if end_ms <= start_ms:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="end_ms must be after start_ms")
+    if state and state not in (STATE_RUNNING, STATE_SLOW, STATE_STOPPED):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown state: {state}")
+    return query_press_states(db, start_ms, end_ms, raspi_no, state)
+
+
+@router.get("/oee")
+def get_press_oee(
+    start_date: date,
+    end_date: date,
+    working_hours: int = Query(8, ge=1, le=18, description="稼働時間（シフトは6:00から）"),
+    machine_list_id: Optional[list[int]] = Query(None, description="機械IDでフィルタ（複数指定可）"),
+    db: Session = Depends(get_db),
+):
+    """
+    機械ごと・シフトごとの計画と実績（稼働率・性能・計画達成率）
+
+    ラズパイと機械の対応（/raspi-machines）が登録されている機械のみ
+    - NumPyでの集計はCPU負荷が高いため同期関数とし、スレッドプールで実行する
+    """
+    try:
+        return compute_press_oee(db, start_date, end_date, working_hours, machine_list_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.get("/raspi-machines")
+async def get_raspi_machines(db: Session = Depends(get_db)):
+    """
+    ラズパイと機械の対応一覧
+    """
+    rows = db.query(
+        IotRaspiMachine.raspi_no,
+        IotRaspiMachine.machine_list_id,
+        MachineList.machine_no
+    ).join(
+        MachineList, MachineList.machine_list_id == IotRaspiMachine.machine_list_id
+    ).order_by(IotRaspiMachine.raspi_no).all()
+    return [
+        {"raspi_no": row.raspi_no, "machine_list_id": row.machine_list_id, "machine_no": row.machine_no}
+        for row in rows
+    ]
+
+
+@router.put("/raspi-machines/{raspi_no}")
+async def set_raspi_machine(
+    raspi_no: str,
+    request: dict,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    ラズパイに機械を割り当てる
+
+    Request:
+        machine_list_id: 機械ID
+    """
+    machine = db.query(MachineList).filter(MachineList.machine_list_id == request.get("machine_list_id")).first()
+    if not machine:
+        raise HTTPException(status_code=404, detail="Machine not found")
+
+    mapping = db.query(IotRaspiMachine).filter(IotRaspiMachine.raspi_no == raspi_no).first()
+    if mapping is None:
+        mapping = IotRaspiMachine(raspi_no=raspi_no)
+        db.add(mapping)
+    mapping.machine_list_id = machine.machine_list_id
+    mapping.user = current_user['username']
+    db.commit()
+    return {"raspi_no": raspi_no, "machine_list_id": machine.machine_list_id, "machine_no": machine.machine_no}
+
+
+@router.delete("/raspi-machines/{raspi_no}")
+async def delete_raspi_machine(
+    raspi_no: str,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    ラズパイの機械の割り当てを解除
+    """
+    mapping = db.query(IotRaspiMachine).filter(IotRaspiMachine.raspi_no == raspi_no).first()
+    if not mapping:
+        raise HTTPException(status_code=404, detail="Mapping not found")
+    db.delete(mapping)
+    db.commit()
+    return {"message": "Mapping deleted successfully"}
 
 
 @router.get("/events/raw", response_model=list[IotPressEventRaw])
 async def get_press_events_raw(
     limit: int = Query(200, description="取得件数", ge=1, le=5000),
     raspi_no: Optional[str] = Query(None, description="ラズパイ番号でフィルタ"),
+    since_ms: Optional[int] = Query(None, description="この時刻 (ms) 以降のイベントのみ（ライブ配信の補完用）"),
+    format: str = Query("json", description="レスポンス形式: json, columnar（列形式）"),
     db: Session = Depends(get_db),
 ):
     """
     プレスイベント生データを新しい順に返す
+
+    ライブ配信（/events/stream）は受信したワーカーのクライアントにしか届かないため、
+    画面は since_ms で直近の期間を定期的に取り直して補完する
     """
+    if validate_response_format(format):
+        # 列形式: ORMオブジェクトを作らず列のみ取得
+        stmt = select(IotPressEvent.id, IotPressEvent.ts_ms, IotPressEvent.raspi_no)\
+            .order_by(IotPressEvent.ts_ms.desc())
+        if raspi_no:
+            stmt = stmt.where(IotPressEvent.raspi_no == raspi_no)
+        if since_ms is not None:
+            stmt = stmt.where(IotPressEvent.ts_ms >= since_ms)
+        rows = db.execute(stmt.limit(limit)).all()
+        return columnar_response(rows, PRESS_EVENT_COLUMNS, ("raspi_no",))
+
     stmt = select(IotPressEvent).order_by(IotPressEvent.ts_ms.desc())
     if raspi_no:
         stmt = stmt.where(IotPressEvent.raspi_no == raspi_no)
+    if since_ms is not None:
+        stmt = stmt.where(IotPressEvent.ts_ms >= since_ms)
     stmt = stmt.limit(limit)
     rows = db.execute(stmt).scalars().all()
     return rows
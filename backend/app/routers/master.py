@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
 from typing import List
 from ..database import get_db
@@ -31,6 +31,7 @@ from ..schemas import material as material_schema
 from ..schemas import cycletime as cycletime_schema
 from .auth import get_current_user
 from ..utils.auth import get_password_hash, generate_strong_password
+from ..utils.conditional_get import check_not_modified
 
 router = APIRouter()
 
@@ -70,11 +71,17 @@ async def get_table_counts(db: Session = Depends(get_db)):
 # ==================== Customers ====================
 @router.get("/customers", response_model=List[customer_schema.CustomerResponse])
 async def get_customers(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     search: str = None,
     db: Session = Depends(get_db)
 ):
+    not_modified = check_not_modified(request, response, db, (Customer.__tablename__,))
+    if not_modified:
+        return not_modified
+
     query = db.query(Customer)
     if search:
         query = query.filter(Customer.customer_name.contains(search))
@@ -143,12 +150,18 @@ async def delete_customer(
 # ==================== Products ====================
 @router.get("/products")
 async def get_products(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     product_code: str = None,
     customer_name: str = None,
     db: Session = Depends(get_db)
 ):
+    not_modified = check_not_modified(request, response, db, (Product.__tablename__, Customer.__tablename__))
+    if not_modified:
+        return not_modified
+
     query = db.query(Product).join(Customer, Product.customer_id == Customer.customer_id)
 
     # 製品コードで検索
@@ -316,6 +329,8 @@ async def delete_product(
 # ==================== Employees ====================
 @router.get("/employees")
 async def get_employees(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     employee_no: str = None,
@@ -323,6 +338,10 @@ async def get_employees(
     has_password: bool = None,
     db: Session = Depends(get_db)
 ):
+    not_modified = check_not_modified(request, response, db, (Employee.__tablename__,))
+    if not_modified:
+        return not_modified
+
     query = db.query(Employee)
 
     # 従業員番号で検索
@@ -468,11 +487,17 @@ async def revoke_employee_password(
 # ==================== Suppliers ====================
 @router.get("/suppliers", response_model=List[supplier_schema.SupplierResponse])
 async def get_suppliers(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     search: str = None,
     db: Session = Depends(get_db)
 ):
+    not_modified = check_not_modified(request, response, db, (Supplier.__tablename__,))
+    if not_modified:
+        return not_modified
+
     query = db.query(Supplier)
     if search:
         query = query.filter(Supplier.supplier_name.contains(search))
@@ -680,12 +705,18 @@ async def autocomplete_machines(
 # ==================== Process Names ====================
 @router.get("/process-names", response_model=List[process_schema.ProcessNameTypeResponse])
 async def get_process_names(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     search: str = None,
     db: Session = Depends(get_db)
 ):
     """工程名一覧を取得"""
+    not_modified = check_not_modified(request, response, db, (ProcessNameType.__tablename__,))
+    if not_modified:
+        return not_modified
+
     query = db.query(ProcessNameType)
     if search:
         query = query.filter(ProcessNameType.process_name.contains(search))
@@ -750,6 +781,8 @@ async def delete_process_name(
 # ==================== Material Rates ====================
 @router.get("/material-rates", response_model=List[material_schema.MaterialRateWithDetails])
 async def get_material_rates(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     search: str = None,
@@ -757,6 +790,10 @@ async def get_material_rates(
     current_user: dict = Depends(get_current_user)
 ):
     """材料レート一覧を取得"""
+    not_modified = check_not_modified(request, response, db, (MaterialRate.__tablename__, Product.__tablename__))
+    if not_modified:
+        return not_modified
+
     query = db.query(MaterialRate).join(Product, MaterialRate.product_id == Product.product_id)
     if search:
         query = query.filter(Product.product_code.contains(search))
@@ -798,6 +835,8 @@ async def create_material_rate(
 # ==================== Machine Types ====================
 @router.get("/machine-types", response_model=List[factory_schema.MachineTypeResponse])
 async def get_machine_types(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     search: str = None,
@@ -805,6 +844,10 @@ async def get_machine_types(
     current_user: dict = Depends(get_current_user)
 ):
     """機械種類一覧を取得"""
+    not_modified = check_not_modified(request, response, db, (MachineType.__tablename__,))
+    if not_modified:
+        return not_modified
+
     query = db.query(MachineType)
     if search:
         query = query.filter(MachineType.machine_type_name.contains(search))
@@ -868,6 +911,8 @@ async def delete_machine_type(
 # ==================== Machines ====================
 @router.get("/machines", response_model=List[factory_schema.MachineListWithDetails])
 async def get_machines(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     search: str = None,
@@ -875,6 +920,10 @@ async def get_machines(
     current_user: dict = Depends(get_current_user)
 ):
     """機械一覧を取得"""
+    not_modified = check_not_modified(request, response, db, (MachineList.__tablename__, Factory.__tablename__, MachineType.__tablename__))
+    if not_modified:
+        return not_modified
+
     query = db.query(MachineList).outerjoin(Factory, MachineList.factory_id == Factory.factory_id).outerjoin(MachineType, MachineList.machine_type_id == MachineType.machine_type_id)
     if search:
         query = query.filter(MachineList.machine_no.contains(search))
@@ -998,6 +1047,8 @@ async def get_product_process_names(
 
 @router.get("/cycletimes", response_model=List[cycletime_schema.CycletimeWithDetails])
 async def get_cycletimes(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     search: str = None,
@@ -1005,6 +1056,10 @@ async def get_cycletimes(
     current_user: dict = Depends(get_current_user)
 ):
     """サイクルタイム設定一覧を取得"""
+    not_modified = check_not_modified(request, response, db, (Cycletime.__tablename__, Product.__tablename__))
+    if not_modified:
+        return not_modified
+
     query = db.query(Cycletime).join(Product, Cycletime.product_id == Product.product_id)
     if search:
         query = query.filter(Product.product_code.contains(search))
@@ -17,6 +17,7 @@ from ..models.factory import Factory
 from ..models.supplier import Supplier
 from ..schemas import material_management as schema
 from .auth import get_current_user
+from ..utils.columnar import columnar_response, validate_response_format
 
 router = APIRouter()
 
@@ -445,6 +446,26 @@ async def delete_material_lot(
 
 
 # ==================== Material Transactions ====================
+# Columns for /material-transactions?format=columnar
+MATERIAL_TRANSACTION_COLUMNS = [
+    ("transaction_id", lambda r: r.MaterialTransaction.transaction_id),
+    ("transaction_date", lambda r: r.MaterialTransaction.transaction_date),
+    ("lot_id", lambda r: r.MaterialTransaction.lot_id),
+    ("factory_id", lambda r: r.MaterialTransaction.factory_id),
+    ("sheet_qty", lambda r: r.MaterialTransaction.sheet_qty),
+    ("coil_qty", lambda r: r.MaterialTransaction.coil_qty),
+    ("weight_kg", lambda r: r.MaterialTransaction.weight_kg),
+    ("transaction_type", lambda r: r.MaterialTransaction.transaction_type),
+    ("note", lambda r: r.MaterialTransaction.note),
+    ("timestamp", lambda r: r.MaterialTransaction.timestamp),
+    ("user", lambda r: r.MaterialTransaction.user),
+    ("lot_no", lambda r: r.lot_no),
+    ("material_code", lambda r: r.material_code),
+    ("material_name", lambda r: r.material_name),
+    ("factory_name", lambda r: r.factory_name),
+]
+
+
 @router.get("/material-transactions", response_model=List[schema.MaterialTransactionWithDetails])
 async def get_material_transactions(
     skip: int = 0,
@@ -452,11 +473,30 @@ async def get_material_transactions(
     lot_id: int = None,
     factory_id: int = None,
     transaction_type: str = None,
+    format: str = "json",
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get all material transactions with details"""
-    query = db.query(MaterialTransaction)
+    """
+    Get all material transactions with details
+
+    Lot, material name and factory name are read in the same query.
+    format=columnar returns column arrays (lot_no, material_code, material_name and factory_name are dictionary-encoded).
+    """
+    columnar = validate_response_format(format)
+
+    query = db.query(
+        MaterialTransaction,
+        MaterialLot.lot_no,
+        MaterialLot.material_code,
+        MaterialType.material_name,
+        Factory.factory_name
+    )\
+        .outerjoin(MaterialLot, MaterialTransaction.lot_id == MaterialLot.lot_id)\
+        .outerjoin(MaterialItem, MaterialLot.material_code == MaterialItem.material_code)\
+        .outerjoin(MaterialSpec, MaterialItem.material_spec_id == MaterialSpec.material_spec_id)\
+        .outerjoin(MaterialType, MaterialSpec.material_type_id == MaterialType.material_type_id)\
+        .outerjoin(Factory, MaterialTransaction.factory_id == Factory.factory_id)
     if lot_id:
         query = query.filter(MaterialTransaction.lot_id == lot_id)
     if factory_id:
@@ -464,27 +504,22 @@ async def get_material_transactions(
     if transaction_type:
         query = query.filter(MaterialTransaction.transaction_type == transaction_type)
     query = query.order_by(MaterialTransaction.transaction_date.desc())
-    transactions = query.offset(skip).limit(limit).all()
+    rows = query.offset(skip).limit(limit).all()
 
-    result = []
-    for tx in transactions:
-        lot = db.query(MaterialLot).filter(MaterialLot.lot_id == tx.lot_id).first()
-        factory = db.query(Factory).filter(Factory.factory_id == tx.factory_id).first()
-        material_item = None
-        material_type = None
-        if lot:
-            material_item = db.query(MaterialItem).filter(MaterialItem.material_code == lot.material_code).first()
-            if material_item:
-                spec = db.query(MaterialSpec).filter(MaterialSpec.material_spec_id == material_item.material_spec_id).first()
-                if spec:
-                    material_type = db.query(MaterialType).filter(MaterialType.material_type_id == spec.material_type_id).first()
+    if columnar:
+        return columnar_response(
+            rows, MATERIAL_TRANSACTION_COLUMNS,
+            ("lot_no", "material_code", "material_name", "factory_name")
+        )
 
+    result = []
+    for row in rows:
         result.append({
-            **tx.__dict__,
-            "lot_no": lot.lot_no if lot else None,
-            "material_code": lot.material_code if lot else None,
-            "material_name": material_type.material_name if material_type else None,
-            "factory_name": factory.factory_name if factory else None,
+            **row.MaterialTransaction.__dict__,
+            "lot_no": row.lot_no,
+            "material_code": row.material_code,
+            "material_name": row.material_name,
+            "factory_name": row.factory_name,
         })
     return result
 
@@ -12,9 +12,25 @@ from ..models.customer import Customer
 from ..schemas import po as po_schema
 from .auth import get_current_user
 from ..utils.delivery_calculator import calculate_delivery_date
+from ..utils.columnar import columnar_response, validate_response_format
 
 router = APIRouter()
 
+# 列形式レスポンスの列（/po?format=columnar）行は (PO, product_code, customer_name)
+PO_COLUMNS = [
+    ("po_id", lambda r: r.PO.po_id),
+    ("po_number", lambda r: r.PO.po_number),
+    ("product_id", lambda r: r.PO.product_id),
+    ("delivery_date", lambda r: r.PO.delivery_date),
+    ("date_receive_po", lambda r: r.PO.date_receive_po),
+    ("po_quantity", lambda r: r.PO.po_quantity),
+    ("is_delivered", lambda r: r.PO.is_delivered),
+    ("timestamp", lambda r: r.PO.timestamp),
+    ("user", lambda r: r.PO.user),
+    ("customer_name", lambda r: r.customer_name),
+    ("product_code", lambda r: r.product_code),
+]
+
 
 @router.get("/po", response_model=List[po_schema.POResponse])
 async def get_pos(
@@ -27,13 +43,17 @@ async def get_pos(
     delivery_date_to: Optional[date] = None,
     is_delivered: Optional[bool] = Query(False, description="配送済みフラグ（デフォルトfalse=未配送のみ表示）"),
     sort_by: Optional[str] = Query("timestamp_desc", description="ソート順: timestamp_desc, timestamp_asc, delivery_date_asc, delivery_date_desc"),
+    format: str = Query("json", description="レスポンス形式: json, columnar（列形式）"),
     db: Session = Depends(get_db)
 ):
     """
     PO一覧を取得（検索機能付き）
     - デフォルトでは配送済みでないものだけを表示
     - 登録時間の降順でソート（最新が上）
+    - format=columnar の場合は列形式で返す（顧客名・製品コードは辞書エンコード）
     """
+    columnar = validate_response_format(format)
+
     # JOINを使用してProduct、Customerと結合し、必要なフィールドを選択
     query = db.query(
         PO,
@@ -77,6 +97,9 @@ async def get_pos(
 
     results = query.offset(skip).limit(limit).all()
 
+    if columnar:
+        return columnar_response(results, PO_COLUMNS, ("customer_name", "product_code"))
+
     # POオブジェクトに追加データを設定
     pos = []
     for po, product_code, customer_name in results:
@@ -1,19 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_
-from typing import List
+from sqlalchemy import and_
+from typing import List, Optional
 from datetime import datetime, timedelta, date
 from decimal import Decimal
+import json
+import logging
+import math
+import os
+import tempfile
 import pytz
 from ..database import get_db
 
 # ベトナム時間（UTC+7）のタイムゾーン
 VIETNAM_TZ = pytz.timezone('Asia/Ho_Chi_Minh')
-from ..models import Calendar, HolidayType, PO, Product, Process, ProcessNameType, Customer, ProductionSchedule
+from ..models import Calendar, HolidayType, PO, Product, Process, ProcessNameType, Customer, ProductionSchedule, PressWeeklyBoard
 from ..models.factory import MachineList
 from ..schemas import schedule as schemas
 from ..routers.auth import get_current_user
-from ..services.production_scheduler import ProductionScheduler
+from ..services.production_scheduler import ProductionScheduler, SCHEDULING_STRATEGIES, DEFAULT_STRATEGY
+from ..services.decision_trace import start_trace, get_trace, DEFAULT_TRACE_CAPACITY, MAX_TRACE_CAPACITY
+from ..services.plan_version import publish_plan_version
+from ..services.schedule_feedback import run_schedule_feedback, FeedbackConflict
+from ..services.schedule_reader import query_schedule_details, encode_cursor, decode_cursor
+from ..services.plan_inputs import load_process_chains, WorkingDayIndex
+from ..services.deadline_service import (
+    get_plan_deadlines, estimate_process_minutes, get_working_minutes as get_scheduler_working_minutes
+)
+from ..utils.conditional_get import check_not_modified, PLAN_TABLES
+from ..utils.columnar import columnar_response, validate_response_format
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -239,58 +258,45 @@ async def get_progress_table(
         Product.is_active == True
     ).all()
 
+    # 工程をまとめて取得、PO需要・休日は締切日サービスから取得
+    process_chains = load_process_chains(db, [p.product_id for p in products])
+    deadlines = get_plan_deadlines(db)
+    po_demand = deadlines.demand
+    holidays = deadlines.holidays
+
+    # デフォルト稼働時間は8時間
+    working_hours = 8
+
     result = []
     for product in products:
-        # この製品の工程を取得
-        processes = db.query(Process).filter(
-            Process.product_id == product.product_id
-        ).order_by(Process.process_no).all()
+        # この製品の工程（工程番号順）
+        processes = process_chains.get(product.product_id)
 
         # 工程がない製品はスキップ
         if not processes:
             continue
 
         # 工程を工程番号ごとに整理（最大20工程）
-        # 工程オブジェクト全体を保持
         process_map = {}
         for proc in processes:
-            if proc.process_no <= 20:
-                process_map[proc.process_no] = proc
-
-        # この製品のPO情報を取得
-        # 1. 最も近い納期を取得（未配送のみ）
-        earliest_po = db.query(PO).filter(
-            and_(
-                PO.product_id == product.product_id,
-                PO.is_delivered == False
-            )
-        ).order_by(PO.delivery_date).first()
+            if proc.Process.process_no <= 20:
+                process_map[proc.Process.process_no] = proc
+
+        # この製品のPO情報（最も近い納期から28日以内のPO）
+        demand = po_demand.get(product.product_id)
 
         total_po_quantity = None
         po_numbers_display = None
         earliest_delivery_date = None
+        delivery_date = None
 
-        if earliest_po:
-            earliest_delivery_date = earliest_po.delivery_date.strftime("%d/%m/%Y")
-
-            # 最も近い納期から28日以内のPOを取得
-            date_limit = earliest_po.delivery_date + timedelta(days=28)
-
-            relevant_pos = db.query(PO).filter(
-                and_(
-                    PO.product_id == product.product_id,
-                    PO.is_delivered == False,
-                    PO.delivery_date >= earliest_po.delivery_date,
-                    PO.delivery_date <= date_limit
-                )
-            ).order_by(PO.delivery_date).all()
-
-            # PO数量の合計を計算
-            total_po_quantity = sum(po.po_quantity for po in relevant_pos)
+        if demand:
+            delivery_date = demand['earliest_delivery_date']
+            earliest_delivery_date = delivery_date.strftime("%d/%m/%Y")
+            total_po_quantity = demand['total_po_quantity']
 
-            # PO番号を最大4件まで取得（改行で区切る）
-            po_numbers = [po.po_number for po in relevant_pos[:4]]
-            po_numbers_display = "<br>".join(po_numbers)
+            # PO番号を最大4件まで（改行で区切る）
+            po_numbers_display = "<br>".join(demand['po_numbers'][:4])
 
         product_row = {
             "product_id": product.product_id,
@@ -310,21 +316,12 @@ async def get_progress_table(
         for i in range(1, 21):
             process = process_map.get(i)
             if process and total_po_quantity:
-                # 工程タイプを取得
-                process_type_record = db.query(ProcessNameType).filter(
-                    ProcessNameType.process_name == process.process_name
-                ).first()
-                process_type = process_type_record.day_or_spm if process_type_record else None
-
-                # デフォルト稼働時間は8時間
-                working_hours = 8
-
                 # 加工時間を計算
                 time_needed = calculate_process_time(
-                    process,
+                    process.Process,
                     total_po_quantity,
                     working_hours,
-                    process_type,
+                    process.day_or_spm,
                     db
                 )
 
@@ -339,9 +336,8 @@ async def get_progress_table(
 
         # 納期から逆算して各工程の予定日時を計算
         process_schedules = {}
-        if earliest_po and total_po_quantity:
-            current_date = earliest_po.delivery_date
-            working_hours = 8
+        if delivery_date and total_po_quantity:
+            current_date = delivery_date
 
             # 工程を逆順（最終工程から最初の工程）に処理
             process_numbers = sorted([k for k in process_map.keys()], reverse=True)
@@ -355,7 +351,8 @@ async def get_progress_table(
                         time_needed["days"],
                         time_needed["minutes"],
                         working_hours,
-                        db
+                        db,
+                        holidays
                     )
 
                     process_schedules[process_no] = planned_datetime
@@ -393,9 +390,6 @@ async def get_progress_table(
                 product_row[f"process_{i}"] = ""
 
         # 合計加工時間をフォーマット（稼働時間を考慮して日単位に切り上げ）
-        # デフォルト稼働時間は8時間
-        working_hours = 8
-
         # 分を時間に変換
         total_hours_from_minutes = total_minutes / 60
 
@@ -440,8 +434,14 @@ def get_working_minutes(hours: int) -> int:
     return working_minutes_map.get(hours, hours * 60)  # デフォルトは休憩なし
 
 
-def is_working_day(date_to_check: date, db: Session) -> bool:
-    """指定された日が稼働日（休日でない）かチェック"""
+def is_working_day(date_to_check: date, db: Session, holidays: Optional[set] = None) -> bool:
+    """
+    指定された日が稼働日（休日でない）かチェック
+
+    holidays（休日の日付セット）を渡した場合はDBを参照しない
+    """
+    if holidays is not None:
+        return date_to_check not in holidays
     holiday = db.query(Calendar).filter(Calendar.date_holiday == date_to_check).first()
     return holiday is None
 
@@ -512,11 +512,14 @@ def subtract_working_time(
     days: int,
     minutes: int,
     working_hours: int,
-    db: Session
+    db: Session,
+    holidays: Optional[set] = None,
+    working_day_index: Optional[WorkingDayIndex] = None
 ) -> datetime:
     """
     指定された日付から稼働時間を遡って計算
     休日を考慮して実際の稼働日のみカウント
+    holidays（休日の日付セット）または working_day_index を渡した場合はDBを参照しない
     """
     current_date = start_date
     remaining_days = days
@@ -532,11 +535,15 @@ def subtract_working_time(
         remaining_days += 1  # 分単位の作業がある場合は1日追加
 
     # 日数分遡る
+    if working_day_index is not None:
+        current_date = working_day_index.subtract_working_days(current_date, remaining_days)
+        remaining_days = 0
+
     while remaining_days > 0:
         current_date = current_date - timedelta(days=1)
 
         # 稼働日のみカウント
-        if is_working_day(current_date, db):
+        if is_working_day(current_date, db, holidays):
             remaining_days -= 1
 
     # 分単位の調整
@@ -555,6 +562,65 @@ def subtract_working_time(
     return datetime.combine(current_date, datetime.min.time().replace(hour=result_hour, minute=result_minute))
 
 
+def backward_schedule_product(
+    product_info,
+    processes: Optional[list],
+    demand: Optional[dict],
+    working_hours: int,
+    working_day_index: Optional[WorkingDayIndex],
+    db: Session
+):
+    """
+    1製品の各工程の開始予定日時を納期から逆算（最終工程から順に返す）
+
+    processes は load_process_chains、demand は締切日サービスの1製品分
+    """
+    if not processes or not demand:
+        return
+
+    total_po_quantity = demand['total_po_quantity']
+
+    # 生産開始予定日 = 納期から逆算（納期そのものから各工程の加工時間を引く）
+    current_date = demand['earliest_delivery_date']
+
+    # 納期（最も近いもの）
+    delivery_date_str = current_date.strftime("%d/%m/%Y")
+
+    # 各工程を逆順に計算
+    for process in reversed(processes):
+        # 工程の所要時間を計算（PO数量合計を使用）
+        time_needed = calculate_process_time(
+            process.Process,
+            total_po_quantity,
+            working_hours,
+            process.day_or_spm,
+            db
+        )
+
+        # 前の工程の開始日時を計算（稼働日を考慮して遡る）
+        planned_datetime = subtract_working_time(
+            current_date,
+            time_needed["days"],
+            time_needed["minutes"],
+            working_hours,
+            db,
+            working_day_index=working_day_index
+        )
+
+        yield {
+            "customer_name": product_info.customer_name,
+            "product_code": product_info.product_code,
+            "process_name": process.process_name,
+            "po_quantity": total_po_quantity,
+            "planned_datetime": planned_datetime.strftime("%d/%m/%Y %H:%M"),
+            "delivery_date": delivery_date_str,  # 納期（最も近いもの）
+            "planned_datetime_sort": planned_datetime  # ソート用の日時オブジェクト
+        }
+
+        # 次の工程（1つ前の工程番号）の開始日を更新
+        current_date = planned_datetime.date()
+
+
 @router.post("/calculate-production-plan")
 async def calculate_production_plan(
     request: dict,
@@ -565,8 +631,12 @@ async def calculate_production_plan(
 
     製品ごとに未配送のPOをグループ化し、PO数量合計で各工程の生産予定日時を計算する
     最も近い納期の3日前から逆算して、各工程の開始予定日時を求める
+
+    - 需要・工程・稼働日は最初にまとめて読み込み、逆算はメモリ上で行う
+    - stream: true の場合は計算した製品から順にNDJSONで返す（日時順のソートなし）
     """
     working_hours = request.get("working_hours", 8)
+    stream = bool(request.get("stream", False))
 
     # 製品ごとにグループ化して、未配送のPOを取得
     products_with_pos = db.query(
@@ -584,94 +654,33 @@ async def calculate_production_plan(
         )
     ).distinct().all()
 
-    result = []
-
-    for product_info in products_with_pos:
-        product_id = product_info.product_id
-        product_code = product_info.product_code
-        customer_name = product_info.customer_name
-
-        # この製品の工程を取得（工程番号の降順 = 最終工程から）
-        processes = db.query(Process).filter(
-            Process.product_id == product_id
-        ).order_by(Process.process_no.desc()).all()
-
-        if not processes:
-            continue
-
-        # この製品の未配送POを取得
-        # 1. 最も近い納期を取得
-        earliest_po = db.query(PO).filter(
-            and_(
-                PO.product_id == product_id,
-                PO.is_delivered == False
-            )
-        ).order_by(PO.delivery_date).first()
-
-        if not earliest_po:
-            continue
-
-        # 2. 最も近い納期から28日以内のPOを取得
-        date_limit = earliest_po.delivery_date + timedelta(days=28)
-
-        relevant_pos = db.query(PO).filter(
-            and_(
-                PO.product_id == product_id,
-                PO.is_delivered == False,
-                PO.delivery_date >= earliest_po.delivery_date,
-                PO.delivery_date <= date_limit
-            )
-        ).all()
-
-        # PO数量の合計を計算
-        total_po_quantity = sum(po.po_quantity for po in relevant_pos)
-
-        # 生産開始予定日 = 納期から逆算（納期そのものから各工程の加工時間を引く）
-        production_start_date = earliest_po.delivery_date
-        current_date = production_start_date
-
-        # 納期（最も近いもの）
-        delivery_date_str = earliest_po.delivery_date.strftime("%d/%m/%Y")
-
-        # 各工程を逆順に計算
-        for process in processes:
-            # 工程タイプを取得
-            process_type_record = db.query(ProcessNameType).filter(
-                ProcessNameType.process_name == process.process_name
-            ).first()
-
-            process_type = process_type_record.day_or_spm if process_type_record else None
-
-            # 工程の所要時間を計算（PO数量合計を使用）
-            time_needed = calculate_process_time(
-                process,
-                total_po_quantity,
+    # 工程をまとめて取得、需要と稼働日インデックスは締切日サービスから取得（以降はDBを参照しない）
+    process_chains = load_process_chains(db, [p.product_id for p in products_with_pos])
+    deadlines = get_plan_deadlines(db)
+    po_demand = deadlines.demand
+    working_day_index = deadlines.working_days
+
+    def plan_rows():
+        for product_info in products_with_pos:
+            yield from backward_schedule_product(
+                product_info,
+                process_chains.get(product_info.product_id),
+                po_demand.get(product_info.product_id),
                 working_hours,
-                process_type,
+                working_day_index,
                 db
             )
 
-            # 前の工程の開始日時を計算（稼働日を考慮して遡る）
-            planned_datetime = subtract_working_time(
-                current_date,
-                time_needed["days"],
-                time_needed["minutes"],
-                working_hours,
-                db
-            )
+    if stream:
+        # 計算した製品から順にNDJSONで返す（並び順は製品ごと）
+        def generate():
+            for item in plan_rows():
+                del item["planned_datetime_sort"]
+                yield json.dumps(item, ensure_ascii=False) + "\n"
 
-            result.append({
-                "customer_name": customer_name,
-                "product_code": product_code,
-                "process_name": process.process_name,
-                "po_quantity": total_po_quantity,
-                "planned_datetime": planned_datetime.strftime("%d/%m/%Y %H:%M"),
-                "delivery_date": delivery_date_str,  # 納期（最も近いもの）
-                "planned_datetime_sort": planned_datetime  # ソート用の日時オブジェクト
-            })
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
 
-            # 次の工程（1つ前の工程番号）の開始日を更新
-            current_date = planned_datetime.date()
+    result = list(plan_rows())
 
     # 生産計画日時で昇順にソート（早い日時が上）
     result.sort(key=lambda x: x["planned_datetime_sort"])
@@ -783,8 +792,29 @@ async def generate_production_schedule(
     - makespan（全体の生産完了時刻）を最小化
     - PRESS機の割当最適化
     - 休日カレンダーを考慮
+    - strategy でスケジューリング戦略を指定可能（デフォルト: by_deadline）
+    - trace: true で割当判断を記録し、run_id を返す
+      （GET /production-schedule/runs/{run_id}/trace で参照）
     """
     working_hours = request.get("working_hours", 8)
+    strategy = request.get("strategy") or DEFAULT_STRATEGY
+    enable_trace = bool(request.get("trace", False))
+
+    if strategy not in SCHEDULING_STRATEGIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown strategy: {strategy}. Available: {', '.join(SCHEDULING_STRATEGIES.keys())}"
+        )
+
+    trace_capacity = request.get("trace_capacity", DEFAULT_TRACE_CAPACITY)
+    if enable_trace:
+        if not isinstance(trace_capacity, int) or isinstance(trace_capacity, bool):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="trace_capacity must be an integer"
+            )
+        # 記録数は 1〜MAX_TRACE_CAPACITY に丸める
+        trace_capacity = min(max(1, trace_capacity), MAX_TRACE_CAPACITY)
 
     # リソース制約設定（将来の拡張用）
     resource_constraints = request.get("resource_constraints", None)
@@ -792,16 +822,28 @@ async def generate_production_schedule(
     # スケジューラーを初期化
     scheduler = ProductionScheduler(db, working_hours, resource_constraints)
 
+    run_id = None
+    if enable_trace:
+        run_id, scheduler.trace = start_trace(trace_capacity)
+
     # スケジュールを生成
     try:
-        result = scheduler.generate_schedule(user_id=current_user.get("username"))
+        result = scheduler.generate_schedule(user_id=current_user.get("username"), strategy=strategy)
         makespan = scheduler.calculate_makespan()
 
+        plan_version = publish_plan_version(
+            db, strategy, working_hours, len(result['all_schedules']), current_user.get("username")
+        )
+
         return {
             "success": True,
+            "strategy": strategy,
+            "run_id": run_id,
+            "plan_version_id": plan_version.plan_version_id,
             "constrained_schedules_count": len(result['constrained_schedules']),
             "unconstrained_schedules_count": len(result['unconstrained_schedules']),
             "total_schedules_count": len(result['all_schedules']),
+            "unscheduled_processes": result.get('unscheduled_processes', []),
             "makespan": makespan.isoformat() if makespan else None,
             "message": f"{len(result['all_schedules'])}件のスケジュールを生成しました（制約あり: {len(result['constrained_schedules'])}件、並行実行: {len(result['unconstrained_schedules'])}件）"
         }
@@ -814,14 +856,257 @@ async def generate_production_schedule(
         )
 
 
+@router.get("/production-schedule/runs/{run_id}/trace")
+async def get_production_schedule_trace(
+    run_id: str,
+    product_code: Optional[str] = None,
+    process_id: Optional[int] = None,
+    machine_list_id: Optional[int] = None,
+    kind: Optional[str] = None,
+    limit: int = 500,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    計画生成時の割当判断トレースを取得
+
+    - 候補機械（開始可能時刻・終了見込み）、選択した機械、段取り判断、締切日順位
+    - kind: press_assign（by_deadline・old）、mold_blocked（by_deadline）、constrained_assign / constrained_continue（v2）
+    - 直近の実行分のみ保持（サーバー再起動で消える）
+    """
+    trace = get_trace(run_id)
+    if trace is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Trace not found: {run_id}"
+        )
+
+    return {
+        "run_id": run_id,
+        "created_at": trace.created_at.isoformat(),
+        "recorded_count": trace.total,
+        "retained_count": len(trace),
+        "capacity": trace.capacity,
+        "entries": trace.query(
+            product_code=product_code,
+            process_id=process_id,
+            machine_list_id=machine_list_id,
+            kind=kind,
+            limit=limit
+        )
+    }
+
+
+@router.get("/production-schedule/strategies")
+async def get_scheduling_strategies(
+    current_user: dict = Depends(get_current_user)
+):
+    """登録済みのスケジューリング戦略一覧を取得"""
+    return [
+        {
+            "name": name,
+            "description": description,
+            "is_default": name == DEFAULT_STRATEGY
+        }
+        for name, (_, description) in SCHEDULING_STRATEGIES.items()
+    ]
+
+
+@router.post("/production-schedule/strategies/compare")
+def compare_production_schedule_strategies(
+    request: dict,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    登録済みの全戦略を同じデータで実行して比較
+
+    実行時間・ピークメモリ・makespan・納期遅れを返す
+    各戦略は production_schedule の一時テーブル上で実行されるため、公開済みの計画は変更されない
+    - CPU負荷の高い処理のため同期関数とし、スレッドプールで実行する
+    """
+    from ..services.strategy_benchmark import compare_scheduling_strategies
+
+    strategies = request.get("strategies")
+    if strategies:
+        unknown = [s for s in strategies if s not in SCHEDULING_STRATEGIES]
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown strategy: {', '.join(unknown)}"
+            )
+
+    results = compare_scheduling_strategies(
+        working_hours=request.get("working_hours", 8),
+        resource_constraints=request.get("resource_constraints", None),
+        strategies=strategies
+    )
+
+    return {
+        "success": True,
+        "results": results
+    }
+
+
+@router.post("/production-schedule/simulate")
+def simulate_production_schedule(
+    request: dict,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    公開済み生産計画のロバスト性をモンテカルロ法でシミュレーション
+
+    - プレス機故障、サイクルタイムのばらつき、金型故障をランダムに発生させて計画を再生
+    - POごとの納期遵守確率と遅延日数の分布を返す（納期遵守確率の低い順）
+    - CPU負荷の高い処理のため同期関数とし、スレッドプールで実行する（イベントループを止めない）
+    """
+    from ..services.plan_simulator import PlanSimulator
+
+    working_hours = request.get("working_hours", 8)
+    trials = request.get("trials", 1000)
+
+    if not isinstance(trials, int) or trials < 1 or trials > 10000:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="trials must be between 1 and 10000"
+        )
+
+    rate_params = {
+        "machine_breakdowns_per_day": request.get("machine_breakdowns_per_day", 0.05),
+        "machine_repair_hours": request.get("machine_repair_hours", 2.0),
+        "cycle_time_cv": request.get("cycle_time_cv", 0.1),
+    }
+    for name, value in rate_params.items():
+        if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value) or value < 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"{name} must be a number of 0 or more"
+            )
+
+    workers = request.get("workers")
+    if workers is not None and (not isinstance(workers, int) or isinstance(workers, bool) or workers < 1):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="workers must be 1 or more"
+        )
+
+    simulator = PlanSimulator(db, working_hours=working_hours)
+
+    try:
+        return simulator.run(
+            trials=trials,
+            seed=request.get("seed"),
+            workers=workers,
+            **rate_params
+        )
+    except Exception as e:
+        logger.exception("計画シミュレーションに失敗")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"計画シミュレーションに失敗しました: {str(e)}"
+        )
+
+
+@router.get("/production-schedule/progress")
+def get_production_schedule_progress(
+    drift_threshold_minutes: Optional[int] = None,
+    machine_list_ids: Optional[List[int]] = Query(None),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    加工中タスクの実績（ショット数）と終了見込み・計画とのずれ
+
+    ずれが閾値以上の機械について、後続タスクの置き直し案（moved）と
+    他の機械の後工程との重なり（conflicts）も返す（計画は変更しない）
+    - DBアクセスと計算がブロッキングのため同期関数とし、スレッドプールで実行する
+    """
+    try:
+        return run_schedule_feedback(
+            db,
+            drift_threshold_minutes=drift_threshold_minutes,
+            machine_list_ids=machine_list_ids,
+            dry_run=True
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.post("/production-schedule/feedback")
+def apply_production_schedule_feedback(
+    request: dict,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    実績（ショット数）による計画の補正を実行
+
+    - 加工中タスクの終了見込みが計画から drift_threshold_minutes（稼働分）以上ずれた機械の
+      加工中タスクと後続タスクだけを置き直す（計画全体は作り直さない）
+    - 補正した場合は新しい計画バージョンを公開する
+    - dry_run: true で置き直し案のみ返す
+    - GET_LOCK の取得を含むブロッキング処理のため同期関数とし、スレッドプールで実行する
+    """
+    try:
+        return run_schedule_feedback(
+            db,
+            drift_threshold_minutes=request.get("drift_threshold_minutes"),
+            machine_list_ids=request.get("machine_list_ids"),
+            dry_run=bool(request.get("dry_run", False)),
+            user=current_user.get("username")
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except FeedbackConflict as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
+# 列形式レスポンスの列（/production-schedule?format=columnar）
+SCHEDULE_COLUMNS = [
+    ("schedule_id", lambda r: r.schedule_id),
+    ("po_id", lambda r: r.po_id),
+    ("process_id", lambda r: r.process_id),
+    ("machine_list_id", lambda r: r.machine_list_id),
+    ("planned_start_datetime", lambda r: r.planned_start_datetime),
+    ("planned_end_datetime", lambda r: r.planned_end_datetime),
+    ("po_quantity", lambda r: r.po_quantity),
+    ("setup_time", lambda r: float(r.setup_time or 0)),
+    ("processing_time", lambda r: float(r.processing_time or 0)),
+    ("po_number", lambda r: r.po_number),
+    ("product_code", lambda r: r.product_code),
+    ("customer_name", lambda r: r.customer_name),
+    ("process_name", lambda r: r.process_name),
+    ("machine_no", lambda r: r.machine_no),
+]
+SCHEDULE_DICTIONARY_COLUMNS = ("product_code", "customer_name", "process_name", "machine_no")
+
+
 @router.get("/production-schedule", response_model=List[schemas.ProductionSchedule])
 async def get_production_schedule(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 1000,
+    format: str = "json",
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """生産計画スケジュールを取得"""
+    """
+    生産計画スケジュールを取得
+
+    format=columnar の場合は列形式で返す（製品コード、顧客名、工程名、機械番号を含む）
+    """
+    columnar = validate_response_format(format)
+
+    not_modified = check_not_modified(
+        request, response, db, PLAN_TABLES if columnar else (ProductionSchedule.__tablename__,)
+    )
+    if not_modified:
+        return not_modified
+
+    if columnar:
+        rows = query_schedule_details(db, limit=limit, offset=skip)
+        return columnar_response(rows, SCHEDULE_COLUMNS, SCHEDULE_DICTIONARY_COLUMNS, response)
+
     schedules = db.query(ProductionSchedule)\
         .order_by(ProductionSchedule.planned_start_datetime.asc())\
         .offset(skip)\
@@ -833,59 +1118,150 @@ async def get_production_schedule(
 
 @router.get("/production-schedule/detailed")
 async def get_production_schedule_detailed(
+    request: Request,
+    response: Response,
     skip: int = 0,
-    limit: int = 1000,
+    cursor: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=5000, description="1ページの最大件数"),
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """生産計画スケジュールを詳細情報付きで取得"""
-    schedules = db.query(ProductionSchedule)\
-        .join(PO, ProductionSchedule.po_id == PO.po_id)\
-        .join(Product, PO.product_id == Product.product_id)\
-        .join(Customer, Product.customer_id == Customer.customer_id)\
-        .join(Process, ProductionSchedule.process_id == Process.process_id)\
-        .order_by(ProductionSchedule.planned_start_datetime.asc())\
-        .offset(skip)\
-        .limit(limit)\
-        .all()
+    """
+    生産計画スケジュールを詳細情報付きで取得
 
-    result = []
-    for schedule in schedules:
-        po = db.query(PO).filter(PO.po_id == schedule.po_id).first()
-        process = db.query(Process).filter(Process.process_id == schedule.process_id).first()
-        product = db.query(Product).filter(Product.product_id == po.product_id).first()
-        customer = db.query(Customer).filter(Customer.customer_id == product.customer_id).first()
+    - 表示項目は1回のJOINクエリで取得
+    - (planned_start_datetime, schedule_id) のキーセットページング
+      次ページがある場合は X-Next-Cursor ヘッダーのカーソルを cursor に指定する
+    - 従来の skip（件数での読み飛ばし）も使用可能（cursor と併用した場合はカーソルの後から読み飛ばす）
+    """
+    not_modified = check_not_modified(request, response, db, PLAN_TABLES)
+    if not_modified:
+        return not_modified
 
-        machine_name = None
-        machine_list_id_debug = schedule.machine_list_id
+    if skip < 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="skip must be 0 or more"
+        )
 
-        if schedule.machine_list_id:
-            machine = db.query(MachineList).filter(MachineList.machine_list_id == schedule.machine_list_id).first()
-            if machine:
-                machine_name = machine.machine_no
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid cursor: {cursor}"
+            )
 
-        # デバッグ情報をログ出力
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.info(f"Process: {process.process_name}, machine_list_id: {machine_list_id_debug}, machine_name: {machine_name}")
+    rows = query_schedule_details(db, after=after, limit=limit, offset=skip)
+
+    if rows and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].planned_start_datetime, rows[-1].schedule_id)
+
+    return [
+        {
+            "schedule_id": row.schedule_id,
+            "po_number": row.po_number,
+            "customer_name": row.customer_name,
+            "product_code": row.product_code,
+            "process_name": row.process_name,
+            "machine_name": row.machine_no,
+            "machine_list_id": row.machine_list_id,
+            "planned_start_datetime": row.planned_start_datetime.strftime("%d/%m/%Y %H:%M"),
+            "planned_end_datetime": row.planned_end_datetime.strftime("%d/%m/%Y %H:%M"),
+            "po_quantity": row.po_quantity,
+            "setup_time": float(row.setup_time) if row.setup_time else 0,
+            "processing_time": float(row.processing_time) if row.processing_time else 0,
+            "delivery_date": row.delivery_date.strftime("%d/%m/%Y") if row.delivery_date else None,
+        }
+        for row in rows
+    ]
 
-        result.append({
-            "schedule_id": schedule.schedule_id,
-            "po_number": po.po_number,
-            "customer_name": customer.customer_name,
-            "product_code": product.product_code,
-            "process_name": process.process_name,
-            "machine_name": machine_name,
-            "machine_list_id": machine_list_id_debug,  # デバッグ用
-            "planned_start_datetime": schedule.planned_start_datetime.strftime("%d/%m/%Y %H:%M"),
-            "planned_end_datetime": schedule.planned_end_datetime.strftime("%d/%m/%Y %H:%M"),
-            "po_quantity": schedule.po_quantity,
-            "setup_time": float(schedule.setup_time) if schedule.setup_time else 0,
-            "processing_time": float(schedule.processing_time) if schedule.processing_time else 0,
-            "delivery_date": po.delivery_date.strftime("%d/%m/%Y") if po.delivery_date else None,
-        })
 
-    return result
+@router.get("/production-schedule/gantt")
+async def get_production_schedule_gantt(
+    start_date: date,
+    end_date: date,
+    resolution: str = "day",
+    machine_list_id: Optional[List[int]] = Query(None, description="機械IDでフィルタ（複数指定可）"),
+    working_hours: int = Query(8, ge=1, le=18, description="稼働時間（シフトは6:00から）"),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    ガントチャート用に機械ごと・時間帯ごとの稼働状況を集計して取得
+
+    - resolution: hour / shift / day / week
+    - 時間帯ごとに稼働（加工）・段取り・空きの分数と製品コードを返す
+    """
+    from ..services.gantt import aggregate_gantt
+
+    try:
+        result = aggregate_gantt(
+            db,
+            start_date,
+            end_date,
+            resolution=resolution,
+            machine_list_ids=machine_list_id,
+            working_hours=working_hours
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    return {
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "resolution": resolution,
+        **result
+    }
+
+
+@router.get("/production-schedule/export")
+def export_production_schedule(
+    format: str = "csv",
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    公開済みの生産計画をCSV / XLSXでダウンロード
+
+    PO・製品・顧客・工程・機械の情報付き
+    行はサーバーサイドカーソルで順に読み込むため、件数が多くてもメモリ使用量は一定
+    - XLSXの書き出しはブロッキング処理のため同期関数とし、スレッドプールで実行する
+    """
+    from ..services.schedule_export import iter_schedule_csv, write_schedule_xlsx, export_filename
+
+    if format == "csv":
+        return StreamingResponse(
+            iter_schedule_csv(),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="{export_filename("csv")}"'}
+        )
+
+    if format == "xlsx":
+        # write-only モードで一時ファイルに書き出し、送信後に削除する
+        with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as tmp:
+            path = tmp.name
+        try:
+            write_schedule_xlsx(path)
+        except Exception:
+            os.remove(path)
+            raise
+
+        return FileResponse(
+            path,
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            filename=export_filename("xlsx"),
+            background=BackgroundTask(os.remove, path)
+        )
+
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="format must be 'csv' or 'xlsx'"
+    )
 
 
 @router.delete("/production-schedule")
@@ -897,6 +1273,8 @@ async def delete_production_schedule(
     deleted_count = db.query(ProductionSchedule).delete()
     db.commit()
 
+    publish_plan_version(db, None, 8, 0, current_user.get("username"))
+
     return {
         "success": True,
         "deleted_count": deleted_count,
@@ -1024,6 +1402,10 @@ async def generate_comprehensive_production_plan(
         # 全スケジュールを使用
         all_schedules = result['all_schedules']
 
+        publish_plan_version(
+            db, DEFAULT_STRATEGY, working_hours, len(all_schedules), current_user.get("username")
+        )
+
         # ===== 工程完全性チェック（無効化） =====
         # 注意: 現在、工程完全性チェックは無効化されています
         # 理由: 一部の工程がProcessNameTypesに登録されていても、
@@ -1141,7 +1523,9 @@ async def generate_comprehensive_production_plan(
 
 @router.get("/press-weekly-schedule-from-plan")
 async def get_press_weekly_schedule_from_plan(
-    working_hours: int = 8,
+    request: Request,
+    response: Response,
+    working_hours: int = Query(8, ge=1, le=18, description="稼働時間（シフトは6:00から）"),
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
@@ -1150,279 +1534,28 @@ async def get_press_weekly_schedule_from_plan(
 
     production_scheduleテーブルのPRESS工程のみを抽出し、
     機械ごと・日付ごとにグループ化して返す
+    計画公開時に作成した予定表（計画バージョン単位）を返し、未作成の場合はここで作成する
 
     Args:
-        working_hours: 工場稼働時間（デフォルト: 8時間）
+        working_hours: 工場稼働時間（1〜18時間、デフォルト: 8時間）
     """
-    from datetime import datetime, timedelta
-    from ..services.production_scheduler import ProductionScheduler
-
-    # スケジュールが存在するか確認し、最も早い日付を取得
-    earliest_schedule = db.query(func.min(ProductionSchedule.planned_start_datetime)).scalar()
-    
-    if earliest_schedule:
-        # スケジュールが存在する場合はその日付を開始日とする
-        today = earliest_schedule.date()
-    else:
-        # スケジュールがない場合は今日を開始日とする
-        today = datetime.now(VIETNAM_TZ).date()
-
-    # 今日から7日間の日付リストを作成
-    dates = [(today + timedelta(days=i)).isoformat() for i in range(7)]
-
-    # PRESS機を取得
-    from ..models.factory import MachineList, MachineType
-    press_machines = db.query(MachineList).join(MachineType).filter(
-        MachineType.machine_type_name == 'PRESS'
-    ).order_by(MachineList.machine_no).all()
-
-    # デバッグログ：全スケジュール件数を確認
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    total_count = db.query(ProductionSchedule).count()
-    constrained_count = db.query(ProductionSchedule).filter(ProductionSchedule.machine_list_id.isnot(None)).count()
-    logger.info(f"DEBUG: Total schedules: {total_count}, Constrained (Press): {constrained_count}")
-    logger.info(f"DEBUG: Earliest schedule: {earliest_schedule}, Today set to: {today}")
-
-    # PRESS工程のスケジュールを取得（1週間分）
-    end_date = today + timedelta(days=7)
-    logger.info(f"DEBUG: Query range: {today} to {end_date}")
-    
-    press_schedules = db.query(ProductionSchedule)\
-        .join(Process, ProductionSchedule.process_id == Process.process_id)\
-        .filter(
-            and_(
-                ProductionSchedule.machine_list_id.isnot(None),
-                ProductionSchedule.planned_start_datetime >= today,
-                ProductionSchedule.planned_start_datetime < end_date
-            )
-        )\
-        .order_by(ProductionSchedule.planned_start_datetime.asc())\
-        .all()
-        
-    logger.info(f"DEBUG: Found {len(press_schedules)} press schedules in range")
-
-    # 生産締切日計算用のスケジューラーを初期化
-    scheduler = ProductionScheduler(db, working_hours=working_hours)
-
-    # POごとの生産締切日をキャッシュ（パフォーマンス向上のため）
-    production_deadline_cache = {}
-
-    # 機械ごと、日付ごとのスケジュールを作成
-    schedule_dict = {}
-    for machine in press_machines:
-        schedule_dict[machine.machine_no] = {}
-        for date_str in dates:
-            schedule_dict[machine.machine_no][date_str] = []
-
-    # スケジュールをグループ化（日をまたぐ場合は分割）
-    for schedule in press_schedules:
-        try:
-            # 機械を取得
-            machine = db.query(MachineList).filter(
-                MachineList.machine_list_id == schedule.machine_list_id
-            ).first()
-
-            if not machine:
-                continue
-            
-            # PRESS機械以外はスキップ（TAP, BARREL, PACKINGなど）
-            if not machine.machine_type or machine.machine_type.machine_type_name != 'PRESS':
-                continue
-
-            # POと製品情報を取得
-            po = db.query(PO).filter(PO.po_id == schedule.po_id).first()
-            if not po:
-                continue
-                
-            product = db.query(Product).filter(Product.product_id == po.product_id).first()
-            if not product:
-                continue
-                
-            customer = db.query(Customer).filter(Customer.customer_id == product.customer_id).first()
-
-            # 工程情報を取得
-            process = db.query(Process).filter(Process.process_id == schedule.process_id).first()
-            if not process:
-                continue
-
-            # 開始日と終了日を取得
-            start_date = schedule.planned_start_datetime.date()
-            end_date = schedule.planned_end_datetime.date()
-
-            # 全体の数量（PO数量合計）- 28日ウィンドウロジックを使用
-            po_total_data = scheduler.calculate_po_total_with_28days(product.product_id)
-            total_po_quantity = po_total_data.get('po_total', 0)
-            # もし計算できなかった場合（通常ありえないが）はPO数量を使用
-            if total_po_quantity == 0:
-                total_po_quantity = po.po_quantity
-
-            # 生産締切日を計算（キャッシュを使用）
-            if po.po_id not in production_deadline_cache:
-                # 総加工日数を計算
-                total_days = scheduler.calculate_total_processing_days(product, total_po_quantity)
-                # 生産締切日を計算（納期から逆算）
-                production_deadline = scheduler.calculate_production_deadline(
-                    po.delivery_date,
-                    total_days
-                )
-                production_deadline_cache[po.po_id] = production_deadline
-            else:
-                production_deadline = production_deadline_cache[po.po_id]
-        except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Error processing schedule {schedule.schedule_id}: {str(e)}")
-            continue
-
-        # 日をまたぐ場合は各日ごとに分割
-        current_date = start_date
-        cumulative_quantity = 0  # 累積生産数
-
-        while current_date <= end_date:
-            date_str = current_date.isoformat()
-
-            # 該当する日付の範囲内かチェック
-            if date_str not in dates:
-                current_date = current_date + timedelta(days=1)
-                continue
-
-            # この日の開始時刻と終了時刻を計算
-            # タイムゾーン情報を統一（タイムゾーン非対応に変換）
-            planned_start_naive = schedule.planned_start_datetime.replace(tzinfo=None) if schedule.planned_start_datetime.tzinfo else schedule.planned_start_datetime
-            planned_end_naive = schedule.planned_end_datetime.replace(tzinfo=None) if schedule.planned_end_datetime.tzinfo else schedule.planned_end_datetime
-
-            if current_date == start_date:
-                # 開始日：スケジュールの開始時刻から
-                day_start = planned_start_naive
-            else:
-                # 2日目以降：その日の始業時刻（6:00）から
-                day_start = datetime.combine(current_date, datetime.min.time().replace(hour=6, minute=0))
-
-            if current_date == end_date:
-                # 終了日：スケジュールの終了時刻まで
-                day_end = planned_end_naive
-            else:
-                # 最終日以外：その日の終業時刻（工場稼働時間を参照）
-                # 稼働時間は8-12時間、開始時刻6:00なので終業時刻は14:00-18:00
-                work_end_hour = 6 + working_hours
-                day_end = datetime.combine(current_date, datetime.min.time().replace(hour=work_end_hour, minute=0))
-
-            # この日の作業時間を計算（分）- 休憩時間を除外
-            day_duration_minutes = scheduler.calculate_working_minutes_in_range(day_start, day_end)
-
-            # 総作業時間を計算（全日数分）- 休憩時間を除外
-            total_duration_minutes = scheduler.calculate_working_minutes_in_range(planned_start_naive, planned_end_naive)
-
-            # このスケジュールレコードの数量と加工時間
-            # production_scheduler.pyで保存時にすでにこのスケジュールレコード分の数量が設定されている
-            schedule_quantity = schedule.po_quantity
-            schedule_processing_time = float(schedule.processing_time or 0)
-
-            # この日の生産数と加工時間を計算
-            # スケジュールが1日で完了する場合（start_date == end_date）はそのまま使用
-            # 複数日にまたがる場合のみ作業時間の比率で按分
-            if start_date == end_date:
-                # 1日で完了するスケジュール：そのまま使用
-                day_quantity = schedule_quantity
-                day_processing_time = schedule_processing_time
-            elif total_duration_minutes > 0:
-                # 複数日にまたがるスケジュール：作業時間の比率で按分
-                ratio = day_duration_minutes / total_duration_minutes
-                day_quantity = int(ratio * schedule_quantity)
-                day_processing_time = ratio * schedule_processing_time
-            else:
-                day_quantity = 0
-                day_processing_time = 0
-
-            # 累積生産数を更新
-            cumulative_quantity += day_quantity
-
-            # 最終日の場合、端数調整（累積がスケジュール数量と一致するように）
-            if current_date == end_date:
-                cumulative_quantity = schedule_quantity
-
-            # 段取り時間の計算（初日のみ、工場稼働時間内に収める）
-            initial_setup_range = None
-            final_setup_range = None
-            
-            # 段取り時間は既にスケジュールの計算に含まれているため、
-            # day_startとday_endの範囲内で段取り時間を表示する
-            if current_date == start_date and schedule.setup_time and schedule.setup_time > 0:
-                setup_minutes = float(schedule.setup_time)
-                initial_setup_minutes = setup_minutes * 0.8  # 80%を開始段取り
-                final_setup_minutes = setup_minutes * 0.2    # 20%を終了段取り
-                
-                # 開始段取り：day_startから開始（工場稼働時間内）
-                initial_setup_start = day_start
-                initial_setup_end = day_start + timedelta(minutes=initial_setup_minutes)
-                initial_setup_range = f"{initial_setup_start.strftime('%H:%M')}-{initial_setup_end.strftime('%H:%M')}"
-                
-                # 終了段取り：分割タスクでない場合、または最終日の場合のみ表示
-                # 次の日に持ち越す場合は終了段取りは不要
-                is_final_day = (current_date == end_date)
-                if is_final_day:
-                # 終了段取りはプレス作業終了後（工場稼働時間内）
-                    final_setup_start = day_end - timedelta(minutes=final_setup_minutes)
-                    final_setup_end = day_end
-                    final_setup_range = f"{final_setup_start.strftime('%H:%M')}-{final_setup_end.strftime('%H:%M')}"
-            
-            # デバッグ用ログ
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.info(f"DEBUG - Product: {product.product_code}, Process: {process.process_name}, Date: {current_date}")
-            logger.info(f"  schedule.po_quantity: {schedule.po_quantity}")
-            logger.info(f"  schedule.processing_time: {schedule.processing_time}")
-            logger.info(f"  total_po_quantity: {total_po_quantity}")
-            logger.info(f"  day_quantity: {day_quantity}")
-            logger.info(f"  day_processing_time: {day_processing_time}")
-            logger.info(f"  cumulative_quantity: {cumulative_quantity}")
-            logger.info(f"  day_duration_minutes: {day_duration_minutes}")
-            logger.info(f"  total_duration_minutes: {total_duration_minutes}")
-            
-            # タスク情報を作成
-            task = {
-                "product_code": product.product_code,
-                "customer_name": customer.customer_name,
-                "process_name": process.process_name if process else "-",
-                "process_no": process.process_no if process else 999,  # 工程番号（ソート用）
-                "po_quantity": total_po_quantity,  # PO数量合計
-                "day_quantity": day_quantity,  # この日の生産数
-                "cumulative_quantity": cumulative_quantity,  # 累積生産数
-                "delivery_date": po.delivery_date.strftime("%d/%m/%Y") if po.delivery_date else "-",
-                "production_deadline": production_deadline.strftime("%d/%m/%Y"),  # 生産締切日（納期から逆算した開始日）
-                "planned_end_datetime": planned_end_naive.strftime("%d/%m/%Y %H:%M"),  # 工程終了日時
-                "start_time": day_start.strftime("%H:%M"),
-                "end_time": day_end.strftime("%H:%M"),
-                "setup_time": float(schedule.setup_time) if current_date == start_date else 0,  # 段取りは初日のみ
-                "processing_time": float(day_processing_time),  # この日の実際の加工時間
-                "is_split": start_date != end_date,  # 分割されたタスクかどうか
-                "split_info": f"{(current_date - start_date).days + 1}/{(end_date - start_date).days + 1}" if start_date != end_date else None,
-                "initial_setup_range": initial_setup_range,  # 開始段取り時刻範囲
-                "final_setup_range": final_setup_range  # 終了段取り時刻範囲
-            }
+    from ..services.press_weekly_board import get_press_weekly_board
 
-            schedule_dict[machine.machine_no][date_str].append(task)
+    # 未作成の予定表は今日を開始日として作成するため、日付もETagに含める
+    not_modified = check_not_modified(
+        request, response, db, PLAN_TABLES + (PressWeeklyBoard.__tablename__,),
+        extra=datetime.now(VIETNAM_TZ).date().isoformat()
+    )
+    if not_modified:
+        return not_modified
 
-            # 次の日へ
-            current_date = current_date + timedelta(days=1)
-
-    return {
-        "dates": dates,
-        "machines": [
-            {
-                "machine_no": m.machine_no,
-                "machine_list_id": m.machine_list_id
-            }
-            for m in press_machines
-        ],
-        "schedule": schedule_dict
-    }
+    return get_press_weekly_board(db, working_hours)
 
 
 @router.get("/all-schedule-from-plan")
 async def get_all_schedule_from_plan(
+    request: Request,
+    response: Response,
     working_hours: int = 8,
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
@@ -1434,25 +1567,21 @@ async def get_all_schedule_from_plan(
     製品ごと・工程ごとにグループ化して返す
     """
     from datetime import datetime, timedelta
-    from ..services.production_scheduler import ProductionScheduler
 
     # 今日から7日間
     today = datetime.now(VIETNAM_TZ).date()
     end_date = today + timedelta(days=7)
 
-    # 全工程のスケジュールを取得
-    all_schedules = db.query(ProductionSchedule)\
-        .join(Process, ProductionSchedule.process_id == Process.process_id)\
-        .filter(
-            and_(
-                ProductionSchedule.planned_start_datetime >= today,
-                ProductionSchedule.planned_start_datetime < end_date
-            )
-        )\
-        .all()
+    not_modified = check_not_modified(request, response, db, PLAN_TABLES, extra=today.isoformat())
+    if not_modified:
+        return not_modified
 
-    # 生産締切日計算用のスケジューラーを初期化
-    scheduler = ProductionScheduler(db, working_hours=working_hours)
+    # 全工程のスケジュールを表示項目付きで取得
+    all_schedules = query_schedule_details(db, start_from=today, start_before=end_date)
+
+    # 生産締切日は締切日サービスで計算
+    deadlines = get_plan_deadlines(db)
+    daily_minutes = get_scheduler_working_minutes(working_hours)
 
     # POごとの生産締切日をキャッシュ
     production_deadline_cache = {}
@@ -1461,22 +1590,6 @@ async def get_all_schedule_from_plan(
     product_processes = {}
 
     for schedule in all_schedules:
-        # POと製品情報を取得
-        po = db.query(PO).filter(PO.po_id == schedule.po_id).first()
-        if not po:
-            continue
-
-        product = db.query(Product).filter(Product.product_id == po.product_id).first()
-        if not product:
-            continue
-
-        customer = db.query(Customer).filter(Customer.customer_id == product.customer_id).first()
-
-        # 工程情報を取得
-        process = db.query(Process).filter(Process.process_id == schedule.process_id).first()
-        if not process:
-            continue
-
         # 開始日を取得
         start_date = schedule.planned_start_datetime.date()
 
@@ -1484,35 +1597,36 @@ async def get_all_schedule_from_plan(
         total_po_quantity = schedule.po_quantity
 
         # 生産締切日を計算（キャッシュを使用）
-        if po.po_id not in production_deadline_cache:
-            total_days = scheduler.calculate_total_processing_days(product, total_po_quantity)
-            production_deadline = scheduler.calculate_production_deadline(
-                po.delivery_date,
-                total_days
+        if schedule.po_id not in production_deadline_cache:
+            production_deadline = deadlines.deadline_for(
+                schedule.product_id,
+                schedule.delivery_date,
+                total_po_quantity,
+                working_hours
             )
-            production_deadline_cache[po.po_id] = production_deadline
+            production_deadline_cache[schedule.po_id] = production_deadline
         else:
-            production_deadline = production_deadline_cache[po.po_id]
+            production_deadline = production_deadline_cache[schedule.po_id]
 
         # 製品キー
-        product_key = product.product_code
+        product_key = schedule.product_code
 
         if product_key not in product_processes:
             product_processes[product_key] = {
-                'customer_name': customer.customer_name if customer else '-',
-                'product_code': product.product_code,
+                'customer_name': schedule.customer_name or '-',
+                'product_code': schedule.product_code,
                 'po_quantity': total_po_quantity,
-                'delivery_date': po.delivery_date.strftime("%d/%m/%Y") if po.delivery_date else "-",
+                'delivery_date': schedule.delivery_date.strftime("%d/%m/%Y") if schedule.delivery_date else "-",
                 'production_deadline': production_deadline.strftime("%d/%m/%Y"),
                 'po_numbers': set(),  # PO番号を収集
                 'processes': {}
             }
 
         # PO番号を追加
-        product_processes[product_key]['po_numbers'].add(po.po_number)
+        product_processes[product_key]['po_numbers'].add(schedule.po_number)
 
         # 工程キー（process_nameで識別）
-        process_key = process.process_name
+        process_key = schedule.process_name
 
         # 日付をフォーマット
         date = start_date
@@ -1520,18 +1634,12 @@ async def get_all_schedule_from_plan(
         month = str(date.month).zfill(2)
         formatted_date = f"{day}/{month}"
 
-        # 工程タイプを取得
-        process_type_record = db.query(ProcessNameType).filter(
-            ProcessNameType.process_name == process.process_name
-        ).first()
-
         # 総加工時間を計算
         total_minutes = float(schedule.setup_time or 0) + float(schedule.processing_time or 0)
 
         # タイプに応じて表示値を計算
-        if process_type_record and process_type_record.day_or_spm is False:
+        if schedule.day_or_spm is False:
             # DAY: 日数で表示
-            daily_minutes = scheduler.get_working_minutes(working_hours)
             display_value = round(total_minutes / daily_minutes, 1)  # 小数点1桁
             display_unit = 'D'
         else:
@@ -1558,8 +1666,8 @@ async def get_all_schedule_from_plan(
         else:
             # 新規工程データを追加
             product_processes[product_key]['processes'][process_key] = {
-                'name': process.process_name,
-                'process_no': process.process_no,
+                'name': schedule.process_name,
+                'process_no': schedule.process_no,
                 'date': formatted_date,
                 'date_str': start_date.isoformat(),
                 'display_value': float(display_value),
@@ -1644,60 +1752,68 @@ async def get_unconstrained_schedule(
     プレス機制約なしのスケジュール計算
     
     すべての工程を現在時刻から順次実行し、機械の空き状況を考慮しない理論的なスケジュールを返す
+
+    - 対象PO（製品・顧客を含む）と工程（工程タイプを含む）はそれぞれ1クエリで取得
+    - 稼働時間の加算はスケジューラーの休日キャッシュ上で行い、
+      同じ製品・数量の工程表は1回だけ計算する（全POが同じ現在時刻から始まるため）
     """
     from ..services.production_scheduler import ProductionScheduler
     
     # スケジューラー初期化
     scheduler = ProductionScheduler(db, working_hours=working_hours)
+    deadlines = get_plan_deadlines(db)
+    daily_minutes = scheduler.get_working_minutes(working_hours)
    
     # 今週のPOを取得（生産対象）
     today = datetime.now(VIETNAM_TZ).date()
     end_of_week = today + timedelta(days=7)
     
-    target_pos = db.query(PO).filter(
+    target_pos = db.query(
+        PO.po_number,
+        PO.po_quantity,
+        PO.delivery_date,
+        Product.product_id,
+        Product.product_code,
+        Customer.customer_name
+    ).join(
+        Product, PO.product_id == Product.product_id
+    ).outerjoin(
+        Customer, Product.customer_id == Customer.customer_id
+    ).filter(
         and_(
             PO.delivery_date >= today,
             PO.delivery_date <= end_of_week
         )
-    ).all()
+    ).order_by(PO.po_id).all()
+
+    # 製品の全工程（工程タイプ付き）をまとめて取得
+    process_chains = load_process_chains(db, {po.product_id for po in target_pos})
     
     # 製品ごとのデータを作成
     product_processes = {}
     current_time = scheduler.get_vietnam_now()
-    
-    for po in target_pos:
-        product = db.query(Product).filter(Product.product_id == po.product_id).first()
-        if not product:
-            continue
-            
-        customer = db.query(Customer).filter(Customer.customer_id == product.customer_id).first()
-        
-        # 製品の全工程を取得
-        processes = db.query(Process).filter(
-            Process.product_id == product.product_id
-        ).order_by(Process.process_no).all()
-        
-        product_key = product.product_code
-        
-        if product_key not in product_processes:
-            product_processes[product_key] = {
-                'customer_name': customer.customer_name if customer else '-',
-                'product_code': product.product_code,
-                'po_quantity': po.po_quantity,
-                'delivery_date': po.delivery_date.strftime("%d/%m/%Y") if po.delivery_date else "-",
-                'po_numbers': {po.po_number},
-                'processes': {},
-                'production_deadline': ''
-            }
-        else:
-            product_processes[product_key]['po_numbers'].add(po.po_number)
-        
-        # 各工程を順次計算（現在時刻から）
+
+    # (product_id, 数量) ごとの工程表 [(工程キー, 工程データ), ...]
+    chain_layouts = {}
+
+    def layout_chain(product_id: int, quantity: int):
+        """製品の工程を現在時刻から順次並べる"""
+        layout = []
         work_start = current_time
-        
-        for process in processes:
+
+        for row in process_chains.get(product_id, []):
+            process = row.Process
+
             # 工程時間を計算
-            setup_time, processing_time = scheduler.calculate_process_time(process, po.po_quantity)
+            setup_time, processing_time = estimate_process_minutes(
+                row.day_or_spm,
+                quantity,
+                process.setup_time,
+                process.rough_cycletime,
+                process.production_limit,
+                process.rough_cycletime,
+                daily_minutes
+            )
             total_minutes = setup_time + processing_time
             
             if total_minutes == 0:
@@ -1708,44 +1824,61 @@ async def get_unconstrained_schedule(
             
             # 開始日をフォーマット
             start_date = work_start.date()
-            day = str(start_date.day).zfill(2)
-            month = str(start_date.month).zfill(2)
-            formatted_date = f"{day}/{month}"
-            
-            # 工程タイプを取得
-            process_type_record = db.query(ProcessNameType).filter(
-                ProcessNameType.process_name == process.process_name
-            ).first()
+            formatted_date = f"{str(start_date.day).zfill(2)}/{str(start_date.month).zfill(2)}"
             
             # タイプに応じて表示値を計算
-            if process_type_record and process_type_record.day_or_spm is False:
+            if row.day_or_spm is False:
                 # DAY: 日数で表示
-                daily_minutes = scheduler.get_working_minutes(working_hours)
                 display_value = round(total_minutes / daily_minutes, 1)
                 display_unit = 'D'
             else:
                 # SPM: 時間で表示
                 display_value = round(total_minutes / 60)
                 display_unit = 'H'
-            
-            # 工程データを追加
-            process_key = process.process_name
-            if process_key in product_processes[product_key]['processes']:
-                existing = product_processes[product_key]['processes'][process_key]
-                existing['display_value'] = float(existing['display_value']) + float(display_value)
-            else:
-                product_processes[product_key]['processes'][process_key] = {
-                    'name': process.process_name,
-                    'process_no': process.process_no,
-                    'date': formatted_date,
-                    'date_str': start_date.isoformat(),
-                    'display_value': float(display_value),
-                    'display_unit': display_unit,
-                    'latest_end_date': work_end.isoformat()
-                }
+
+            layout.append((row.process_name, {
+                'name': row.process_name,
+                'process_no': process.process_no,
+                'date': formatted_date,
+                'date_str': start_date.isoformat(),
+                'display_value': float(display_value),
+                'display_unit': display_unit,
+                'latest_end_date': work_end.isoformat()
+            }))
             
             # 次の工程の開始時刻を更新
             work_start = work_end
+
+        return layout
+    
+    for po in target_pos:
+        product_key = po.product_code
+        
+        if product_key not in product_processes:
+            product_processes[product_key] = {
+                'customer_name': po.customer_name or '-',
+                'product_code': po.product_code,
+                'po_quantity': po.po_quantity,
+                'delivery_date': po.delivery_date.strftime("%d/%m/%Y") if po.delivery_date else "-",
+                'po_numbers': {po.po_number},
+                'processes': {},
+                'production_deadline': ''
+            }
+        else:
+            product_processes[product_key]['po_numbers'].add(po.po_number)
+
+        layout_key = (po.product_id, po.po_quantity)
+        if layout_key not in chain_layouts:
+            chain_layouts[layout_key] = layout_chain(po.product_id, po.po_quantity)
+        
+        # 工程データを追加（同じ工程名は表示値を合算）
+        processes = product_processes[product_key]['processes']
+        for process_key, process_data in chain_layouts[layout_key]:
+            if process_key in processes:
+                existing = processes[process_key]
+                existing['display_value'] = float(existing['display_value']) + process_data['display_value']
+            else:
+                processes[process_key] = dict(process_data)
     
     # 総加工時間と生産締切日を計算
     for product_data in product_processes.values():
@@ -1784,7 +1917,7 @@ async def get_unconstrained_schedule(
         # 生産締切日を計算
         total_processing_days = total_days + (total_hours / 8)  # 8時間=1日と仮定
         delivery_date_obj = datetime.strptime(product_data['delivery_date'], "%d/%m/%Y").date()
-        production_deadline = scheduler.calculate_production_deadline(delivery_date_obj, total_processing_days)
+        production_deadline = deadlines.production_deadline(delivery_date_obj, total_processing_days)
         product_data['production_deadline'] = production_deadline.strftime("%d/%m/%Y")
     
     # リスト形式に変換
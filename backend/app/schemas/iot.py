@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 from typing import Optional
 from datetime import datetime
 
@@ -22,13 +22,53 @@ class IotButtonEvent(IotButtonEventBase):
         from_attributes = True
 
 
+class IotButtonEventBatchItem(BaseModel):
+    button_name: str = Field(max_length=100)
+    raspi_no: Optional[str] = Field(None, max_length=100)
+    note: Optional[str] = None
+    # クライアントが付けるイベントID（再送時も同じ値、省略時は pressed_at と button_name で重複排除）
+    event_id: Optional[str] = Field(None, max_length=64)
+    pressed_at: Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def require_dedupe_key(self):
+        if not self.event_id and self.pressed_at is None:
+            raise ValueError("event_id or pressed_at is required")
+        return self
+
+
+class IotButtonEventBatchIn(BaseModel):
+    # イベントに raspi_no がない場合に使う
+    raspi_no: Optional[str] = Field(None, max_length=100)
+    events: list[IotButtonEventBatchItem]
+
+
+class IotButtonEventBatchOut(BaseModel):
+    status: str = "ok"
+    received: int
+    inserted: int
+    duplicates: int
+
+
+class IotButtonCounter(BaseModel):
+    raspi_no: Optional[str] = None
+    button_name: str
+    event_count: int
+    last_pressed_at: Optional[datetime] = None
+
+
+# iot_press_events.ts_ms（BIGINT）の上限
+MAX_TS_MS = 2**63 - 1
+
+
 # Press-raspi互換スキーマ
 class IotPressEventItem(BaseModel):
-    ts_ms: int
+    ts_ms: int = Field(ge=0, le=MAX_TS_MS)
 
 
 class IotPressEventIn(BaseModel):
-    raspi_no: str = "unknown"
+    # iot_press_events.raspi_no の長さ
+    raspi_no: str = Field("unknown", max_length=50)
     events: list[IotPressEventItem]
 
 
@@ -41,6 +81,14 @@ class IotPressEventsResponse(BaseModel):
     events: list[int]
 
 
+class IotPressTimelineResponse(BaseModel):
+    start_ms: int
+    bucket_ms: int
+    points: int
+    # ラズパイ番号ごとのショット数（start_ms から bucket_ms ごと、長さは points）
+    series: dict[str, list[int]]
+
+
 class IotPressEventRaw(BaseModel):
     id: int
     ts_ms: int
@@ -0,0 +1,285 @@
+"""
+生産締切日サービス
+
+製品ごとの需要（最も近い納期から28日以内の未配送PO）、生産数（PO数合計 - 未出荷在庫）、
+総加工日数、生産締切日を全製品まとめて計算し、プロセス内にキャッシュする
+
+- キャッシュは table_change_counters のバージョン（PO・製品・工程・工程タイプ・完成品・休日）で
+  無効化し、変更がなければリクエストをまたいで再利用する
+- 稼働時間に依存する総加工日数と締切日は稼働時間ごとに初回参照時に計算する
+- キャッシュするのはIDと値のみ（ORMオブジェクトはセッションに紐づくため持たない）
+
+スケジューラー（get_target_products_with_pos / get_target_pos_sorted_by_deadline）、
+進捗確認テーブル、生産計画の逆算、計画の読込（週間予定表・全工程スケジュール）はここから読む
+"""
+
+from collections import namedtuple
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+import logging
+import math
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..models import PO, Product, Process, ProcessNameType, FinishedProduct, Calendar
+from ..utils.conditional_get import get_table_versions
+from .plan_inputs import load_po_demand, load_holiday_set, WorkingDayIndex
+
+logger = logging.getLogger(__name__)
+
+# 実稼働分数マップ（休憩時間を除いた実作業時間）
+# 休憩時間帯は ProductionScheduler.add_working_time で自動的にスキップされる
+# - 昼休憩: 10:00-10:40（40分）- 全稼働時間
+# - 追加休憩: 14:00-14:30（30分）- 11時間以上稼働の場合のみ
+WORKING_MINUTES_MAP = {
+    8: 440,   # 8時間稼働（6:00-14:00）、実稼働440分（昼休憩40分除く）
+    9: 500,   # 9時間稼働（6:00-15:00）、実稼働500分（昼休憩40分除く）
+    10: 560,  # 10時間稼働（6:00-16:00）、実稼働560分（昼休憩40分除く）
+    11: 590,  # 11時間稼働（6:00-17:00）、実稼働590分（昼休憩40分+追加休憩30分除く）
+    12: 650,  # 12時間稼働（6:00-18:00）、実稼働650分（昼休憩40分+追加休憩30分除く）
+}
+
+# SPM工程の安全係数
+SPM_SAFETY_FACTOR = Decimal("0.7")
+
+# 締切日の計算に使うテーブル（いずれかが変更されるとキャッシュを作り直す）
+DEADLINE_TABLES = (
+    PO.__tablename__,
+    Product.__tablename__,
+    Process.__tablename__,
+    ProcessNameType.__tablename__,
+    FinishedProduct.__tablename__,
+    Calendar.__tablename__,
+)
+
+# カウンターを経由しない変更（直接のSQL更新など）に備えた最大保持時間（秒）
+DEADLINE_CACHE_TTL_SECONDS = 600
+
+# 締切日の逆算で稼働日インデックスを作る期間（最も早い納期から遡る日数）
+DEADLINE_LOOKBACK_DAYS = 366
+
+# 締切日計算用の工程情報
+ProcessSpec = namedtuple(
+    "ProcessSpec",
+    "process_id process_no process_name day_or_spm setup_time rough_cycletime production_limit"
+)
+
+
+def get_working_minutes(hours: int) -> int:
+    """稼働時間から実稼働分数を計算（休憩時間を除く）"""
+    return WORKING_MINUTES_MAP.get(hours, hours * 60)
+
+
+def estimate_process_minutes(
+    day_or_spm: Optional[bool],
+    quantity: int,
+    setup_time,
+    rate,
+    production_limit,
+    rough_cycletime,
+    daily_minutes: int
+) -> Tuple[float, float]:
+    """
+    工程の所要時間を計算
+
+    Args:
+        day_or_spm: 工程タイプ（True: SPM、False: DAY、None: 不明）
+        rate: SPM工程の生産レート（1分間あたりの生産数）
+        daily_minutes: 1日の実稼働分数（DAY工程の日数を分に変換）
+
+    Returns: (setup_time分, processing_time分)
+    """
+    setup_minutes = float(setup_time or 0)
+
+    if day_or_spm is True:  # SPM
+        # 処理時間（分） = 数量 ÷ (SPM × 安全係数)
+        if not rate:
+            return setup_minutes, 0
+        effective_spm = rate * SPM_SAFETY_FACTOR
+        return setup_minutes, float(Decimal(quantity) / effective_spm)
+
+    if day_or_spm is False:  # DAY
+        # rough_cycletime日で production_limit 個生産できる
+        if not production_limit:
+            return setup_minutes, 0
+        cycles_needed = math.ceil(quantity / production_limit)
+        days_per_cycle = float(rough_cycletime) if rough_cycletime else 1
+        return setup_minutes, cycles_needed * days_per_cycle * daily_minutes
+
+    # タイプが不明な場合
+    return setup_minutes, 0
+
+
+class PlanDeadlines:
+    """
+    製品ごとの需要と生産締切日のスナップショット
+
+    demand: {product_id: {
+        'earliest_delivery_date': date, 'earliest_po_id': int,
+        'total_po_quantity': int, 'po_ids': [int, ...], 'po_numbers': [str, ...],  # 納期順
+        'unshipped_finished': int, 'production_quantity': int, 'is_active': bool
+    }}
+    chains: {product_id: [ProcessSpec, ...]}（工程番号順）
+    """
+
+    def __init__(self, version: str, demand: Dict[int, Dict], chains: Dict[int, List[ProcessSpec]], holidays: set):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.demand = demand
+        self.chains = chains
+        self.holidays = holidays
+
+        delivery_dates = [d['earliest_delivery_date'] for d in demand.values()]
+        today = date.today()
+        self.working_days = WorkingDayIndex(
+            holidays,
+            min(delivery_dates + [today]) - timedelta(days=DEADLINE_LOOKBACK_DAYS),
+            max(delivery_dates + [today])
+        )
+
+        self._lock = threading.Lock()
+        self._deadlines_by_hours: Dict[int, Dict[int, Dict]] = {}
+        self._total_days_memo: Dict[Tuple[int, int, int], float] = {}
+
+    def process_details(self, product_id: int, quantity: int, working_hours: int) -> List[Dict]:
+        """各工程の所要時間（ProductionScheduler.calculate_all_processes_deadline と同じ形式）"""
+        daily_minutes = get_working_minutes(working_hours)
+        details = []
+        for spec in self.chains.get(product_id, []):
+            setup_time, processing_time = estimate_process_minutes(
+                spec.day_or_spm, quantity, spec.setup_time, spec.rough_cycletime,
+                spec.production_limit, spec.rough_cycletime, daily_minutes
+            )
+            details.append({
+                'process_no': spec.process_no,
+                'process_name': spec.process_name,
+                'setup_time': setup_time,
+                'processing_time': processing_time,
+                'total_time': setup_time + processing_time
+            })
+        return details
+
+    def total_processing_days(self, product_id: int, quantity: int, working_hours: int) -> float:
+        """製品の総加工日数（小数点あり）"""
+        key = (product_id, quantity, working_hours)
+        total_days = self._total_days_memo.get(key)
+        if total_days is None:
+            total_minutes = sum(d['total_time'] for d in self.process_details(product_id, quantity, working_hours))
+            total_days = total_minutes / get_working_minutes(working_hours)
+            self._total_days_memo[key] = total_days
+        return total_days
+
+    def production_deadline(self, delivery_date: date, total_days: float) -> date:
+        """納期から総加工日数（端数切り上げ）の稼働日を遡った日付"""
+        return self.working_days.subtract_working_days(delivery_date, math.ceil(total_days))
+
+    def deadline_for(self, product_id: int, delivery_date: date, quantity: int, working_hours: int) -> date:
+        """指定した納期・数量での生産締切日"""
+        return self.production_deadline(
+            delivery_date, self.total_processing_days(product_id, quantity, working_hours)
+        )
+
+    def product_deadlines(self, working_hours: int) -> Dict[int, Dict]:
+        """
+        全製品の総加工日数と生産締切日（稼働時間ごとに1回だけ計算）
+
+        Returns: {product_id: {'total_days': float, 'deadline': date, 'process_details': [...]}}
+        """
+        deadlines = self._deadlines_by_hours.get(working_hours)
+        if deadlines is not None:
+            return deadlines
+
+        with self._lock:
+            deadlines = self._deadlines_by_hours.get(working_hours)
+            if deadlines is None:
+                daily_minutes = get_working_minutes(working_hours)
+                deadlines = {}
+                for product_id, demand in self.demand.items():
+                    details = self.process_details(product_id, demand['production_quantity'], working_hours)
+                    total_days = sum(d['total_time'] for d in details) / daily_minutes
+                    deadlines[product_id] = {
+                        'total_days': total_days,
+                        'deadline': self.production_deadline(demand['earliest_delivery_date'], total_days),
+                        'process_details': details,
+                    }
+                self._deadlines_by_hours[working_hours] = deadlines
+        return deadlines
+
+
+def load_plan_deadlines(db: Session, version: str = "") -> PlanDeadlines:
+    """需要・在庫・工程・休日を集合クエリで読み込み、スナップショットを作成"""
+    demand = load_po_demand(db)
+
+    unshipped = dict(
+        db.query(FinishedProduct.product_id, func.sum(FinishedProduct.finished_quantity))
+        .filter(FinishedProduct.is_shipped == False)
+        .group_by(FinishedProduct.product_id)
+        .all()
+    )
+    active_product_ids = {
+        row.product_id for row in db.query(Product.product_id).filter(Product.is_active == True).all()
+    }
+
+    for product_id, entry in demand.items():
+        unshipped_finished = int(unshipped.get(product_id) or 0)
+        entry['earliest_po_id'] = entry['po_ids'][0]
+        entry['unshipped_finished'] = unshipped_finished
+        entry['production_quantity'] = max(0, entry['total_po_quantity'] - unshipped_finished)
+        entry['is_active'] = product_id in active_product_ids
+
+    chains: Dict[int, List[ProcessSpec]] = {}
+    rows = db.query(
+        Process.product_id,
+        Process.process_id,
+        Process.process_no,
+        ProcessNameType.process_name,
+        ProcessNameType.day_or_spm,
+        Process.setup_time,
+        Process.rough_cycletime,
+        Process.production_limit
+    ).outerjoin(
+        ProcessNameType, Process.process_name_id == ProcessNameType.process_name_id
+    ).order_by(Process.product_id, Process.process_no).all()
+    for row in rows:
+        chains.setdefault(row.product_id, []).append(ProcessSpec(
+            row.process_id, row.process_no, row.process_name, row.day_or_spm,
+            row.setup_time, row.rough_cycletime, row.production_limit
+        ))
+
+    return PlanDeadlines(version, demand, chains, load_holiday_set(db))
+
+
+_cache_lock = threading.Lock()
+_cached_deadlines: Optional[PlanDeadlines] = None
+
+
+def get_plan_deadlines(db: Session) -> PlanDeadlines:
+    """
+    キャッシュ済みのスナップショットを取得
+
+    データのバージョンが変わった場合、または保持時間を過ぎた場合は読み込み直す
+    """
+    global _cached_deadlines
+
+    version, _ = get_table_versions(db, DEADLINE_TABLES)
+    cached = _cached_deadlines
+    if (
+        cached is not None
+        and cached.version == version
+        and time.monotonic() - cached.loaded_at < DEADLINE_CACHE_TTL_SECONDS
+    ):
+        return cached
+
+    started = time.monotonic()
+    deadlines = load_plan_deadlines(db, version)
+    logger.info(
+        f"締切日スナップショット作成: {len(deadlines.demand)}製品, "
+        f"{time.monotonic() - started:.2f}秒 (version={version})"
+    )
+    with _cache_lock:
+        _cached_deadlines = deadlines
+    return deadlines
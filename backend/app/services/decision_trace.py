@@ -0,0 +1,143 @@
+"""
+スケジューラーの判断トレース
+
+計画生成時の割当判断（候補機械、選択した機械、段取り判断、締切日順位）を
+固定長のリングバッファに記録する（オプトイン）
+
+- 無効時はスケジューラー側で `if self.trace is not None` の判定のみ
+- 1件はタプルで保持し、参照時にdictへ変換する
+- 直近の実行分のみプロセス内に保持する（ワーカー間では共有されない）
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import threading
+import uuid
+
+# 1件のフィールド順（record() の引数順と一致）
+TRACE_FIELDS = (
+    'seq',
+    'kind',
+    'product_code',
+    'process_id',
+    'process_name',
+    'deadline_rank',
+    'deadline',
+    'candidates',
+    'chosen_machine_id',
+    'planned_start',
+    'planned_end',
+    'setup_minutes',
+    'setup_postponed',
+)
+
+DEFAULT_TRACE_CAPACITY = 10000
+# 1実行あたりの最大記録数（MAX_TRACE_RUNS 件分を保持してもメモリを使いすぎない範囲）
+MAX_TRACE_CAPACITY = 100000
+
+# 保持する実行数
+MAX_TRACE_RUNS = 20
+
+
+class DecisionTrace:
+    """固定長リングバッファ（古い記録から上書き）"""
+
+    def __init__(self, capacity: int = DEFAULT_TRACE_CAPACITY):
+        self.capacity = min(max(1, int(capacity)), MAX_TRACE_CAPACITY)
+        self._entries: List[Optional[Tuple]] = [None] * self.capacity
+        self._next = 0
+        self.total = 0
+        self.created_at = datetime.now()
+
+    def record(
+        self,
+        kind: str,
+        product_code: Optional[str],
+        process_id: Optional[int],
+        process_name: Optional[str],
+        deadline_rank: Optional[int],
+        deadline,
+        candidates: Optional[List[Tuple]],
+        chosen_machine_id: Optional[int],
+        planned_start: Optional[datetime],
+        planned_end: Optional[datetime],
+        setup_minutes: float,
+        setup_postponed: bool
+    ):
+        """判断を1件記録"""
+        self._entries[self._next] = (
+            self.total, kind, product_code, process_id, process_name,
+            deadline_rank, deadline, candidates, chosen_machine_id,
+            planned_start, planned_end, setup_minutes, setup_postponed,
+        )
+        self._next = (self._next + 1) % self.capacity
+        self.total += 1
+
+    def __len__(self) -> int:
+        return min(self.total, self.capacity)
+
+    def entries(self) -> List[Tuple]:
+        """保持している記録を古い順に返す"""
+        if self.total <= self.capacity:
+            return self._entries[:self.total]
+        return self._entries[self._next:] + self._entries[:self._next]
+
+    def query(
+        self,
+        product_code: Optional[str] = None,
+        process_id: Optional[int] = None,
+        machine_list_id: Optional[int] = None,
+        kind: Optional[str] = None,
+        limit: int = 500
+    ) -> List[Dict]:
+        """条件で絞り込んでdictのリストで返す"""
+        result = []
+        for entry in self.entries():
+            if product_code is not None and entry[2] != product_code:
+                continue
+            if process_id is not None and entry[3] != process_id:
+                continue
+            if machine_list_id is not None and entry[8] != machine_list_id:
+                continue
+            if kind is not None and entry[1] != kind:
+                continue
+
+            item = dict(zip(TRACE_FIELDS, entry))
+            item['candidates'] = [
+                {
+                    'machine_list_id': c[0],
+                    'available_start': c[1].isoformat() if c[1] else None,
+                    'estimated_finish': c[2].isoformat() if c[2] else None,
+                }
+                for c in (entry[7] or [])
+            ]
+            for key in ('planned_start', 'planned_end', 'deadline'):
+                if item[key] is not None:
+                    item[key] = item[key].isoformat()
+            result.append(item)
+
+            if len(result) >= limit:
+                break
+        return result
+
+
+_trace_runs: "OrderedDict[str, DecisionTrace]" = OrderedDict()
+_trace_lock = threading.Lock()
+
+
+def start_trace(capacity: int = DEFAULT_TRACE_CAPACITY) -> Tuple[str, DecisionTrace]:
+    """新しい実行のトレースを作成して登録"""
+    run_id = uuid.uuid4().hex[:12]
+    trace = DecisionTrace(capacity)
+    with _trace_lock:
+        _trace_runs[run_id] = trace
+        while len(_trace_runs) > MAX_TRACE_RUNS:
+            _trace_runs.popitem(last=False)
+    return run_id, trace
+
+
+def get_trace(run_id: str) -> Optional[DecisionTrace]:
+    """実行IDからトレースを取得"""
+    with _trace_lock:
+        return _trace_runs.get(run_id)
@@ -0,0 +1,253 @@
+"""
+ガントチャート用の時間帯別集計
+
+指定期間を時間帯（hour / shift / day / week）に区切り、機械ごとに
+稼働（加工）・段取り・空きの分数と製品コードを集計する
+
+- 時刻は基準日（期間開始日、またはそれより前に始まるタスクの開始日）0:00からの整数分で扱う
+- 稼働時間帯（6:00〜終業、休憩・休日を除く）は1分単位の累積和で持ち、
+  任意区間の稼働分数を引き算で求める
+- 段取りはタスク開始からの稼働時間の先頭 setup_time 分とみなす（プレス週間予定表と同じ）
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+
+from ..models import PO, Product, ProductionSchedule
+from ..models.factory import MachineList, MachineType
+from .plan_inputs import load_holiday_set
+
+GANTT_RESOLUTIONS = ('hour', 'shift', 'day', 'week')
+
+# 1機械あたりの最大時間帯数
+MAX_GANTT_BUCKETS = 2000
+
+WORK_START_HOUR = 6
+# 稼働時間の上限（6:00開始で24:00まで）
+MAX_WORKING_HOURS = 24 - WORK_START_HOUR
+
+
+def _break_windows(working_hours: int) -> List[Tuple[int, int]]:
+    """休憩時間帯（0:00からの分）ProductionScheduler.skip_break_times と同じ"""
+    windows = [(10 * 60, 10 * 60 + 40)]
+    if working_hours >= 11:
+        windows.append((14 * 60, 14 * 60 + 30))
+    return windows
+
+
+def build_working_minute_prefix(
+    range_start: datetime,
+    days: int,
+    working_hours: int,
+    holidays: set
+) -> array:
+    """
+    稼働時間の1分単位の累積和を作成
+
+    prefix[m] = 期間開始から m 分までの稼働分数
+
+    Raises: ValueError working_hours が 1〜MAX_WORKING_HOURS の範囲外の場合
+    """
+    if not 1 <= working_hours <= MAX_WORKING_HOURS:
+        raise ValueError(f"working_hours must be between 1 and {MAX_WORKING_HOURS}")
+    breaks = _break_windows(working_hours)
+    work_start = WORK_START_HOUR * 60
+    work_end = (WORK_START_HOUR + working_hours) * 60
+
+    # 稼働日1日分のパターン（1: 稼働、0: 非稼働）
+    day_pattern = bytearray(1440)
+    for minute in range(work_start, work_end):
+        day_pattern[minute] = 1
+    for break_start, break_end in breaks:
+        for minute in range(break_start, break_end):
+            day_pattern[minute] = 0
+    holiday_pattern = bytearray(1440)
+
+    minutes = b''.join(
+        holiday_pattern if (range_start.date() + timedelta(days=offset)) in holidays else day_pattern
+        for offset in range(days)
+    )
+    prefix = array('i', [0])
+    prefix.extend(accumulate(minutes))
+    return prefix
+
+
+def build_buckets(range_start: datetime, days: int, resolution: str, working_hours: int) -> List[Tuple[int, int]]:
+    """時間帯の区切り（期間開始からの分）のリスト [(start, end), ...]"""
+    total_minutes = days * 1440
+
+    if resolution == 'hour':
+        return [(m, m + 60) for m in range(0, total_minutes, 60)]
+
+    if resolution == 'shift':
+        shift_start = WORK_START_HOUR * 60
+        shift_end = (WORK_START_HOUR + working_hours) * 60
+        return [(d * 1440 + shift_start, d * 1440 + shift_end) for d in range(days)]
+
+    if resolution == 'day':
+        return [(m, m + 1440) for m in range(0, total_minutes, 1440)]
+
+    # week: 月曜始まり（期間の開始・終了で切る）
+    buckets = []
+    start = 0
+    first_week_days = 7 - range_start.weekday()
+    end = min(first_week_days * 1440, total_minutes)
+    while start < total_minutes:
+        buckets.append((start, end))
+        start = end
+        end = min(start + 7 * 1440, total_minutes)
+    return buckets
+
+
+def _to_minute(dt: datetime, origin: datetime) -> int:
+    """基準日時からの整数分"""
+    return int((dt.replace(tzinfo=None) - origin).total_seconds() // 60)
+
+
+def aggregate_gantt(
+    db: Session,
+    start_date: date,
+    end_date: date,
+    resolution: str = 'day',
+    machine_list_ids: Optional[List[int]] = None,
+    working_hours: int = 8
+) -> Dict:
+    """
+    機械ごと・時間帯ごとの稼働・段取り・空き分数を集計
+
+    Args:
+        start_date: 開始日
+        end_date: 終了日（含む）
+
+    Raises: ValueError 解像度や期間が不正な場合
+
+    Returns: {
+        'buckets': [{'start', 'end', 'available_minutes'}, ...],
+        'machines': [{'machine_list_id', 'machine_no',
+                      'busy_minutes': [...], 'setup_minutes': [...], 'idle_minutes': [...],
+                      'product_codes': [[...], ...]}, ...]
+    }
+    """
+    if resolution not in GANTT_RESOLUTIONS:
+        raise ValueError(f"resolution must be one of: {', '.join(GANTT_RESOLUTIONS)}")
+    if end_date < start_date:
+        raise ValueError("end_date must be on or after start_date")
+
+    range_start = datetime.combine(start_date, datetime.min.time())
+    days = (end_date - start_date).days + 1
+    range_end = range_start + timedelta(days=days)
+
+    buckets = build_buckets(range_start, days, resolution, working_hours)
+    if len(buckets) > MAX_GANTT_BUCKETS:
+        raise ValueError(f"Too many buckets ({len(buckets)}); use a coarser resolution or a shorter range")
+
+    machine_query = db.query(MachineList.machine_list_id, MachineList.machine_no)
+    if machine_list_ids:
+        machine_query = machine_query.filter(MachineList.machine_list_id.in_(machine_list_ids))
+    else:
+        machine_query = machine_query.join(MachineType).filter(MachineType.machine_type_name == 'PRESS')
+    machines = machine_query.order_by(MachineList.machine_no).all()
+
+    n_buckets = len(buckets)
+    busy: Dict[int, List[int]] = {m.machine_list_id: [0] * n_buckets for m in machines}
+    setup: Dict[int, List[int]] = {m.machine_list_id: [0] * n_buckets for m in machines}
+    products: Dict[int, List[set]] = {m.machine_list_id: [set() for _ in buckets] for m in machines}
+
+    # 期間と重なるタスクのみ取得
+    tasks = db.query(
+        ProductionSchedule.machine_list_id,
+        ProductionSchedule.planned_start_datetime,
+        ProductionSchedule.planned_end_datetime,
+        ProductionSchedule.setup_time,
+        Product.product_code
+    )\
+        .join(PO, ProductionSchedule.po_id == PO.po_id)\
+        .join(Product, PO.product_id == Product.product_id)\
+        .filter(
+            and_(
+                ProductionSchedule.machine_list_id.in_(list(busy.keys())),
+                ProductionSchedule.planned_start_datetime < range_end,
+                ProductionSchedule.planned_end_datetime > range_start
+            )
+        ).all() if busy else []
+
+    # 期間より前に始まるタスクの段取りも数えるため、累積和は最も早いタスク開始日から作る
+    origin = range_start
+    for task in tasks:
+        task_day = datetime.combine(task.planned_start_datetime.date(), datetime.min.time())
+        if task_day < origin:
+            origin = task_day
+    offset = _to_minute(range_start, origin)
+    prefix = build_working_minute_prefix(origin, (range_end - origin).days, working_hours, load_holiday_set(db))
+
+    # 時間帯の区切りを origin 基準に変換
+    buckets = [(start + offset, end + offset) for start, end in buckets]
+    bucket_starts = [b[0] for b in buckets]
+    range_start_minute = offset
+    range_end_minute = len(prefix) - 1
+
+    for task in tasks:
+        task_start = _to_minute(task.planned_start_datetime, origin)
+        task_end = min(_to_minute(task.planned_end_datetime, origin), range_end_minute)
+
+        # 段取りの終了 = タスク開始から稼働時間で setup_time 分進んだ時刻
+        setup_minutes = int(round(float(task.setup_time or 0)))
+        setup_end = task_start
+        if setup_minutes:
+            setup_end = bisect_left(prefix, prefix[task_start] + setup_minutes, lo=task_start)
+
+        clip_start = max(task_start, range_start_minute)
+        clip_end = task_end
+        if clip_start >= clip_end:
+            continue
+
+        first = max(bisect_right(bucket_starts, clip_start) - 1, 0)
+        for index in range(first, n_buckets):
+            bucket_start, bucket_end = buckets[index]
+            if bucket_start >= clip_end:
+                break
+            overlap_start = max(bucket_start, clip_start)
+            overlap_end = min(bucket_end, clip_end)
+            if overlap_start >= overlap_end:
+                continue
+
+            working = prefix[overlap_end] - prefix[overlap_start]
+            setup_overlap_end = min(overlap_end, setup_end)
+            setup_working = prefix[setup_overlap_end] - prefix[overlap_start] if setup_overlap_end > overlap_start else 0
+
+            setup[task.machine_list_id][index] += setup_working
+            busy[task.machine_list_id][index] += working - setup_working
+            products[task.machine_list_id][index].add(task.product_code)
+
+    available = [prefix[end] - prefix[start] for start, end in buckets]
+
+    return {
+        'buckets': [
+            {
+                'start': (origin + timedelta(minutes=start)).isoformat(),
+                'end': (origin + timedelta(minutes=end)).isoformat(),
+                'available_minutes': available[i],
+            }
+            for i, (start, end) in enumerate(buckets)
+        ],
+        'machines': [
+            {
+                'machine_list_id': m.machine_list_id,
+                'machine_no': m.machine_no,
+                'busy_minutes': busy[m.machine_list_id],
+                'setup_minutes': setup[m.machine_list_id],
+                'idle_minutes': [
+                    max(available[i] - busy[m.machine_list_id][i] - setup[m.machine_list_id][i], 0)
+                    for i in range(n_buckets)
+                ],
+                'product_codes': [sorted(codes) for codes in products[m.machine_list_id]],
+            }
+            for m in machines
+        ]
+    }
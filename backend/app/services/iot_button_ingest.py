@@ -0,0 +1,165 @@
+"""
+IoTボタン押下イベントのバッチ受信（再送の重複排除）
+
+ラズパイは Wi-Fi が不安定な場合に同じイベントを再送するため、イベントごとに重複排除キーを持たせる
+- クライアントがイベントIDを付けた場合: (raspi_no, イベントID)
+- 付けていない場合: (raspi_no, pressed_at, button_name)（同じボタンの同じ秒の押下は1件とみなす）
+キーはSHA-1にして iot_button_events.dedupe_key（UNIQUE）に保存し、INSERT IGNORE で書き込む
+
+ラズパイ・ボタンごとの件数は iot_button_counters に同じトランザクションで加算する
+（ダッシュボードは全件COUNTではなくこちらを参照）
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import hashlib
+
+from sqlalchemy import func, insert
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.orm import Session
+
+from ..models.iot_button_event import IotButtonEvent, IotButtonCounter
+from .production_scheduler import VIETNAM_TZ
+
+# 1回の送信の最大イベント数
+MAX_BUTTON_BATCH_EVENTS = 1000
+# 同時に同じイベントが書き込まれて件数が合わない場合のやり直し回数
+INSERT_ATTEMPTS = 3
+
+
+class ButtonIngestConflict(Exception):
+    """同じイベントの同時書き込みが続き、新規件数を確定できない"""
+
+
+def to_local_naive(dt: datetime) -> datetime:
+    """タイムゾーン付きの日時をベトナム時間（タイムゾーンなし）に変換（なしの場合はそのまま）"""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(VIETNAM_TZ).replace(tzinfo=None)
+    return dt
+
+
+def button_dedupe_key(
+    raspi_no: Optional[str],
+    button_name: str,
+    client_event_id: Optional[str],
+    pressed_at: Optional[datetime]
+) -> str:
+    """
+    重複排除キー（SHA-1の16進40文字）
+
+    Raises: ValueError イベントIDも pressed_at もない場合
+    """
+    if client_event_id:
+        parts = ("id", raspi_no or "", client_event_id)
+    elif pressed_at is not None:
+        parts = ("at", raspi_no or "", pressed_at.replace(microsecond=0).isoformat(), button_name)
+    else:
+        raise ValueError("event_id or pressed_at is required for deduplication")
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def increment_button_counters(db: Session, counts: Dict[Tuple[str, str], Tuple[int, datetime]]):
+    """
+    ラズパイ・ボタンごとの件数を加算（コミットは呼び出し側）
+
+    counts: {(raspi_no, button_name): (件数, 最新の押下日時)}
+    """
+    if not counts:
+        return
+    stmt = mysql_insert(IotButtonCounter).values([
+        {"raspi_no": raspi_no, "button_name": button_name, "event_count": count, "last_pressed_at": last_pressed_at}
+        for (raspi_no, button_name), (count, last_pressed_at) in counts.items()
+    ])
+    stmt = stmt.on_duplicate_key_update(
+        event_count=IotButtonCounter.event_count + stmt.inserted.event_count,
+        last_pressed_at=func.greatest(
+            func.coalesce(IotButtonCounter.last_pressed_at, stmt.inserted.last_pressed_at),
+            stmt.inserted.last_pressed_at
+        )
+    )
+    db.execute(stmt)
+
+
+def _count_rows(rows: Iterable[Dict]) -> Dict[Tuple[str, str], Tuple[int, datetime]]:
+    counts: Dict[Tuple[str, str], Tuple[int, datetime]] = {}
+    for row in rows:
+        key = (row["raspi_no"] or "", row["button_name"])
+        count, last_pressed_at = counts.get(key, (0, row["pressed_at"]))
+        counts[key] = (count + 1, max(last_pressed_at, row["pressed_at"]))
+    return counts
+
+
+def ingest_button_events(db: Session, events: List[Dict], user: str = "raspi") -> Dict:
+    """
+    ボタン押下イベントをまとめて書き込む（既に受信済みのイベントは無視）
+
+    events: [{"button_name", "raspi_no", "note", "event_id", "pressed_at"}, ...]
+    pressed_at が省略されたイベントは受信時刻で記録する（event_id が必要）
+
+    Returns: {"received": 件数, "inserted": 新規件数, "duplicates": 重複件数}
+    Raises: ValueError イベント数が上限を超える場合、重複排除キーが作れない場合、
+            ButtonIngestConflict 同じイベントが同時に書き込まれ続けた場合
+    """
+    if len(events) > MAX_BUTTON_BATCH_EVENTS:
+        raise ValueError(f"more than {MAX_BUTTON_BATCH_EVENTS} events")
+
+    received_at = datetime.now(VIETNAM_TZ).replace(tzinfo=None, microsecond=0)
+    rows: Dict[str, Dict] = {}
+    for event in events:
+        pressed_at = event.get("pressed_at")
+        pressed_at = to_local_naive(pressed_at) if pressed_at is not None else None
+        key = button_dedupe_key(event.get("raspi_no"), event["button_name"], event.get("event_id"), pressed_at)
+        # 同じバッチ内の重複は最初のものを使う
+        rows.setdefault(key, {
+            "button_name": event["button_name"],
+            "raspi_no": event.get("raspi_no"),
+            "pressed_at": pressed_at or received_at,
+            "note": event.get("note"),
+            "user": user,
+            "dedupe_key": key,
+        })
+
+    inserted = 0
+    for attempt in range(INSERT_ATTEMPTS):
+        existing = {
+            key for (key,) in db.query(IotButtonEvent.dedupe_key).filter(IotButtonEvent.dedupe_key.in_(list(rows)))
+        } if rows else set()
+        new_rows = [row for key, row in rows.items() if key not in existing]
+        if not new_rows:
+            break
+
+        result = db.execute(insert(IotButtonEvent).prefix_with("IGNORE").values(new_rows))
+        if result.rowcount != len(new_rows):
+            # 確認後に別のリクエストが同じイベントを書き込んだ: どれが入ったか分からないのでやり直す
+            db.rollback()
+            if attempt + 1 == INSERT_ATTEMPTS:
+                raise ButtonIngestConflict("Button events were written concurrently, retry later")
+            continue
+
+        increment_button_counters(db, _count_rows(new_rows))
+        db.commit()
+        inserted = len(new_rows)
+        break
+
+    return {"received": len(events), "inserted": inserted, "duplicates": len(events) - inserted}
+
+
+def query_button_counters(db: Session, raspi_no: Optional[str] = None) -> List[Dict]:
+    """ラズパイ・ボタンごとの押下件数"""
+    query = db.query(IotButtonCounter)
+    if raspi_no is not None:
+        query = query.filter(IotButtonCounter.raspi_no == raspi_no)
+    return [
+        {
+            "raspi_no": c.raspi_no or None,
+            "button_name": c.button_name,
+            "event_count": c.event_count,
+            "last_pressed_at": c.last_pressed_at,
+        }
+        for c in query.order_by(IotButtonCounter.raspi_no, IotButtonCounter.button_name).all()
+    ]
+
+
+def total_button_events(db: Session) -> int:
+    """全ラズパイ・ボタンの押下件数（ダッシュボード用）"""
+    return int(db.query(func.coalesce(func.sum(IotButtonCounter.event_count), 0)).scalar())
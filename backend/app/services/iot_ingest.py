@@ -0,0 +1,272 @@
+"""
+プレスショットイベントのバッファ付き受信
+
+/api/iot/events/press で受け取ったイベントをプロセス内のキューに積み、
+バックグラウンドの書き込みタスクが件数または時間の閾値でまとめて複数行INSERTする
+
+- キューの未書き込み件数が上限を超える場合は受け付けない（呼び出し側で429を返す）
+- total は iot_press_counters（ラズパイごとの件数、書き込みと同じトランザクションで加算）と
+  未書き込み件数から返し、iot_press_events の全件COUNTは行わない
+- 分/時/日ごとのショット数（iot_press_shot_rollups）も同じトランザクションで加算する
+- DBに接続できず書き込みに失敗したイベントは一定間隔で再送する（未書き込み件数に含めたまま）
+  値が不正で書き込めない行は、バッチを分割して特定し破棄する（他のイベントの書き込みを止めない）
+- 受け付けたイベントはキューに積んだ時点でライブ配信（iot_stream）にも渡す
+  （稼働状態の判定（iot_press_monitor）は全ワーカー分を見るため、書き込み後の件数・ロールアップから行う）
+
+キューはプロセス内のため、プロセスが異常終了した場合は未書き込みのイベントが失われる
+正常終了時は stop() で残りを書き込む
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, insert
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from ..database import SessionLocal
+from ..models.iot_press_event import IotPressEvent, IotPressCounter
+from .iot_rollup import upsert_shot_rollups
+from .iot_stream import press_broadcaster
+
+logger = logging.getLogger(__name__)
+
+# 未書き込みイベントの上限（これを超える受信は429）
+INGEST_MAX_PENDING_EVENTS = 100_000
+# この件数がたまったら書き込む
+INGEST_FLUSH_EVENTS = 2000
+# 最初のイベントを受け取ってからこの秒数で書き込む
+INGEST_FLUSH_INTERVAL_SECONDS = 0.5
+# 1回のINSERT文の最大行数
+INGEST_INSERT_CHUNK = 1000
+# 書き込み失敗時の再試行間隔（秒）
+INGEST_RETRY_SECONDS = 2.0
+
+# 再送待ちの行だけを書き込む（新しいイベントを待たずに再送する）
+_RETRY_ONLY = object()
+
+
+class IngestQueueFull(Exception):
+    """未書き込みイベントが上限を超えた"""
+
+
+class PressEventIngestor:
+    """プレスショットイベントの受信キューと書き込みタスク"""
+
+    def __init__(
+        self,
+        max_pending: int = INGEST_MAX_PENDING_EVENTS,
+        flush_events: int = INGEST_FLUSH_EVENTS,
+        flush_interval: float = INGEST_FLUSH_INTERVAL_SECONDS
+    ):
+        self.max_pending = max_pending
+        self.flush_events = flush_events
+        self.flush_interval = flush_interval
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+        # 未書き込み件数（キュー内 + 書き込み中 + 再送待ち）
+        self._pending = 0
+        # 書き込みに失敗し、次回再送する行
+        self._retry_rows: List[Dict] = []
+        # 書き込み済みの件数（iot_press_counters の合計、書き込みごとに読み直す）
+        self._stored_total = 0
+
+    @property
+    def running(self) -> bool:
+        return self._writer is not None and not self._writer.done()
+
+    async def start(self):
+        """書き込みタスクを開始（アプリ起動時）"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._stored_total = await asyncio.to_thread(self._read_stored_total)
+        self._writer = asyncio.create_task(self._run())
+        logger.info(f"プレスイベント受信キュー開始 (登録済み: {self._stored_total}件)")
+
+    async def stop(self):
+        """残りのイベントを書き込んで終了（アプリ終了時）"""
+        if not self.running:
+            return
+        await self._queue.put(None)
+        await self._writer
+        self._writer = None
+
+    def enqueue(self, raspi_no: str, ts_list: List[int]) -> int:
+        """
+        イベントをキューに積む
+
+        Returns: 全ラズパイのイベント件数（書き込み済み + 未書き込み）
+        Raises: IngestQueueFull 未書き込み件数が上限を超える場合
+        """
+        if not self.running:
+            raise RuntimeError("Press event ingestor is not running")
+
+        count = len(ts_list)
+        if self._pending + count > self.max_pending:
+            raise IngestQueueFull(f"{self._pending} events pending")
+
+        if count:
+            self._pending += count
+            self._queue.put_nowait((raspi_no, ts_list))
+            # ライブ配信（書き込みを待たずに行う）
+            press_broadcaster.publish(raspi_no, ts_list)
+        return self._stored_total + self._pending
+
+    def stats(self) -> Dict:
+        """キューの状態"""
+        return {
+            "running": self.running,
+            "pending_events": self._pending,
+            "max_pending_events": self.max_pending,
+            "stored_total": self._stored_total,
+        }
+
+    async def _run(self):
+        """件数または時間の閾値でまとめて書き込む（再送待ちがあれば新しいイベントがなくても再送する）"""
+        stopping = False
+        while not stopping:
+            rows: List[Dict] = []
+            try:
+                item = await asyncio.wait_for(
+                    self._queue.get(), INGEST_RETRY_SECONDS if self._retry_rows else None
+                )
+            except asyncio.TimeoutError:
+                item = _RETRY_ONLY
+
+            if item is None:
+                stopping = True
+            elif item is not _RETRY_ONLY:
+                self._append_rows(rows, item)
+
+                # 閾値まで、または時間切れまで追加で受け取る
+                deadline = time.monotonic() + self.flush_interval
+                while not stopping and len(rows) < self.flush_events:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    if item is None:
+                        stopping = True
+                    else:
+                        self._append_rows(rows, item)
+
+            # 終了時はキューに残っている分もまとめる
+            if stopping:
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if item is not None:
+                        self._append_rows(rows, item)
+
+            rows = self._retry_rows + rows
+            self._retry_rows = []
+            if not rows:
+                continue
+
+            stored_total, retry_rows, dropped = await asyncio.to_thread(self._write_isolating, rows)
+            if stored_total is not None:
+                self._stored_total = stored_total
+            self._pending -= len(rows) - len(retry_rows)
+            if dropped:
+                logger.error(f"書き込めないプレスイベントを {dropped}件破棄")
+            if retry_rows:
+                self._retry_rows = retry_rows
+                if stopping:
+                    logger.error(f"終了時の書き込みに失敗したため {len(retry_rows)}件のイベントを破棄")
+                    break
+                await asyncio.sleep(INGEST_RETRY_SECONDS)
+
+    @classmethod
+    def _write_isolating(cls, rows: List[Dict]) -> Tuple[Optional[int], List[Dict], int]:
+        """
+        まとめて書き込み、失敗した場合は半分ずつに分けて書き込める行だけ書き込む
+
+        - 接続の失敗（DBが使えない）: 残りの行をすべて再送待ちにする
+        - それ以外（値が不正な行など）: 1行まで分けても失敗する行はログに出して破棄する
+          （1行の不正なイベントが以降の書き込みをすべて止めないように）
+
+        Returns: (書き込み後の全ラズパイのイベント件数（1回も書き込めなければ None）, 再送する行, 破棄した件数)
+        """
+        stored_total = None
+        retry_rows: List[Dict] = []
+        dropped = 0
+        chunks = [rows]
+        while chunks:
+            chunk = chunks.pop()
+            if retry_rows:
+                retry_rows.extend(chunk)
+                continue
+            try:
+                stored_total = cls._write(chunk)
+            except (OperationalError, InterfaceError):
+                logger.exception(f"プレスイベントの書き込みに失敗 ({len(chunk)}件、再送待ち)")
+                retry_rows.extend(chunk)
+            except Exception:
+                if len(chunk) == 1:
+                    logger.exception(f"プレスイベントを書き込めないため破棄: {chunk[0]}")
+                    dropped += 1
+                else:
+                    middle = len(chunk) // 2
+                    chunks.append(chunk[middle:])
+                    chunks.append(chunk[:middle])
+        return stored_total, retry_rows, dropped
+
+    @staticmethod
+    def _append_rows(rows: List[Dict], item: Tuple[str, List[int]]):
+        raspi_no, ts_list = item
+        rows.extend({"ts_ms": ts_ms, "raspi_no": raspi_no} for ts_ms in ts_list)
+
+    @staticmethod
+    def _write(rows: List[Dict]) -> int:
+        """
+        イベントの複数行INSERTとラズパイごとの件数・ロールアップの加算（1トランザクション）
+
+        Returns: 書き込み後の全ラズパイのイベント件数
+        """
+        counts: Dict[str, Tuple[int, int]] = {}
+        for row in rows:
+            count, last_ts_ms = counts.get(row["raspi_no"], (0, row["ts_ms"]))
+            counts[row["raspi_no"]] = (count + 1, max(last_ts_ms, row["ts_ms"]))
+
+        db = SessionLocal()
+        try:
+            for i in range(0, len(rows), INGEST_INSERT_CHUNK):
+                db.execute(insert(IotPressEvent).values(rows[i:i + INGEST_INSERT_CHUNK]))
+
+            stmt = mysql_insert(IotPressCounter).values([
+                {"raspi_no": raspi_no, "event_count": count, "last_ts_ms": last_ts_ms}
+                for raspi_no, (count, last_ts_ms) in counts.items()
+            ])
+            stmt = stmt.on_duplicate_key_update(
+                event_count=IotPressCounter.event_count + stmt.inserted.event_count,
+                last_ts_ms=func.greatest(func.coalesce(IotPressCounter.last_ts_ms, 0), stmt.inserted.last_ts_ms)
+            )
+            db.execute(stmt)
+
+            upsert_shot_rollups(db, ((row["raspi_no"], row["ts_ms"]) for row in rows))
+            db.commit()
+
+            return int(db.query(func.coalesce(func.sum(IotPressCounter.event_count), 0)).scalar())
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def _read_stored_total() -> int:
+        db = SessionLocal()
+        try:
+            return int(db.query(func.coalesce(func.sum(IotPressCounter.event_count), 0)).scalar())
+        finally:
+            db.close()
+
+
+# アプリ全体で共有する受信キュー（main.py の起動・終了時に start / stop）
+press_ingestor = PressEventIngestor()
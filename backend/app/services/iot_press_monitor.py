@@ -0,0 +1,549 @@
+"""
+プレスの稼働状態の判定（停止・速度低下の検知）
+
+受信キュー（iot_ingest）が書き込むラズパイごとの件数（iot_press_counters）と
+分ごとのショット数（iot_press_shot_rollups）を一定間隔で読み、各プレスの状態を判定する
+状態が変化した時だけ iot_press_states に1行追加する
+
+- stopped: 件数が PRESS_STOPPAGE_SECONDS（計画SPMが低い場合は STOPPAGE_CYCLES 周期分）増えない
+- slow:    計画中の工程（SPM工程）の SPM × 安全係数 を下回る状態が STATE_HOLD_SECONDS 続いた
+           速度は最後のイベントを含む分の直前の1分間のショット数（分ごとのロールアップ）
+- running: それ以外（停止中に件数が増えると running）
+
+計画はラズパイと機械の対応（iot_raspi_machines）から、現在時刻を含む production_schedule の工程を引く
+計画SPMはスケジューラーと同じく機械別サイクルタイムを優先する（ProductionScheduler.get_cycle_rate）
+停止・速度低下の期間は iot_press_states の ended_ts_ms で引けるため、生イベントを走査しない
+
+複数ワーカー構成では各ワーカーの受信キューが一部のイベントしか受け取らないため、
+判定はDBに書き込まれた全ワーカー分の件数・ロールアップから行う
+判定と書き込みは MySQL の GET_LOCK を取得した1つのワーカーだけが行い、
+他のワーカーは iot_press_states の継続中の状態を読んで返す（ロックを持つワーカーが終了すると別のワーカーが引き継ぐ）
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, insert, text, tuple_, update
+
+from ..database import SessionLocal, engine
+from ..models import ProductionSchedule, Process, ProcessNameType
+from ..models.iot_press_event import (
+    IotPressCounter, IotPressEvent, IotPressShotRollup, IotPressState, IotRaspiMachine
+)
+from .deadline_service import SPM_SAFETY_FACTOR
+from .iot_rollup import ROLLUP_RESOLUTIONS, bucket_start
+from .production_scheduler import ProductionScheduler, VIETNAM_TZ
+
+logger = logging.getLogger(__name__)
+
+# SPMの集計期間（ms、分ごとのロールアップ1つ分）
+SPM_WINDOW_MS = dict(ROLLUP_RESOLUTIONS)["minute"]
+# この秒数イベントがなければ停止
+PRESS_STOPPAGE_SECONDS = 60
+# 計画SPMが低い工程は、この周期数分イベントがなければ停止
+STOPPAGE_CYCLES = 3
+# running / slow の切り替えに必要な継続時間（秒）
+STATE_HOLD_SECONDS = 30
+# 判定の間隔（秒）
+MONITOR_TICK_SECONDS = 2.0
+# 計画（現在の工程とSPM）を読み直す間隔（秒）
+PLAN_REFRESH_SECONDS = 60
+# 判定を行うワーカーを決めるロック名と、ロックを持たないワーカーが取得を試みる間隔（秒）
+MONITOR_LOCK_NAME = "iot_press_monitor"
+MONITOR_LOCK_RETRY_SECONDS = 10
+
+STATE_RUNNING = "running"
+STATE_SLOW = "slow"
+STATE_STOPPED = "stopped"
+
+
+def previous_minute(ts_ms: int) -> int:
+    """ts_ms を含む分の直前の1分間（分ごとのロールアップの bucket_start_ms）"""
+    return bucket_start(ts_ms, SPM_WINDOW_MS) - SPM_WINDOW_MS
+
+
+def stoppage_seconds(planned_spm: Optional[float]) -> float:
+    """停止と判定する無受信時間（秒）"""
+    if planned_spm:
+        return max(PRESS_STOPPAGE_SECONDS, STOPPAGE_CYCLES * 60 / planned_spm)
+    return PRESS_STOPPAGE_SECONDS
+
+
+class PressMonitor:
+    """ラズパイごとのSPMと稼働状態"""
+
+    def __init__(self):
+        # ラズパイごとの件数 {raspi_no: {'event_count', 'last_ts_ms', 'changed_at'（件数の増加を読んだ時刻、monotonic）}}
+        self._seen: Dict[str, Dict] = {}
+        # 直近に読んだ分ごとのショット数 {(raspi_no, bucket_start_ms): shot_count}
+        self._minute_counts: Dict[Tuple[str, int], int] = {}
+        self._polled = False
+        # 現在の状態 {raspi_no: {'state', 'started_ts_ms', 'spm', 'planned_spm', 'schedule_id'}}
+        self._states: Dict[str, Dict] = {}
+        # 切り替え待ちの状態 {raspi_no: (state, 最初に判定したサーバー時刻, ラズパイの時計での時刻)}
+        self._candidates: Dict[str, Tuple[str, float, int]] = {}
+        # 計画中の工程 {raspi_no: (schedule_id, planned_spm)}
+        self._plans: Dict[str, Tuple[int, Optional[float]]] = {}
+        self._plans_loaded_at: Optional[float] = None
+        # 書き込み待ちの状態変化
+        self._pending_records: List[Dict] = []
+        self._listeners: List[Callable[[str, Dict], None]] = []
+        self._task: Optional[asyncio.Task] = None
+        # 判定を行うワーカーのロックを持つ接続（持っていなければ None）
+        self._lock_conn = None
+        self._lock_retry_at = 0.0
+
+    @property
+    def is_leader(self) -> bool:
+        """このワーカーが判定と書き込みを行っているか"""
+        return self._lock_conn is not None
+
+    def add_listener(self, listener: Callable[[str, Dict], None]):
+        """状態が変化した時に呼ぶ関数（raspi_no, 状態）を登録"""
+        self._listeners.append(listener)
+
+    def _estimated_now_ts_ms(self, seen: Dict, now: float) -> int:
+        """
+        ラズパイの時計での現在時刻（推定）
+
+        ラズパイの時計とサーバーの時計のずれの影響を受けないよう、
+        最後のイベント時刻に、件数の増加を読んでからの経過時間を足す
+        """
+        return int(seen["last_ts_ms"] + (now - seen["changed_at"]) * 1000)
+
+    def _rate(self, raspi_no: str) -> int:
+        """最後のイベントの直前の1分間のショット数（稼働中の速度、停止中も下がらない）"""
+        seen = self._seen.get(raspi_no)
+        if seen is None:
+            return 0
+        return self._minute_counts.get((raspi_no, previous_minute(seen["last_ts_ms"])), 0)
+
+    def _spm(self, raspi_no: str, now: float) -> int:
+        """現在の直前の1分間のショット数（停止すると下がる）"""
+        seen = self._seen.get(raspi_no)
+        if seen is None:
+            return 0
+        return self._minute_counts.get((raspi_no, previous_minute(self._estimated_now_ts_ms(seen, now))), 0)
+
+    def snapshot(self, raspi_nos=None) -> Dict[str, Dict]:
+        """ラズパイごとの現在のSPMと状態 {raspi_no: {'spm', 'last_ts_ms', 'state', 'state_since_ms', 'planned_spm'}}"""
+        now = time.monotonic()
+        names = self._seen.keys() if raspi_nos is None else [n for n in raspi_nos if n in self._seen]
+        result = {}
+        for name in names:
+            state = self._states.get(name) or {}
+            result[name] = {
+                "spm": self._spm(name, now),
+                "last_ts_ms": self._seen[name]["last_ts_ms"],
+                "state": state.get("state"),
+                "state_since_ms": state.get("started_ts_ms"),
+                "planned_spm": self._plans.get(name, (None, None))[1],
+            }
+        return result
+
+    def tick(self, now: Optional[float] = None):
+        """各プレスの状態を判定（判定を行うワーカーのみ）"""
+        now = time.monotonic() if now is None else now
+        for raspi_no, seen in self._seen.items():
+            current = self._states.get(raspi_no)
+            schedule_id, planned_spm = self._plans.get(raspi_no, (None, None))
+
+            if now - seen["changed_at"] >= stoppage_seconds(planned_spm):
+                if current is not None and current["state"] != STATE_STOPPED:
+                    self._change(raspi_no, STATE_STOPPED, seen["last_ts_ms"])
+                self._candidates.pop(raspi_no, None)
+                continue
+            if current is None or current["state"] == STATE_STOPPED:
+                continue
+
+            candidate = STATE_RUNNING
+            # 速度は最後のイベントの直前の1分間で判定する（無受信の間は停止の判定に任せる）
+            # 再開直後（再起動直後を含む）は、その1分間が稼働中に収まってから判定する
+            rate = self._rate(raspi_no)
+            if planned_spm and rate and previous_minute(seen["last_ts_ms"]) >= current["started_ts_ms"]:
+                if rate < planned_spm * float(SPM_SAFETY_FACTOR):
+                    candidate = STATE_SLOW
+
+            if candidate == current["state"]:
+                self._candidates.pop(raspi_no, None)
+                continue
+            pending = self._candidates.get(raspi_no)
+            if pending is None or pending[0] != candidate:
+                self._candidates[raspi_no] = (candidate, now, seen["last_ts_ms"])
+            elif now - pending[1] >= STATE_HOLD_SECONDS:
+                self._change(raspi_no, candidate, pending[2])
+                self._candidates.pop(raspi_no, None)
+
+    def _change(self, raspi_no: str, state: str, started_ts_ms: int):
+        schedule_id, planned_spm = self._plans.get(raspi_no, (None, None))
+        record = {
+            "raspi_no": raspi_no,
+            "state": state,
+            "started_ts_ms": started_ts_ms,
+            "spm": self._rate(raspi_no),
+            "planned_spm": planned_spm,
+            "schedule_id": schedule_id,
+        }
+        self._states[raspi_no] = record
+        self._pending_records.append(record)
+        self._notify(raspi_no, record)
+
+    def _notify(self, raspi_no: str, record: Dict):
+        for listener in self._listeners:
+            listener(raspi_no, record)
+
+    def _apply_poll(self, poll: Dict, now: float):
+        """読み込んだ件数・ロールアップ・状態を反映（イベントループ上で呼ぶ）"""
+        for raspi_no, (event_count, last_ts_ms) in poll["counters"].items():
+            seen = self._seen.get(raspi_no)
+            if seen is None:
+                self._seen[raspi_no] = {"event_count": event_count, "last_ts_ms": last_ts_ms, "changed_at": now}
+                # 起動後最初の読込は受信済みの件数（新しいイベントではない）
+                increased = self._polled
+            else:
+                increased = event_count > seen["event_count"]
+                seen.update(event_count=event_count, last_ts_ms=last_ts_ms)
+                if increased:
+                    seen["changed_at"] = now
+
+            if increased and self.is_leader:
+                current = self._states.get(raspi_no)
+                if current is None or current["state"] == STATE_STOPPED:
+                    self._change(raspi_no, STATE_RUNNING, poll["first_ts"].get(raspi_no) or last_ts_ms)
+
+        self._minute_counts = poll["minute_counts"]
+        self._polled = True
+
+        # 判定を行わないワーカーは継続中の状態をそのまま使う
+        if poll["open_states"] is not None:
+            for raspi_no, record in poll["open_states"].items():
+                current = self._states.get(raspi_no)
+                if current is None or current.get("state_id") != record["state_id"]:
+                    self._states[raspi_no] = record
+                    self._notify(raspi_no, record)
+
+    async def start(self):
+        """判定タスクを開始（アプリ起動時）"""
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """判定タスクを停止し、未書き込みの状態変化を書き込んでロックを解放する"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self.is_leader:
+            await self._flush()
+            await asyncio.to_thread(self._release_lock)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(MONITOR_TICK_SECONDS)
+            try:
+                await self._step()
+            except Exception:
+                logger.exception("プレスの稼働状態の判定に失敗")
+            if self.is_leader:
+                await self._flush()
+
+    async def _step(self):
+        was_leader = self.is_leader
+        await asyncio.to_thread(self._update_leadership, time.monotonic())
+        if self.is_leader and not was_leader:
+            # 前回の状態を引き継ぐ（最後のイベントは、いま受け取ったものとして停止判定を始める）
+            self._states = await asyncio.to_thread(self._load_last_states)
+            self._candidates.clear()
+            now = time.monotonic()
+            for seen in self._seen.values():
+                seen["changed_at"] = now
+            logger.info("プレスの稼働状態の判定を開始（このワーカーで判定）")
+        elif was_leader and not self.is_leader:
+            if self._pending_records:
+                logger.warning(f"ロックを失ったため未書き込みの状態変化 {len(self._pending_records)}件を破棄")
+            self._pending_records = []
+            self._candidates.clear()
+
+        if self._plans_loaded_at is None or time.monotonic() - self._plans_loaded_at >= PLAN_REFRESH_SECONDS:
+            self._plans_loaded_at = time.monotonic()
+            self._plans = await asyncio.to_thread(self._load_plans)
+
+        now = time.monotonic()
+        previous = {
+            raspi_no: (seen["event_count"], seen["last_ts_ms"], self._estimated_now_ts_ms(seen, now))
+            for raspi_no, seen in self._seen.items()
+        }
+        # 停止中（または状態なし）のプレスは、再開した最初のイベントを読む
+        resuming = {
+            raspi_no for raspi_no in previous
+            if self._states.get(raspi_no) is None or self._states[raspi_no]["state"] == STATE_STOPPED
+        } if self.is_leader else set()
+        poll = await asyncio.to_thread(self._poll, previous, resuming, not self.is_leader)
+        self._apply_poll(poll, time.monotonic())
+        if self.is_leader:
+            self.tick()
+
+    def _update_leadership(self, now: float):
+        """ロックを持っていれば保持を確認し、持っていなければ一定間隔で取得を試みる"""
+        if self._lock_conn is not None:
+            try:
+                held = self._lock_conn.execute(
+                    text("SELECT IS_USED_LOCK(:name) = CONNECTION_ID()"), {"name": MONITOR_LOCK_NAME}
+                ).scalar()
+                self._lock_conn.commit()
+            except Exception:
+                logger.exception("プレスの稼働状態の判定ロックの確認に失敗")
+                held = False
+            if not held:
+                logger.warning("プレスの稼働状態の判定ロックを失った（別のワーカーが引き継ぐ）")
+                self._close_lock_conn()
+            return
+
+        if now < self._lock_retry_at:
+            return
+        self._lock_retry_at = now + MONITOR_LOCK_RETRY_SECONDS
+        # ロックは専用の接続で持つ（接続が切れるとロックも解放され、別のワーカーが取得する）
+        conn = engine.connect()
+        try:
+            acquired = conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": MONITOR_LOCK_NAME}).scalar()
+            # 読み取りのトランザクションを開いたままにしない（ロックはコミットしても残る）
+            conn.commit()
+        except Exception:
+            conn.close()
+            raise
+        if acquired:
+            self._lock_conn = conn
+        else:
+            conn.close()
+
+    def _release_lock(self):
+        if self._lock_conn is None:
+            return
+        try:
+            self._lock_conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": MONITOR_LOCK_NAME})
+            self._lock_conn.commit()
+        except Exception:
+            logger.exception("プレスの稼働状態の判定ロックの解放に失敗")
+        self._close_lock_conn()
+
+    def _close_lock_conn(self):
+        try:
+            self._lock_conn.close()
+        except Exception:
+            pass
+        self._lock_conn = None
+
+    async def _flush(self):
+        if not self._pending_records:
+            return
+        records, self._pending_records = self._pending_records, []
+        try:
+            await asyncio.to_thread(self._write, records)
+        except Exception:
+            logger.exception(f"プレスの稼働状態の書き込みに失敗 ({len(records)}件、次回再送)")
+            self._pending_records = records + self._pending_records
+
+    @staticmethod
+    def _poll(
+        previous: Dict[str, Tuple[int, int, int]],
+        resuming: set,
+        read_states: bool
+    ) -> Dict:
+        """
+        全ワーカー分の件数・分ごとのショット数（・継続中の状態）を読む
+
+        Args:
+            previous: 前回読んだ値 {raspi_no: (件数, 最後のイベント時刻, ラズパイの時計での現在時刻（推定）)}
+            resuming: 件数が増えていれば再開した最初のイベント時刻を読むラズパイ
+            read_states: iot_press_states の継続中の状態を読むか（判定を行わないワーカー）
+        """
+        db = SessionLocal()
+        try:
+            counters = {
+                row.raspi_no: (int(row.event_count), int(row.last_ts_ms))
+                for row in db.query(
+                    IotPressCounter.raspi_no, IotPressCounter.event_count, IotPressCounter.last_ts_ms
+                ).filter(IotPressCounter.last_ts_ms.isnot(None)).all()
+            }
+
+            first_ts = {}
+            buckets = set()
+            for raspi_no, (event_count, last_ts_ms) in counters.items():
+                buckets.add((raspi_no, previous_minute(last_ts_ms)))
+                prev = previous.get(raspi_no)
+                if prev is None or event_count > prev[0]:
+                    now_ts_ms = last_ts_ms
+                else:
+                    now_ts_ms = prev[2]
+                buckets.add((raspi_no, previous_minute(now_ts_ms)))
+
+                if raspi_no in resuming and prev is not None and event_count > prev[0]:
+                    first_ts[raspi_no] = db.query(func.min(IotPressEvent.ts_ms)).filter(
+                        IotPressEvent.raspi_no == raspi_no,
+                        IotPressEvent.ts_ms > prev[1]
+                    ).scalar()
+
+            minute_counts = {}
+            if buckets:
+                minute_counts = {
+                    (row.raspi_no, int(row.bucket_start_ms)): int(row.shot_count)
+                    for row in db.query(
+                        IotPressShotRollup.raspi_no, IotPressShotRollup.bucket_start_ms, IotPressShotRollup.shot_count
+                    ).filter(
+                        IotPressShotRollup.resolution == "minute",
+                        tuple_(IotPressShotRollup.raspi_no, IotPressShotRollup.bucket_start_ms).in_(sorted(buckets))
+                    ).all()
+                }
+
+            open_states = None
+            if read_states:
+                open_states = {}
+                for row in db.query(IotPressState).filter(
+                    IotPressState.ended_ts_ms.is_(None)
+                ).order_by(IotPressState.state_id).all():
+                    open_states[row.raspi_no] = {
+                        "state_id": row.state_id,
+                        "raspi_no": row.raspi_no,
+                        "state": row.state,
+                        "started_ts_ms": row.started_ts_ms,
+                        "spm": row.spm,
+                        "planned_spm": float(row.planned_spm) if row.planned_spm is not None else None,
+                        "schedule_id": row.schedule_id,
+                    }
+
+            return {"counters": counters, "first_ts": first_ts, "minute_counts": minute_counts, "open_states": open_states}
+        finally:
+            db.close()
+
+    @staticmethod
+    def _write(records: List[Dict]):
+        """状態変化を追加し、同じラズパイの前の状態を終了させる（1トランザクション）"""
+        db = SessionLocal()
+        try:
+            for record in records:
+                db.execute(
+                    update(IotPressState)
+                    .where(IotPressState.raspi_no == record["raspi_no"], IotPressState.ended_ts_ms.is_(None))
+                    .values(ended_ts_ms=record["started_ts_ms"])
+                )
+                db.execute(insert(IotPressState).values(**record))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def _load_plans() -> Dict[str, Tuple[int, Optional[float]]]:
+        """
+        ラズパイごとの現在の計画 {raspi_no: (schedule_id, SPM工程のSPM（DAY工程は None）)}
+
+        SPMはスケジューラーと同じく機械別サイクルタイム、なければ工程マスターの rough_cycletime
+        """
+        now = datetime.now(VIETNAM_TZ).replace(tzinfo=None)
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                IotRaspiMachine.raspi_no,
+                IotRaspiMachine.machine_list_id,
+                ProductionSchedule.schedule_id,
+                Process,
+                ProcessNameType.day_or_spm
+            ).join(
+                ProductionSchedule, ProductionSchedule.machine_list_id == IotRaspiMachine.machine_list_id
+            ).join(
+                Process, Process.process_id == ProductionSchedule.process_id
+            ).outerjoin(
+                ProcessNameType, Process.process_name_id == ProcessNameType.process_name_id
+            ).filter(
+                ProductionSchedule.planned_start_datetime <= now,
+                ProductionSchedule.planned_end_datetime > now
+            ).order_by(ProductionSchedule.planned_start_datetime).all()
+
+            plans = {}
+            scheduler = ProductionScheduler(db) if rows else None
+            for row in rows:
+                if row.raspi_no in plans:
+                    continue
+                planned_spm = None
+                if row.day_or_spm is True:
+                    rate = scheduler.get_cycle_rate(row.Process, row.machine_list_id)
+                    planned_spm = float(rate) if rate else None
+                plans[row.raspi_no] = (row.schedule_id, planned_spm)
+            return plans
+        finally:
+            db.close()
+
+    @staticmethod
+    def _load_last_states() -> Dict[str, Dict]:
+        """ラズパイごとの最後の状態"""
+        db = SessionLocal()
+        try:
+            latest = db.query(
+                IotPressState.raspi_no, func.max(IotPressState.state_id).label("state_id")
+            ).group_by(IotPressState.raspi_no).subquery()
+            rows = db.query(IotPressState).join(latest, IotPressState.state_id == latest.c.state_id).all()
+            return {
+                row.raspi_no: {
+                    "state_id": row.state_id,
+                    "raspi_no": row.raspi_no,
+                    "state": row.state,
+                    "started_ts_ms": row.started_ts_ms,
+                    "spm": row.spm,
+                    "planned_spm": float(row.planned_spm) if row.planned_spm is not None else None,
+                    "schedule_id": row.schedule_id,
+                }
+                for row in rows
+            }
+        finally:
+            db.close()
+
+
+def query_press_states(
+    db,
+    start_ms: int,
+    end_ms: int,
+    raspi_no: Optional[str] = None,
+    state: Optional[str] = None
+) -> List[Dict]:
+    """
+    期間 [start_ms, end_ms) に重なる状態の一覧（ラズパイ・開始時刻順）
+
+    継続中の状態の ended_ts_ms は None、duration_ms は期間の終了までで切る
+    """
+    query = db.query(IotPressState).filter(
+        IotPressState.started_ts_ms < end_ms,
+        (IotPressState.ended_ts_ms > start_ms) | IotPressState.ended_ts_ms.is_(None)
+    )
+    if raspi_no:
+        query = query.filter(IotPressState.raspi_no == raspi_no)
+    if state:
+        query = query.filter(IotPressState.state == state)
+    rows = query.order_by(IotPressState.raspi_no, IotPressState.started_ts_ms).all()
+
+    return [
+        {
+            "raspi_no": row.raspi_no,
+            "state": row.state,
+            "started_ts_ms": row.started_ts_ms,
+            "ended_ts_ms": row.ended_ts_ms,
+            "duration_ms": min(row.ended_ts_ms or end_ms, end_ms) - max(row.started_ts_ms, start_ms),
+            "spm": row.spm,
+            "planned_spm": float(row.planned_spm) if row.planned_spm is not None else None,
+            "schedule_id": row.schedule_id,
+        }
+        for row in rows
+    ]
+
+
+# アプリ全体で共有する判定（main.py の起動・終了時に start / stop）
+press_monitor = PressMonitor()
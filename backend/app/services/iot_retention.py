@@ -0,0 +1,385 @@
+"""
+プレスイベントの保持期間管理（パーティションのアーカイブと削除）
+
+iot_press_events は ts_ms（ベトナム時間の月初 0:00）で月ごとに RANGE パーティション化している
+（database/migration_partition_iot_press_events.sql）
+
+- 先の月のパーティションは p_future を分割して事前に作る（空のうちに分割するためデータの移動はない）
+- 保持期間（IOT_RETENTION_MONTHS）より古いパーティションは
+  1. ロールアップ（日）がイベント件数に足りているか確認し、足りなければ集計し直す
+  2. 日ごとの gzip CSV（id, ts_ms, raspi_no）に書き出す
+     IOT_ARCHIVE_DIR/iot_press_events/YYYY/MM/YYYY-MM-DD.<パーティション名>.csv.gz
+  3. 書き出した件数とパーティションの件数が一致すれば DROP PARTITION で削除する
+- 削除後のグラフ・集計はロールアップ（/api/iot/events/rollup）から引き続き取得できる
+- iot_press_counters の件数は受信した累計のため、削除しても減らさない
+
+アプリ起動中は定期的に実行し（start_retention_task）、/api/iot/events/retention から手動でも実行できる
+複数ワーカーで同時に実行しないよう、MySQL の GET_LOCK で排他する
+"""
+
+import asyncio
+import calendar
+import csv
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from ..config import settings
+from ..database import engine
+from ..models.iot_press_event import IotPressEvent
+from .iot_rollup import LOCAL_OFFSET_MS, ROLLUP_RESOLUTIONS, backfill_shot_rollups, bucket_start
+
+logger = logging.getLogger(__name__)
+
+EVENTS_TABLE = IotPressEvent.__tablename__
+
+# 上限のないパーティション（ここを分割して先の月を作る）
+FUTURE_PARTITION = "p_future"
+# 月ごとのパーティション名
+MONTH_PARTITION_PATTERN = re.compile(r"^p\d{6}$")
+# 当月から何か月先までパーティションを用意しておくか
+PARTITIONS_AHEAD_MONTHS = 2
+# アーカイブ時に1回で読み込む行数
+ARCHIVE_FETCH_ROWS = 10000
+# 定期実行の間隔（秒）と起動後の初回実行までの待ち時間（秒）
+RETENTION_INTERVAL_SECONDS = 6 * 3600
+RETENTION_INITIAL_DELAY_SECONDS = 60
+# /api/iot/events/retention から手動実行する場合の keep_months の下限
+MIN_MANUAL_KEEP_MONTHS = 1
+# 複数ワーカーでの同時実行を防ぐロック名
+RETENTION_LOCK_NAME = "iot_press_events_retention"
+
+DAY_MS = dict(ROLLUP_RESOLUTIONS)["day"]
+LOCAL_TZ = timezone(timedelta(milliseconds=LOCAL_OFFSET_MS))
+
+
+class RetentionError(Exception):
+    """パーティションの管理・アーカイブができない"""
+
+
+class RetentionBusy(RetentionError):
+    """別のプロセスで実行中"""
+
+
+def month_start_ms(year: int, month: int) -> int:
+    """ベトナム時間の月初 0:00（ms）"""
+    return calendar.timegm((year, month, 1, 0, 0, 0)) * 1000 - LOCAL_OFFSET_MS
+
+
+def add_months(year: int, month: int, months: int) -> Tuple[int, int]:
+    index = year * 12 + (month - 1) + months
+    return index // 12, index % 12 + 1
+
+
+def local_month(ts_ms: int) -> Tuple[int, int]:
+    """ts_ms を含む月（ベトナム時間）"""
+    local = datetime.fromtimestamp(ts_ms / 1000, LOCAL_TZ)
+    return local.year, local.month
+
+
+def list_partitions(db) -> List[Dict]:
+    """
+    iot_press_events のパーティション一覧（範囲順）
+
+    Args:
+        db: Session または Connection
+
+    Returns: [{'name': str, 'lower_ms': int|None, 'upper_ms': int|None（MAXVALUE）, 'approx_rows': int}]
+             パーティション化されていない場合は空
+    """
+    rows = db.execute(text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS "
+        "FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name "
+        "ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {"table_name": EVENTS_TABLE}).all()
+
+    partitions = []
+    lower_ms = None
+    for row in rows:
+        if row.PARTITION_NAME is None:
+            return []
+        upper_ms = None if row.PARTITION_DESCRIPTION == "MAXVALUE" else int(row.PARTITION_DESCRIPTION)
+        partitions.append({
+            "name": row.PARTITION_NAME,
+            "lower_ms": lower_ms,
+            "upper_ms": upper_ms,
+            "approx_rows": int(row.TABLE_ROWS or 0),
+        })
+        lower_ms = upper_ms
+    return partitions
+
+
+def _require_partitions(db) -> List[Dict]:
+    partitions = list_partitions(db)
+    if not partitions or partitions[-1]["name"] != FUTURE_PARTITION:
+        raise RetentionError(
+            f"{EVENTS_TABLE} is not partitioned; run database/migration_partition_iot_press_events.sql"
+        )
+    return partitions
+
+
+def plan_future_partitions(partitions: List[Dict], now_ms: int) -> List[Tuple[str, int]]:
+    """当月から PARTITIONS_AHEAD_MONTHS か月先までで足りないパーティション [(名前, 上限ms)]"""
+    year, month = local_month(now_ms)
+    target_ms = month_start_ms(*add_months(year, month, PARTITIONS_AHEAD_MONTHS + 1))
+
+    bounded = [p["upper_ms"] for p in partitions if p["upper_ms"] is not None]
+    last_upper = max(bounded) if bounded else month_start_ms(year, month)
+
+    planned = []
+    while last_upper < target_ms:
+        year, month = local_month(last_upper)
+        last_upper = month_start_ms(*add_months(year, month, 1))
+        planned.append((f"p{year:04d}{month:02d}", last_upper))
+    return planned
+
+
+def ensure_future_partitions(conn, now_ms: int) -> List[str]:
+    """先の月のパーティションを p_future の分割で作成"""
+    planned = plan_future_partitions(_require_partitions(conn), now_ms)
+    if not planned:
+        return []
+
+    definitions = ", ".join(f"PARTITION {name} VALUES LESS THAN ({upper_ms})" for name, upper_ms in planned)
+    conn.execute(text(
+        f"ALTER TABLE {EVENTS_TABLE} REORGANIZE PARTITION {FUTURE_PARTITION} INTO "
+        f"({definitions}, PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE)"
+    ))
+    names = [name for name, _ in planned]
+    logger.info(f"{EVENTS_TABLE} のパーティションを追加: {', '.join(names)}")
+    return names
+
+
+def expired_partitions(partitions: List[Dict], now_ms: int, keep_months: int) -> List[Dict]:
+    """保持期間（当月 + 過去 keep_months か月）より前に収まるパーティション"""
+    year, month = local_month(now_ms)
+    cutoff_ms = month_start_ms(*add_months(year, month, -keep_months))
+    return [p for p in partitions if p["upper_ms"] is not None and p["upper_ms"] <= cutoff_ms]
+
+
+def _check_partition_name(name: str):
+    # パーティション名はSQLに直接埋め込むため、想定した形式のみ許可する
+    if name != "p_history" and not MONTH_PARTITION_PATTERN.match(name):
+        raise RetentionError(f"Unexpected partition name: {name}")
+
+
+def _ensure_rollups(conn, partition: Dict) -> int:
+    """
+    パーティション内のイベントが日のロールアップに反映されているか確認し、不足があれば集計し直す
+
+    Returns: 集計し直したロールアップの行数（不足がなければ0）
+    """
+    name = partition["name"]
+    raw = {
+        (row.raspi_no, int(row.bucket)): int(row.shot_count)
+        for row in conn.execute(text(
+            f"SELECT raspi_no, (ts_ms + :offset) DIV :day * :day - :offset AS bucket, COUNT(*) AS shot_count "
+            f"FROM {EVENTS_TABLE} PARTITION ({name}) GROUP BY raspi_no, bucket"
+        ), {"offset": LOCAL_OFFSET_MS, "day": DAY_MS})
+    }
+    if not raw:
+        return 0
+
+    first_bucket = min(bucket for _, bucket in raw)
+    end_ms = partition["upper_ms"]
+    rollup = {
+        (row.raspi_no, int(row.bucket_start_ms)): int(row.shot_count)
+        for row in conn.execute(text(
+            "SELECT raspi_no, bucket_start_ms, shot_count FROM iot_press_shot_rollups "
+            "WHERE resolution = 'day' AND bucket_start_ms >= :start_ms AND bucket_start_ms < :end_ms"
+        ), {"start_ms": first_bucket, "end_ms": end_ms})
+    }
+
+    # 範囲より前に削除したパーティションの遅着分を含む場合があるため、ロールアップ側が多いのは正常
+    if all(rollup.get(key, 0) >= count for key, count in raw.items()):
+        return 0
+
+    start_ms = partition["lower_ms"] if partition["lower_ms"] is not None else first_bucket
+    logger.warning(f"{EVENTS_TABLE} {name}: ロールアップに不足があるため集計し直します")
+    updated = backfill_shot_rollups(conn, start_ms, end_ms)
+    conn.commit()
+    return updated
+
+
+def _archive_path(archive_dir: str, day_start_ms: int, partition_name: str) -> str:
+    day = datetime.fromtimestamp(day_start_ms / 1000, LOCAL_TZ)
+    return os.path.join(
+        archive_dir, EVENTS_TABLE, f"{day:%Y}", f"{day:%m}", f"{day:%Y-%m-%d}.{partition_name}.csv.gz"
+    )
+
+
+def archive_partition(conn, partition: Dict, archive_dir: str) -> Dict:
+    """
+    パーティションのイベントを日ごとの gzip CSV に書き出す
+
+    ファイルは一時ファイルに書いてから置き換えるため、途中で失敗しても再実行で上書きされる
+
+    Returns: {'rows': int, 'files': [{'path': str, 'rows': int}]}
+    """
+    name = partition["name"]
+    files: List[Dict] = []
+    total = 0
+
+    result = None
+    current_path = None
+    current_file = None
+    writer = None
+    day_end_ms = None
+
+    def close_current():
+        current_file.close()
+        os.replace(current_path + ".tmp", current_path)
+
+    try:
+        result = conn.execute(
+            text(f"SELECT id, ts_ms, raspi_no FROM {EVENTS_TABLE} PARTITION ({name}) ORDER BY ts_ms, id"),
+            execution_options={"stream_results": True}
+        )
+        for chunk in result.partitions(ARCHIVE_FETCH_ROWS):
+            for row in chunk:
+                if day_end_ms is None or row.ts_ms >= day_end_ms:
+                    if current_file is not None:
+                        close_current()
+                    day_start_ms = bucket_start(row.ts_ms, DAY_MS)
+                    day_end_ms = day_start_ms + DAY_MS
+                    current_path = _archive_path(archive_dir, day_start_ms, name)
+                    os.makedirs(os.path.dirname(current_path), exist_ok=True)
+                    current_file = gzip.open(current_path + ".tmp", "wt", newline="", encoding="utf-8")
+                    writer = csv.writer(current_file)
+                    writer.writerow(["id", "ts_ms", "raspi_no"])
+                    files.append({"path": current_path, "rows": 0})
+                writer.writerow([row.id, row.ts_ms, row.raspi_no])
+                files[-1]["rows"] += 1
+                total += 1
+        if current_file is not None:
+            close_current()
+            current_file = None
+    finally:
+        if current_file is not None and not current_file.closed:
+            current_file.close()
+        # 途中で失敗した場合も未読の行を破棄して接続を使える状態に戻す
+        if result is not None:
+            result.close()
+
+    return {"rows": total, "files": files}
+
+
+def archive_and_drop_partition(conn, partition: Dict, archive_dir: str) -> Dict:
+    """ロールアップを確認し、アーカイブしてからパーティションを削除"""
+    name = partition["name"]
+    _check_partition_name(name)
+
+    rollups_repaired = _ensure_rollups(conn, partition)
+    archived = archive_partition(conn, partition, archive_dir)
+
+    # 書き出し中に遅れて届いたイベントがあれば削除しない（次回の実行でアーカイブし直す）
+    count = conn.execute(text(f"SELECT COUNT(*) FROM {EVENTS_TABLE} PARTITION ({name})")).scalar()
+    if int(count) != archived["rows"]:
+        raise RetentionError(f"{name}: {count} rows in partition but {archived['rows']} archived")
+
+    conn.execute(text(f"ALTER TABLE {EVENTS_TABLE} DROP PARTITION {name}"))
+    logger.info(f"{EVENTS_TABLE} {name} をアーカイブして削除: {archived['rows']}件, {len(archived['files'])}ファイル")
+    return {
+        "partition": name,
+        "lower_ms": partition["lower_ms"],
+        "upper_ms": partition["upper_ms"],
+        "rows": archived["rows"],
+        "files": archived["files"],
+        "rollups_repaired": rollups_repaired,
+    }
+
+
+def run_retention(
+    keep_months: Optional[int] = None,
+    archive_dir: Optional[str] = None,
+    dry_run: bool = False,
+    now_ms: Optional[int] = None
+) -> Dict:
+    """
+    先の月のパーティション作成と、保持期間を過ぎたパーティションのアーカイブ・削除
+
+    Args:
+        keep_months: 当月を除いて残す月数（省略時は IOT_RETENTION_MONTHS）
+        dry_run: True の場合は対象を返すだけで変更しない
+
+    Raises: RetentionBusy 別のプロセスで実行中の場合、RetentionError 実行できない場合
+    """
+    keep_months = settings.IOT_RETENTION_MONTHS if keep_months is None else keep_months
+    archive_dir = archive_dir or settings.IOT_ARCHIVE_DIR
+    if keep_months < 0:
+        raise RetentionError("keep_months must be 0 or more")
+    if now_ms is None:
+        now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+
+    # ロックとDDLは同じ接続で行う（コミットしても接続を手放さない）
+    with engine.connect() as conn:
+        if not conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": RETENTION_LOCK_NAME}).scalar():
+            raise RetentionBusy("Retention is already running")
+        try:
+            partitions = _require_partitions(conn)
+            expired = expired_partitions(partitions, now_ms, keep_months)
+
+            if dry_run:
+                return {
+                    "dry_run": True,
+                    "keep_months": keep_months,
+                    "archive_dir": archive_dir,
+                    "created_partitions": [name for name, _ in plan_future_partitions(partitions, now_ms)],
+                    "archived": [
+                        {"partition": p["name"], "lower_ms": p["lower_ms"], "upper_ms": p["upper_ms"],
+                         "approx_rows": p["approx_rows"]}
+                        for p in expired
+                    ],
+                }
+
+            created = ensure_future_partitions(conn, now_ms)
+            archived = [archive_and_drop_partition(conn, p, archive_dir) for p in expired]
+            return {
+                "dry_run": False,
+                "keep_months": keep_months,
+                "archive_dir": archive_dir,
+                "created_partitions": created,
+                "archived": archived,
+            }
+        finally:
+            conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": RETENTION_LOCK_NAME})
+
+
+async def _run_periodically():
+    await asyncio.sleep(RETENTION_INITIAL_DELAY_SECONDS)
+    while True:
+        try:
+            await asyncio.to_thread(run_retention)
+        except RetentionBusy:
+            logger.info("プレスイベントの保持期間処理は別のプロセスで実行中")
+        except Exception:
+            logger.exception("プレスイベントの保持期間処理に失敗")
+        await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
+
+
+_retention_task: Optional[asyncio.Task] = None
+
+
+def start_retention_task():
+    """保持期間処理の定期実行を開始（アプリ起動時）"""
+    global _retention_task
+    if settings.IOT_RETENTION_ENABLED and _retention_task is None:
+        _retention_task = asyncio.create_task(_run_periodically())
+
+
+async def stop_retention_task():
+    """定期実行を停止（アプリ終了時）"""
+    global _retention_task
+    if _retention_task is not None:
+        _retention_task.cancel()
+        try:
+            await _retention_task
+        except asyncio.CancelledError:
+            pass
+        _retention_task = None
@@ -0,0 +1,157 @@
+"""
+プレスショット数のロールアップ
+
+iot_press_shot_rollups にラズパイごと・分/時/日ごとのショット数を持ち、
+受信キューの書き込み時（iot_ingest）にイベントと同じトランザクションで加算する
+
+タイムライングラフは生の ts_ms ではなく、要求された時間幅を満たす最も粗いロールアップから集計する
+日の区切りはベトナム時間（UTC+7）の0:00
+"""
+
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.orm import Session
+
+from ..models.iot_press_event import IotPressShotRollup
+
+# ロールアップの種類と時間幅（ms）（細かい順）
+ROLLUP_RESOLUTIONS: List[Tuple[str, int]] = [
+    ("minute", 60_000),
+    ("hour", 3_600_000),
+    ("day", 86_400_000),
+]
+
+# 日の区切りをベトナム時間にするためのオフセット（ms）
+LOCAL_OFFSET_MS = 7 * 3_600_000
+
+# 1系列あたりの最大バケット数
+MAX_ROLLUP_BUCKETS = 5000
+
+
+def bucket_start(ts_ms: int, bucket_ms: int) -> int:
+    """ts_ms を含むバケットの開始時刻（ms、ベトナム時間基準で区切る）"""
+    return (ts_ms + LOCAL_OFFSET_MS) // bucket_ms * bucket_ms - LOCAL_OFFSET_MS
+
+
+def upsert_shot_rollups(db: Session, events: Iterable[Tuple[str, int]]):
+    """
+    イベント (raspi_no, ts_ms) をロールアップに加算（コミットは呼び出し側）
+    """
+    counts: Counter = Counter()
+    for raspi_no, ts_ms in events:
+        for resolution, size in ROLLUP_RESOLUTIONS:
+            counts[(resolution, raspi_no, bucket_start(ts_ms, size))] += 1
+
+    if not counts:
+        return
+
+    stmt = mysql_insert(IotPressShotRollup).values([
+        {"resolution": resolution, "raspi_no": raspi_no, "bucket_start_ms": start, "shot_count": count}
+        for (resolution, raspi_no, start), count in counts.items()
+    ])
+    stmt = stmt.on_duplicate_key_update(
+        shot_count=IotPressShotRollup.shot_count + stmt.inserted.shot_count
+    )
+    db.execute(stmt)
+
+
+def backfill_shot_rollups(db, start_ms: int, end_ms: int) -> int:
+    """
+    期間 [start_ms, end_ms) のイベントからロールアップを集計し直す（コミットは呼び出し側）
+
+    受信キューを経由せずに登録されたイベントの補完用
+    アーカイブ済みのイベントを含む場合があるため、既存の値より小さくはしない
+
+    Args:
+        db: Session または Connection
+
+    Returns: 更新した行数（MySQLの affected rows）
+    """
+    updated = 0
+    for resolution, size in ROLLUP_RESOLUTIONS:
+        result = db.execute(text(
+            "INSERT INTO iot_press_shot_rollups (resolution, raspi_no, bucket_start_ms, shot_count) "
+            "SELECT :resolution, raspi_no, (ts_ms + :offset) DIV :size * :size - :offset AS bucket, COUNT(*) "
+            "FROM iot_press_events WHERE ts_ms >= :start_ms AND ts_ms < :end_ms "
+            "GROUP BY raspi_no, bucket "
+            "ON DUPLICATE KEY UPDATE shot_count = GREATEST(shot_count, VALUES(shot_count))"
+        ), {
+            "resolution": resolution, "offset": LOCAL_OFFSET_MS, "size": size,
+            "start_ms": start_ms, "end_ms": end_ms,
+        })
+        updated += result.rowcount
+    return updated
+
+
+def choose_rollup(bucket_ms: int) -> Tuple[str, int]:
+    """
+    要求された時間幅を割り切れる最も粗いロールアップを選ぶ
+
+    Raises: ValueError 分単位で割り切れない時間幅の場合
+    """
+    chosen = None
+    for resolution, size in ROLLUP_RESOLUTIONS:
+        if size <= bucket_ms and bucket_ms % size == 0:
+            chosen = (resolution, size)
+    if chosen is None:
+        raise ValueError(f"bucket_ms must be a multiple of {ROLLUP_RESOLUTIONS[0][1]}")
+    return chosen
+
+
+def query_shot_counts(
+    db: Session,
+    start_ms: int,
+    end_ms: int,
+    bucket_ms: int,
+    raspi_no: Optional[str] = None
+) -> Dict:
+    """
+    時間幅 bucket_ms ごとのショット数を取得
+
+    期間はバケットの境界に広げる（開始・終了を含むバケット全体を集計）
+
+    Raises: ValueError 期間や時間幅が不正な場合
+
+    Returns: {
+        'bucket_ms': int, 'source': 'minute'|'hour'|'day',
+        'series': {raspi_no: [[bucket_start_ms, shot_count], ...]}  # 時刻順、0件のバケットは含まない
+    }
+    """
+    if end_ms < start_ms:
+        raise ValueError("end_ms must be on or after start_ms")
+
+    resolution, _ = choose_rollup(bucket_ms)
+    range_start = bucket_start(start_ms, bucket_ms)
+    range_end = bucket_start(end_ms, bucket_ms) + bucket_ms
+    if (range_end - range_start) // bucket_ms > MAX_ROLLUP_BUCKETS:
+        raise ValueError(f"Too many buckets; use bucket_ms >= {(range_end - range_start) // MAX_ROLLUP_BUCKETS}")
+
+    # ロールアップのバケットを要求された時間幅に再集計
+    bucket = (
+        (IotPressShotRollup.bucket_start_ms + LOCAL_OFFSET_MS).op("DIV")(bucket_ms) * bucket_ms - LOCAL_OFFSET_MS
+    ).label("bucket")
+    query = db.query(
+        IotPressShotRollup.raspi_no,
+        bucket,
+        func.sum(IotPressShotRollup.shot_count).label("shot_count")
+    ).filter(
+        IotPressShotRollup.resolution == resolution,
+        IotPressShotRollup.bucket_start_ms >= range_start,
+        IotPressShotRollup.bucket_start_ms < range_end
+    )
+    if raspi_no:
+        query = query.filter(IotPressShotRollup.raspi_no == raspi_no)
+    rows = query.group_by(IotPressShotRollup.raspi_no, bucket).order_by(IotPressShotRollup.raspi_no, bucket).all()
+
+    series: Dict[str, List[List[int]]] = {}
+    for row in rows:
+        series.setdefault(row.raspi_no, []).append([int(row.bucket), int(row.shot_count)])
+
+    return {
+        "bucket_ms": bucket_ms,
+        "source": resolution,
+        "series": series,
+    }
@@ -0,0 +1,148 @@
+"""
+プレスイベントのライブ配信（Server-Sent Events）
+
+受信キュー（iot_ingest）に積んだイベントを、購読中のクライアントへそのまま配信する
+ラズパイごとの直近1分間のショット数（SPM）と稼働状態の変化は iot_press_monitor から取得して送る
+
+- クライアントごとにラズパイ番号で絞り込める（指定なしは全ラズパイ）
+- クライアントごとのキューが上限に達した場合はそのクライアント宛のイベントを捨て、
+  lagged を送る（クライアント側で /api/iot/events から取り直す）
+- 一定間隔で購読中のラズパイのSPMを送り、接続維持（プロキシのタイムアウト対策）を兼ねる
+
+配信はプロセス内のため、複数ワーカー構成では受信したワーカーに接続しているクライアントにのみ届く
+（SPMと稼働状態は全ワーカー分のDBの値から作るため、どのワーカーでも同じ）
+press イベントだけでは他のワーカーが受信した分が欠けるため、クライアントは
+/api/iot/events/raw?since_ms=... で直近の期間を定期的に取り直して補完する（FactoryView）
+"""
+
+import asyncio
+import json
+import weakref
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from .iot_press_monitor import press_monitor
+
+# クライアントごとの未送信メッセージの上限
+STREAM_QUEUE_SIZE = 1000
+# SPMの定期送信間隔（秒）
+STREAM_HEARTBEAT_SECONDS = 5.0
+# 同時接続数の上限
+MAX_STREAM_SUBSCRIBERS = 100
+
+
+class TooManySubscribers(Exception):
+    """同時接続数が上限を超えた"""
+
+
+class _Subscription:
+    def __init__(self, raspi_nos: Optional[Set[str]]):
+        self.raspi_nos = raspi_nos
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.lagged = False
+
+    def accepts(self, raspi_no: str) -> bool:
+        return self.raspi_nos is None or raspi_no in self.raspi_nos
+
+    def offer(self, message: str):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class PressEventBroadcaster:
+    """受信したプレスイベントを購読中のクライアントへ配信"""
+
+    def __init__(self):
+        self._subscribers: Set[_Subscription] = set()
+
+    def _offer(self, raspi_no: str, message_factory):
+        subscribers = [s for s in self._subscribers if s.accepts(raspi_no)]
+        if not subscribers:
+            return
+        message = message_factory()
+        for subscription in subscribers:
+            subscription.offer(message)
+
+    def publish(self, raspi_no: str, ts_list: List[int]):
+        """
+        受信したイベントを配信（受信キューに積んだ直後、イベントループ上で呼ぶ）
+
+        SPMは press_monitor の直近の読込（全ワーカー分のロールアップ）から取る
+        """
+        if not ts_list:
+            return
+
+        def message():
+            current = press_monitor.snapshot([raspi_no]).get(raspi_no) or {}
+            return _sse("press", {
+                "raspi_no": raspi_no,
+                "events": ts_list,
+                "spm": current.get("spm"),
+                "last_ts_ms": max(ts_list),
+            })
+
+        self._offer(raspi_no, message)
+
+    def publish_state(self, raspi_no: str, state: Dict):
+        """稼働状態の変化を配信（press_monitor から呼ばれる）"""
+        self._offer(raspi_no, lambda: _sse("state", {
+            "raspi_no": raspi_no,
+            "state": state["state"],
+            "started_ts_ms": state["started_ts_ms"],
+            "spm": state["spm"],
+            "planned_spm": state["planned_spm"],
+        }))
+
+    def spm_snapshot(self, raspi_nos: Optional[Iterable[str]] = None) -> Dict[str, Dict]:
+        """ラズパイごとの現在のSPMと状態（press_monitor.snapshot）"""
+        return press_monitor.snapshot(raspi_nos)
+
+    def stream(self, raspi_nos: Optional[List[str]], is_disconnected) -> AsyncIterator[str]:
+        """
+        SSEのメッセージを順に返す（StreamingResponse 用）
+
+        Args:
+            raspi_nos: 配信するラズパイ番号（None は全ラズパイ）
+            is_disconnected: クライアントの切断を確認するコルーチン関数（Request.is_disconnected）
+
+        Raises: TooManySubscribers 同時接続数が上限を超えた場合
+        """
+        if len(self._subscribers) >= MAX_STREAM_SUBSCRIBERS:
+            raise TooManySubscribers(f"{len(self._subscribers)} subscribers")
+
+        # 上限の確認と同時に枠を確保する（送信開始までの間に他の接続が上限を超えて登録されないように）
+        subscription = _Subscription(set(raspi_nos) if raspi_nos else None)
+        self._subscribers.add(subscription)
+        messages = self._iterate(subscription, is_disconnected)
+        # 送信が始まらずに破棄された場合（開始前の切断など）も枠を解放する
+        weakref.finalize(messages, self._subscribers.discard, subscription)
+        return messages
+
+    async def _iterate(self, subscription: _Subscription, is_disconnected) -> AsyncIterator[str]:
+        try:
+            yield _sse("spm", {"spm": self.spm_snapshot(subscription.raspi_nos)})
+            while not await is_disconnected():
+                try:
+                    message = await asyncio.wait_for(subscription.queue.get(), STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield _sse("spm", {"spm": self.spm_snapshot(subscription.raspi_nos)})
+                    continue
+                yield message
+                if subscription.lagged and subscription.queue.empty():
+                    subscription.lagged = False
+                    yield _sse("lagged", {"message": "Some events were dropped; reload the range"})
+        finally:
+            self._subscribers.discard(subscription)
+
+    def stats(self) -> Dict:
+        return {"subscribers": len(self._subscribers), "max_subscribers": MAX_STREAM_SUBSCRIBERS}
+
+
+# アプリ全体で共有する配信先（iot_ingest の受信時に publish）
+press_broadcaster = PressEventBroadcaster()
+press_monitor.add_listener(press_broadcaster.publish_state)
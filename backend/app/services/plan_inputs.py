@@ -0,0 +1,150 @@
+"""
+計画計算の入力データの一括読込
+
+進捗確認テーブルや生産計画の逆算で、製品ごとに繰り返していたクエリ
+（最も近い納期、28日以内のPO合計、工程と工程タイプ、休日判定）を
+少数の集合クエリにまとめる
+"""
+
+from bisect import bisect_left
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Iterable
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+from ..models import PO, Process, ProcessNameType, Calendar
+
+# 基準納期からPOを合算する日数
+PO_WINDOW_DAYS = 28
+
+
+def load_po_demand(db: Session, max_po_numbers: Optional[int] = None) -> Dict[int, Dict]:
+    """
+    製品ごとの未配送POの需要を1クエリで取得
+
+    ウィンドウ関数で製品ごとの最も近い納期を求め、そこから28日以内のPOを合算する
+
+    Args:
+        max_po_numbers: po_numbers に含めるPO番号の最大件数（納期順、Noneの場合は全件）
+
+    Returns: {product_id: {
+        'earliest_delivery_date': date,
+        'total_po_quantity': int,
+        'po_ids': [int, ...],  # 納期順
+        'po_numbers': [str, ...]  # 納期順
+    }}
+    """
+    undelivered = select(
+        PO.po_id,
+        PO.product_id,
+        PO.po_number,
+        PO.po_quantity,
+        PO.delivery_date,
+        func.min(PO.delivery_date).over(partition_by=PO.product_id).label("earliest_delivery_date"),
+    ).where(PO.is_delivered == False).subquery()
+
+    window = select(
+        undelivered.c.product_id,
+        undelivered.c.po_id,
+        undelivered.c.po_number,
+        undelivered.c.earliest_delivery_date,
+        func.sum(undelivered.c.po_quantity).over(
+            partition_by=undelivered.c.product_id
+        ).label("total_po_quantity"),
+        func.row_number().over(
+            partition_by=undelivered.c.product_id,
+            order_by=(undelivered.c.delivery_date, undelivered.c.po_id)
+        ).label("po_rank"),
+    ).where(
+        undelivered.c.delivery_date <= func.date_add(
+            undelivered.c.earliest_delivery_date, text(f"INTERVAL {PO_WINDOW_DAYS} DAY")
+        )
+    ).subquery()
+
+    query = select(window).order_by(window.c.product_id, window.c.po_rank)
+    if max_po_numbers is not None:
+        query = query.where(window.c.po_rank <= max_po_numbers)
+
+    demand: Dict[int, Dict] = {}
+    for row in db.execute(query):
+        if row.product_id not in demand:
+            demand[row.product_id] = {
+                'earliest_delivery_date': row.earliest_delivery_date,
+                'total_po_quantity': int(row.total_po_quantity or 0),
+                'po_ids': [],
+                'po_numbers': [],
+            }
+        demand[row.product_id]['po_ids'].append(row.po_id)
+        demand[row.product_id]['po_numbers'].append(row.po_number)
+    return demand
+
+
+def load_process_chains(db: Session, product_ids: Iterable[int]) -> Dict[int, List]:
+    """
+    製品ごとの工程（工程番号の昇順）を工程タイプと合わせて1クエリで取得
+
+    Returns: {product_id: [Row(Process, process_name, day_or_spm), ...]}
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+
+    rows = db.query(
+        Process,
+        ProcessNameType.process_name,
+        ProcessNameType.day_or_spm
+    ).outerjoin(
+        ProcessNameType, Process.process_name_id == ProcessNameType.process_name_id
+    ).filter(
+        Process.product_id.in_(product_ids)
+    ).order_by(Process.product_id, Process.process_no).all()
+
+    chains: Dict[int, List] = {}
+    for row in rows:
+        chains.setdefault(row.Process.product_id, []).append(row)
+    return chains
+
+
+def load_holiday_set(db: Session) -> set:
+    """休日（calendarテーブル）の日付セットを取得"""
+    return {row.date_holiday for row in db.query(Calendar.date_holiday).all()}
+
+
+class WorkingDayIndex:
+    """
+    稼働日インデックス（指定期間の稼働日を昇順に保持）
+
+    稼働日数の逆算を1日ずつの休日判定ではなく、リストの位置計算で行う
+    期間外にはみ出した場合は休日セットで1日ずつ判定する
+    """
+
+    def __init__(self, holidays: set, start: date, end: date):
+        self.holidays = holidays
+        self.start = start
+        self.end = end
+        self.days: List[date] = []
+        current = start
+        while current <= end:
+            if current not in holidays:
+                self.days.append(current)
+            current += timedelta(days=1)
+
+    def subtract_working_days(self, from_date: date, working_days: int) -> date:
+        """from_date より前の稼働日を working_days 日遡った日付を返す"""
+        if working_days <= 0:
+            return from_date
+
+        if self.start <= from_date <= self.end + timedelta(days=1):
+            # from_date より前の稼働日数
+            position = bisect_left(self.days, from_date)
+            if position - working_days >= 0:
+                return self.days[position - working_days]
+
+        current = from_date
+        remaining = working_days
+        while remaining > 0:
+            current -= timedelta(days=1)
+            if current not in self.holidays:
+                remaining -= 1
+        return current
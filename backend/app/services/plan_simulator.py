@@ -0,0 +1,415 @@
+"""
+生産計画のロバスト性シミュレーション（モンテカルロ法）
+
+要件:
+- 公開済みの production_schedule をそのまま再生する
+- プレス機の故障、サイクルタイムのばらつき、金型故障をランダムに発生させる
+- 金型故障率・修理日数は broken_mold の履歴から推定する
+- POごとの納期遵守確率と遅延日数の分布を返す
+
+計算方法:
+- 計画を「稼働分」（休日・休憩を除いた分数）の時間軸に変換し、一度だけ配列化する
+- 試行はNumPyで試行方向にベクトル化し、試行のまとまりをプロセスプールで並列実行する
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, date
+from typing import Dict, List, Optional
+import logging
+import math
+import os
+import time
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..models import PO, Process, Product, ProductionSchedule, BrokenMold
+from .production_scheduler import ProductionScheduler
+
+logger = logging.getLogger(__name__)
+
+# 遅延日数ヒストグラムの区切り（稼働日）
+LATENESS_BINS = [0, 1, 2, 3, 5, 7, 14]
+
+# 1プロセスあたりの最小試行数（これ未満ならプールを使わない）
+MIN_TRIALS_PER_WORKER = 250
+
+
+class PlanSimulator:
+    """公開済み生産計画のモンテカルロシミュレーター"""
+
+    def __init__(self, db: Session, working_hours: int = 8):
+        self.db = db
+        self.working_hours = working_hours
+        # 休日キャッシュ・休憩時間計算はスケジューラーのものを使用
+        self.scheduler = ProductionScheduler(db, working_hours=working_hours)
+        self.daily_minutes = self.scheduler.get_working_minutes(working_hours)
+        # {date: その日より前の累積稼働分}
+        self._working_index: Dict[date, float] = {}
+        self._index_origin: Optional[date] = None
+
+    # ============================================
+    # 稼働分の時間軸
+    # ============================================
+
+    def _build_working_index(self, start_date: date, end_date: date):
+        """start_date〜end_dateの各日について、その日より前の累積稼働分を計算"""
+        self._index_origin = start_date
+        self._working_index = {}
+        cumulative = 0.0
+        current = start_date
+        while current <= end_date:
+            self._working_index[current] = cumulative
+            if self.scheduler.is_working_day(current):
+                cumulative += self.daily_minutes
+            current = current + timedelta(days=1)
+
+    def to_working_minutes(self, dt: datetime) -> float:
+        """日時を稼働分の時間軸に変換"""
+        day = dt.date()
+        base = self._working_index.get(day)
+        if base is None:
+            # インデックス範囲外（通常は発生しない）
+            base = (day - self._index_origin).days * self.daily_minutes
+        if not self.scheduler.is_working_day(day):
+            return base
+
+        day_start = datetime.combine(day, datetime.min.time().replace(hour=6, minute=0))
+        if dt <= day_start:
+            return base
+        elapsed = self.scheduler.calculate_working_minutes_in_range(day_start, dt)
+        return base + min(elapsed, self.daily_minutes)
+
+    # ============================================
+    # スナップショット
+    # ============================================
+
+    def load_snapshot(self) -> Optional[Dict]:
+        """
+        公開済み計画をシミュレーション用の配列に変換
+
+        Returns: ワーカープロセスに渡せるdict（計画がない場合はNone）
+        """
+        rows = self.db.query(
+            ProductionSchedule.schedule_id,
+            ProductionSchedule.po_id,
+            ProductionSchedule.process_id,
+            ProductionSchedule.machine_list_id,
+            ProductionSchedule.planned_start_datetime,
+            ProductionSchedule.planned_end_datetime,
+            ProductionSchedule.setup_time,
+            ProductionSchedule.processing_time,
+            Process.process_no,
+            PO.po_number,
+            PO.delivery_date,
+            Product.product_code,
+        ).join(
+            Process, ProductionSchedule.process_id == Process.process_id
+        ).join(
+            PO, ProductionSchedule.po_id == PO.po_id
+        ).join(
+            Product, PO.product_id == Product.product_id
+        ).order_by(
+            ProductionSchedule.planned_start_datetime.asc(),
+            ProductionSchedule.schedule_id.asc()
+        ).all()
+
+        if not rows:
+            return None
+
+        first_day = min(rows[0].planned_start_datetime.date(), min(r.delivery_date for r in rows))
+        last_day = max(
+            max(r.planned_end_datetime for r in rows).date(),
+            max(r.delivery_date for r in rows)
+        )
+        self._build_working_index(first_day, last_day + timedelta(days=1))
+
+        n = len(rows)
+        planned_start = np.empty(n, dtype=np.float64)
+        planned_end = np.empty(n, dtype=np.float64)
+        setup = np.empty(n, dtype=np.float64)
+        processing = np.empty(n, dtype=np.float64)
+        machine_idx = np.full(n, -1, dtype=np.int32)
+
+        machine_index: Dict[int, int] = {}
+        po_index: Dict[int, int] = {}
+        pos: List[Dict] = []
+        last_task_on_machine: Dict[int, int] = {}
+        machine_pred = np.full(n, -1, dtype=np.int32)
+        tasks_by_po: Dict[int, List[int]] = {}
+        process_nos = np.empty(n, dtype=np.int32)
+
+        for i, row in enumerate(rows):
+            start_wm = self.to_working_minutes(row.planned_start_datetime)
+            end_wm = self.to_working_minutes(row.planned_end_datetime)
+            setup_minutes = float(row.setup_time or 0)
+
+            planned_start[i] = start_wm
+            planned_end[i] = end_wm
+            setup[i] = setup_minutes
+            # 計画上の所要時間から段取りを除いた分を加工時間とする
+            processing[i] = max(0.0, end_wm - start_wm - setup_minutes)
+            process_nos[i] = row.process_no
+
+            if row.machine_list_id is not None:
+                m = machine_index.setdefault(row.machine_list_id, len(machine_index))
+                machine_idx[i] = m
+                machine_pred[i] = last_task_on_machine.get(m, -1)
+                last_task_on_machine[m] = i
+
+            if row.po_id not in po_index:
+                po_index[row.po_id] = len(pos)
+                pos.append({
+                    'po_id': row.po_id,
+                    'po_number': row.po_number,
+                    'product_code': row.product_code,
+                    'delivery_date': row.delivery_date,
+                    'deadline_wm': self._working_index.get(row.delivery_date, 0.0),
+                })
+            tasks_by_po.setdefault(po_index[row.po_id], []).append(i)
+
+        # 工程順の依存関係: 同じPOで工程番号が小さく、計画上この作業の開始前に終わっている作業
+        chain_preds: List[List[int]] = [[] for _ in range(n)]
+        for task_ids in tasks_by_po.values():
+            for i in task_ids:
+                chain_preds[i] = [
+                    j for j in task_ids
+                    if process_nos[j] < process_nos[i] and planned_end[j] <= planned_start[i] + 1e-6
+                ]
+
+        return {
+            'planned_start': planned_start,
+            'planned_end': planned_end,
+            'setup': setup,
+            'processing': processing,
+            'machine_idx': machine_idx,
+            'machine_pred': machine_pred,
+            'chain_preds': chain_preds,
+            'po_tasks': [tasks_by_po[p] for p in range(len(pos))],
+            'deadlines': np.array([p['deadline_wm'] for p in pos], dtype=np.float64),
+            'pos': pos,
+        }
+
+    # ============================================
+    # 故障率の推定
+    # ============================================
+
+    def estimate_mold_break_model(self) -> Dict:
+        """
+        broken_moldの履歴から金型故障率と修理日数を推定
+
+        Returns: {
+            'rate_per_minute': float,  # 1工程・1稼働分あたりの故障発生率
+            'repair_minutes': List[float]  # 修理に要した稼働分（経験分布）
+        }
+        """
+        broken_molds = self.db.query(
+            BrokenMold.date_broken,
+            BrokenMold.date_hope_repaired,
+            BrokenMold.date_schedule_repaired
+        ).all()
+        process_count = self.db.query(Process.process_id).count()
+
+        if not broken_molds or process_count == 0:
+            return {'rate_per_minute': 0.0, 'repair_minutes': [float(self.daily_minutes)]}
+
+        today = self.scheduler.get_vietnam_today()
+        first_broken = min(bm.date_broken for bm in broken_molds)
+        observed_days = max(1, (today - first_broken).days)
+
+        repair_minutes = []
+        for bm in broken_molds:
+            repaired = bm.date_schedule_repaired or bm.date_hope_repaired
+            if repaired is None or repaired < bm.date_broken:
+                continue
+            # 修理完了日までの暦日数を稼働分に換算（当日修理でも最低1日）
+            repair_days = max(1, (repaired - bm.date_broken).days)
+            repair_minutes.append(float(repair_days * self.daily_minutes))
+
+        if not repair_minutes:
+            repair_minutes = [float(self.daily_minutes)]
+
+        rate = len(broken_molds) / (process_count * observed_days * self.daily_minutes)
+        return {'rate_per_minute': rate, 'repair_minutes': repair_minutes}
+
+    # ============================================
+    # 実行
+    # ============================================
+
+    def run(
+        self,
+        trials: int = 1000,
+        machine_breakdowns_per_day: float = 0.05,
+        machine_repair_hours: float = 2.0,
+        cycle_time_cv: float = 0.1,
+        seed: Optional[int] = None,
+        workers: Optional[int] = None
+    ) -> Dict:
+        """
+        シミュレーションを実行してPOごとの統計を返す
+
+        Args:
+            trials: 試行回数
+            machine_breakdowns_per_day: プレス機1台・1稼働日あたりの故障回数
+            machine_repair_hours: プレス機故障1回あたりの平均復旧時間（時間）
+            cycle_time_cv: 加工時間のばらつき（変動係数）
+            seed: 乱数シード（再現用）
+            workers: 並列プロセス数（Noneの場合はCPU数、CPU数が上限）
+        """
+        total_start = time.time()
+
+        snapshot = self.load_snapshot()
+        if snapshot is None:
+            return {'trials': 0, 'pos': [], 'elapsed_seconds': 0.0}
+
+        mold_model = self.estimate_mold_break_model()
+        params = {
+            'machine_rate_per_minute': machine_breakdowns_per_day / self.daily_minutes,
+            'machine_repair_minutes': machine_repair_hours * 60,
+            'cycle_time_cv': cycle_time_cv,
+            'mold_rate_per_minute': mold_model['rate_per_minute'],
+            'mold_repair_minutes': np.array(mold_model['repair_minutes'], dtype=np.float64),
+            'daily_minutes': float(self.daily_minutes),
+        }
+
+        # 試行を分割してプロセスプールで実行
+        # CPU数を超えるプロセスは起動しない
+        cpu_count = os.cpu_count() or 1
+        workers = max(1, min(workers or cpu_count, cpu_count))
+        chunk_count = max(1, min(workers, trials // MIN_TRIALS_PER_WORKER))
+        chunk_sizes = [trials // chunk_count + (1 if i < trials % chunk_count else 0) for i in range(chunk_count)]
+        seeds = np.random.SeedSequence(seed).spawn(chunk_count)
+
+        if chunk_count == 1:
+            results = [_simulate_chunk(snapshot, params, chunk_sizes[0], seeds[0])]
+        else:
+            with ProcessPoolExecutor(max_workers=chunk_count) as executor:
+                results = list(executor.map(
+                    _simulate_chunk,
+                    [snapshot] * chunk_count,
+                    [params] * chunk_count,
+                    chunk_sizes,
+                    seeds
+                ))
+
+        # {PO: 試行ごとの遅延（稼働日）}
+        lateness_days = np.concatenate(results, axis=1)
+
+        planned_finish = np.array([
+            snapshot['planned_end'][task_ids].max() for task_ids in snapshot['po_tasks']
+        ])
+        planned_lateness = (planned_finish - snapshot['deadlines']) / self.daily_minutes
+
+        po_results = []
+        bins = np.array(LATENESS_BINS + [np.inf], dtype=np.float64)
+        for p, po in enumerate(snapshot['pos']):
+            lateness = lateness_days[p]
+            positive = np.maximum(lateness, 0.0)
+            histogram, _ = np.histogram(positive[lateness > 0], bins=bins)
+            po_results.append({
+                'po_id': po['po_id'],
+                'po_number': po['po_number'],
+                'product_code': po['product_code'],
+                'delivery_date': po['delivery_date'].isoformat(),
+                'planned_lateness_days': round(float(max(planned_lateness[p], 0.0)), 2),
+                'on_time_probability': round(float((lateness <= 0).mean()), 4),
+                'expected_lateness_days': round(float(positive.mean()), 2),
+                'lateness_percentiles_days': {
+                    'p50': round(float(np.percentile(positive, 50)), 2),
+                    'p90': round(float(np.percentile(positive, 90)), 2),
+                    'p95': round(float(np.percentile(positive, 95)), 2),
+                    'max': round(float(positive.max()), 2),
+                },
+                'lateness_histogram': [
+                    {
+                        'from_days': LATENESS_BINS[i],
+                        'to_days': LATENESS_BINS[i + 1] if i + 1 < len(LATENESS_BINS) else None,
+                        'probability': round(float(histogram[i]) / trials, 4),
+                    }
+                    for i in range(len(histogram))
+                ],
+            })
+
+        # 納期遵守確率が低い（壊れやすい）POから順に返す
+        po_results.sort(key=lambda x: (x['on_time_probability'], -x['expected_lateness_days']))
+
+        elapsed = time.time() - total_start
+        logger.info(f"計画シミュレーション完了: {trials}試行, {len(po_results)}PO, {chunk_count}プロセス, {elapsed:.2f}秒")
+
+        return {
+            'trials': trials,
+            'workers': chunk_count,
+            'task_count': int(len(snapshot['planned_start'])),
+            'mold_break_rate_per_day': round(mold_model['rate_per_minute'] * self.daily_minutes, 6),
+            'elapsed_seconds': round(elapsed, 2),
+            'pos': po_results,
+        }
+
+
+def _simulate_chunk(snapshot: Dict, params: Dict, trials: int, seed_sequence) -> np.ndarray:
+    """
+    試行のまとまりを実行（ワーカープロセスで実行される）
+
+    作業を計画開始順に1回ずつ走査し、各作業の終了時刻を試行方向の配列で計算する
+    - 計画開始時刻より前には開始しない
+    - 同じ機械の前作業、同じPOの前工程の終了を待つ
+    - 加工時間に対数正規分布のばらつきを掛ける
+    - 機械故障・金型故障の復旧時間を加算する
+
+    Returns: POごと・試行ごとの遅延日数（稼働日）の配列 (PO数, trials)
+    """
+    rng = np.random.default_rng(seed_sequence)
+
+    planned_start = snapshot['planned_start']
+    setup = snapshot['setup']
+    processing = snapshot['processing']
+    machine_idx = snapshot['machine_idx']
+    machine_pred = snapshot['machine_pred']
+    chain_preds = snapshot['chain_preds']
+
+    sigma = math.sqrt(math.log(1 + params['cycle_time_cv'] ** 2)) if params['cycle_time_cv'] > 0 else 0.0
+    machine_rate = params['machine_rate_per_minute']
+    machine_repair = params['machine_repair_minutes']
+    mold_rate = params['mold_rate_per_minute']
+    mold_repairs = params['mold_repair_minutes']
+
+    n_tasks = len(planned_start)
+    ends = np.empty((n_tasks, trials), dtype=np.float64)
+    start = np.empty(trials, dtype=np.float64)
+
+    for i in range(n_tasks):
+        start.fill(planned_start[i])
+        if machine_pred[i] >= 0:
+            np.maximum(start, ends[machine_pred[i]], out=start)
+        for j in chain_preds[i]:
+            np.maximum(start, ends[j], out=start)
+
+        duration = np.full(trials, setup[i])
+        if processing[i] > 0:
+            if sigma > 0:
+                duration += processing[i] * rng.lognormal(-sigma * sigma / 2, sigma, trials)
+            else:
+                duration += processing[i]
+
+            # プレス機故障: 作業時間中の故障回数 ~ ポアソン、復旧時間 ~ 指数分布の和
+            if machine_idx[i] >= 0 and machine_rate > 0:
+                failures = rng.poisson(machine_rate * processing[i], trials)
+                duration += rng.gamma(failures, machine_repair)
+
+            # 金型故障: 作業時間中に1回でも故障すれば履歴の修理日数分だけ遅れる
+            if mold_rate > 0:
+                broken_probability = 1 - math.exp(-mold_rate * processing[i])
+                broken = rng.random(trials) < broken_probability
+                if broken.any():
+                    duration += broken * rng.choice(mold_repairs, trials)
+
+        np.add(start, duration, out=ends[i])
+
+    # 稼働日単位に換算（1日 = 稼働分数）
+    deadlines = snapshot['deadlines']
+    daily_minutes = params['daily_minutes']
+    lateness = np.empty((len(deadlines), trials), dtype=np.float32)
+    for p, task_ids in enumerate(snapshot['po_tasks']):
+        lateness[p] = (ends[task_ids].max(axis=0) - deadlines[p]) / daily_minutes
+
+    return lateness
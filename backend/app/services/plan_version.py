@@ -0,0 +1,59 @@
+"""
+生産計画のバージョン管理
+
+production_schedule を作り直すたびに production_plan_versions に1件追加する
+計画から作成する派生データ（プレス週間予定表など）は計画バージョン単位で保存し、
+新しいバージョンが公開された時点で古いものは使われなくなる
+"""
+
+from typing import Optional
+import logging
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..models import ProductionPlanVersion, PressWeeklyBoard
+from .press_weekly_board import materialize_press_weekly_board
+
+logger = logging.getLogger(__name__)
+
+
+def get_current_plan_version_id(db: Session) -> Optional[int]:
+    """現在（最新）の計画バージョンIDを取得"""
+    return db.query(func.max(ProductionPlanVersion.plan_version_id)).scalar()
+
+
+def publish_plan_version(
+    db: Session,
+    strategy: Optional[str],
+    working_hours: int,
+    schedules_count: int,
+    user: Optional[str] = None
+) -> ProductionPlanVersion:
+    """
+    新しい計画バージョンを登録し、プレス週間予定表を作成
+
+    予定表の作成に失敗しても計画の公開は取り消さない（表示時に再作成される）
+    """
+    version = ProductionPlanVersion(
+        strategy=strategy,
+        working_hours=working_hours,
+        schedules_count=schedules_count,
+        user=user
+    )
+    db.add(version)
+    db.flush()
+
+    # 古いバージョンの予定表は不要
+    db.query(PressWeeklyBoard).filter(
+        PressWeeklyBoard.plan_version_id < version.plan_version_id
+    ).delete(synchronize_session=False)
+    db.commit()
+
+    try:
+        materialize_press_weekly_board(db, version.plan_version_id, working_hours)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"プレス週間予定表の作成に失敗 (plan_version_id: {version.plan_version_id}): {str(e)}")
+
+    return version
@@ -0,0 +1,295 @@
+"""
+プレスの計画と実績の突き合わせ（稼働率・性能・計画達成率）
+
+ラズパイと機械の対応（iot_raspi_machines）で、分単位のショット数ロールアップを機械に割り当て、
+公開済みの production_schedule のタスク区間と1分単位で突き合わせる
+
+- シフトはガントチャートと同じく1日1シフト（6:00〜6:00+稼働時間、休憩・休日を除く）
+- 計算は機械ごとに (日, 分) の配列にまとめ、NumPyで集計する
+  - 計画分:   タスク区間の稼働分（段取りはタスク開始からの稼働時間の先頭 setup_time 分）
+  - 稼働分:   計画分のうちショットのあった分
+  - 稼働率 (availability) = 稼働分 / 計画分
+  - 性能 (performance)    = ショット数 / (稼働分 × 計画SPM)（SPM工程の加工分のみ）
+  - 計画達成率 (attainment) = 実績数（ショット数 × キャビティ数）/ 計画数（po_quantity を加工分に均等配分）
+- 前日以前の結果は日ごとにプロセス内にキャッシュする
+  （計画・工程・休日・ラズパイの対応が変わった場合は table_change_counters のバージョンで、
+    遅れて届いたショットでロールアップが増えた場合はその日の日次ロールアップの合計で作り直す）
+"""
+
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+import calendar
+import threading
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..models import Calendar, Process, ProcessNameType, ProductionSchedule
+from ..models.factory import MachineList
+from ..models.iot_press_event import IotPressShotRollup, IotRaspiMachine
+from ..utils.conditional_get import get_table_versions
+from .gantt import WORK_START_HOUR, build_working_minute_prefix
+from .iot_rollup import LOCAL_OFFSET_MS
+from .plan_inputs import load_holiday_set
+from .production_scheduler import VIETNAM_TZ
+
+# 1回に集計できる最大日数
+OEE_MAX_DAYS = 62
+
+# 結果が依存するテーブル（いずれかが変更されるとキャッシュを使わない）
+OEE_TABLES = (
+    ProductionSchedule.__tablename__,
+    Process.__tablename__,
+    ProcessNameType.__tablename__,
+    Calendar.__tablename__,
+    IotRaspiMachine.__tablename__,
+)
+
+# キャッシュする日数（日 × 稼働時間 × バージョン × ショット数合計）
+OEE_CACHE_SIZE = 400
+
+_cache_lock = threading.Lock()
+_day_cache: "OrderedDict[Tuple[date, int, str, int], List[Dict]]" = OrderedDict()
+
+
+def local_day_start_ms(day: date) -> int:
+    """ベトナム時間の0:00（ms）"""
+    return calendar.timegm(day.timetuple()) * 1000 - LOCAL_OFFSET_MS
+
+
+def _ratio(numerator: float, denominator: float) -> Optional[float]:
+    return round(float(numerator) / float(denominator), 4) if denominator else None
+
+
+def _day_shot_totals(db: Session, days: List[date]) -> Dict[date, int]:
+    """日ごとの全ラズパイのショット数合計（日次ロールアップ、キャッシュの作り直し判定用）"""
+    start_ms = local_day_start_ms(days[0])
+    rows = db.query(
+        IotPressShotRollup.bucket_start_ms,
+        func.sum(IotPressShotRollup.shot_count)
+    ).filter(
+        IotPressShotRollup.resolution == "day",
+        IotPressShotRollup.bucket_start_ms >= start_ms,
+        IotPressShotRollup.bucket_start_ms < local_day_start_ms(days[-1]) + 86_400_000
+    ).group_by(IotPressShotRollup.bucket_start_ms).all()
+    totals = {bucket_start_ms: int(total or 0) for bucket_start_ms, total in rows}
+    return {day: totals.get(local_day_start_ms(day), 0) for day in days}
+
+
+def _compute_days(db: Session, first: date, last: date, working_hours: int) -> Dict[date, List[Dict]]:
+    """first〜last（含む）の機械ごと・日ごとの集計"""
+    report_days = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+    mappings = db.query(
+        IotRaspiMachine.raspi_no,
+        IotRaspiMachine.machine_list_id,
+        MachineList.machine_no
+    ).join(MachineList, MachineList.machine_list_id == IotRaspiMachine.machine_list_id).all()
+    if not mappings:
+        return {day: [] for day in report_days}
+
+    machine_ids = sorted({m.machine_list_id for m in mappings})
+    machine_index = {machine_id: i for i, machine_id in enumerate(machine_ids)}
+    machine_nos = {m.machine_list_id: m.machine_no for m in mappings}
+    raspi_machine = {m.raspi_no: machine_index[m.machine_list_id] for m in mappings}
+
+    range_start = datetime.combine(first, time())
+    range_end = datetime.combine(last + timedelta(days=1), time())
+    tasks = db.query(
+        ProductionSchedule.machine_list_id,
+        ProductionSchedule.planned_start_datetime,
+        ProductionSchedule.planned_end_datetime,
+        ProductionSchedule.setup_time,
+        ProductionSchedule.po_quantity,
+        Process.rough_cycletime,
+        Process.cavity,
+        ProcessNameType.day_or_spm
+    ).join(
+        Process, Process.process_id == ProductionSchedule.process_id
+    ).outerjoin(
+        ProcessNameType, Process.process_name_id == ProcessNameType.process_name_id
+    ).filter(
+        ProductionSchedule.machine_list_id.in_(machine_ids),
+        ProductionSchedule.planned_start_datetime < range_end,
+        ProductionSchedule.planned_end_datetime > range_start
+    ).all()
+
+    # 段取り・計画数の配分はタスク全体で決まるため、期間外にはみ出すタスクも含めた範囲で配列を作る
+    origin = min([range_start] + [t.planned_start_datetime.replace(hour=0, minute=0, second=0, microsecond=0) for t in tasks])
+    end = max([range_end] + [
+        datetime.combine(t.planned_end_datetime.date() + timedelta(days=1), time()) for t in tasks
+    ])
+    days = (end - origin).days
+    total = days * 1440
+
+    working = np.diff(np.asarray(
+        build_working_minute_prefix(origin, days, working_hours, load_holiday_set(db)), dtype=np.int32
+    )).astype(bool)
+    working_minutes = working.reshape(days, 1440).sum(axis=1)
+
+    tasks_by_machine: Dict[int, List] = {}
+    for task in tasks:
+        tasks_by_machine.setdefault(machine_index[task.machine_list_id], []).append(task)
+
+    # 分単位のショット数（期間内のみ）
+    offset = (range_start - origin).days * 1440
+    range_start_ms = local_day_start_ms(first)
+    rollups = db.query(
+        IotPressShotRollup.raspi_no,
+        IotPressShotRollup.bucket_start_ms,
+        IotPressShotRollup.shot_count
+    ).filter(
+        IotPressShotRollup.resolution == "minute",
+        IotPressShotRollup.raspi_no.in_(list(raspi_machine)),
+        IotPressShotRollup.bucket_start_ms >= range_start_ms,
+        IotPressShotRollup.bucket_start_ms < range_start_ms + len(report_days) * 86_400_000
+    ).all()
+    rollups_by_machine: Dict[int, List] = {}
+    for r in rollups:
+        rollups_by_machine.setdefault(raspi_machine[r.raspi_no], []).append(r)
+
+    # (機械, 日) ごとの集計値
+    stat_shape = (len(machine_ids), days)
+    planned_minutes = np.zeros(stat_shape)
+    setup_minutes = np.zeros(stat_shape)
+    run_minutes = np.zeros(stat_shape)
+    shots_total = np.zeros(stat_shape)
+    shots_in_plan = np.zeros(stat_shape)
+    actual_quantity = np.zeros(stat_shape)
+    plan_quantity = np.zeros(stat_shape)
+    measured_shots = np.zeros(stat_shape)
+    ideal_shots = np.zeros(stat_shape)
+
+    # (日, 分) にして日ごとに集計
+    def per_day(values: np.ndarray) -> np.ndarray:
+        return values.reshape(days, 1440).sum(axis=1)
+
+    # 機械ごとに分単位の配列を作る（機械 × 分の配列は期間と台数によってはメモリを使いすぎるため）
+    for m in range(len(machine_ids)):
+        planned = np.zeros(total, dtype=bool)
+        setup = np.zeros(total, dtype=bool)
+        planned_quantity = np.zeros(total)
+        ideal_spm = np.zeros(total)
+        cavity = np.ones(total)
+
+        for task in tasks_by_machine.get(m, []):
+            start = int((task.planned_start_datetime - origin).total_seconds() // 60)
+            stop = int((task.planned_end_datetime - origin).total_seconds() // 60)
+            work_minutes = np.flatnonzero(working[start:stop]) + start
+            setup_count = int(round(float(task.setup_time or 0)))
+            production_minutes = work_minutes[setup_count:]
+
+            planned[work_minutes] = True
+            setup[work_minutes[:setup_count]] = True
+            cavity[work_minutes] = task.cavity or 1
+            if len(production_minutes):
+                planned_quantity[production_minutes] += task.po_quantity / len(production_minutes)
+                if task.day_or_spm is True and task.rough_cycletime:
+                    ideal_spm[production_minutes] = float(task.rough_cycletime)
+
+        shots = np.zeros(total)
+        machine_rollups = rollups_by_machine.get(m)
+        if machine_rollups:
+            columns = np.array([(r.bucket_start_ms - range_start_ms) // 60_000 + offset for r in machine_rollups])
+            np.add.at(shots, columns, np.array([r.shot_count for r in machine_rollups], dtype=float))
+
+        in_plan = planned & working
+        running = (shots > 0) & working
+        running_in_plan = running & in_plan
+        measured = running_in_plan & (ideal_spm > 0)
+
+        planned_minutes[m] = per_day(in_plan)
+        setup_minutes[m] = per_day(setup & working)
+        run_minutes[m] = per_day(running_in_plan)
+        shots_total[m] = per_day(shots * working)
+        shots_in_plan[m] = per_day(shots * in_plan)
+        actual_quantity[m] = per_day(shots * cavity * in_plan)
+        plan_quantity[m] = per_day(planned_quantity)
+        measured_shots[m] = per_day(shots * measured)
+        ideal_shots[m] = per_day(ideal_spm * measured)
+
+    shift_start = f"{WORK_START_HOUR:02d}:00"
+    shift_end = f"{WORK_START_HOUR + working_hours:02d}:00"
+    results: Dict[date, List[Dict]] = {}
+    for day in report_days:
+        d = (day - origin.date()).days
+        entries = []
+        for m, machine_id in enumerate(machine_ids):
+            availability = _ratio(run_minutes[m, d], planned_minutes[m, d])
+            performance = _ratio(measured_shots[m, d], ideal_shots[m, d])
+            entries.append({
+                "machine_list_id": machine_id,
+                "machine_no": machine_nos[machine_id],
+                "date": day.isoformat(),
+                "shift_start": shift_start,
+                "shift_end": shift_end,
+                "working_minutes": int(working_minutes[d]),
+                "planned_minutes": int(planned_minutes[m, d]),
+                "setup_minutes": int(setup_minutes[m, d]),
+                "run_minutes": int(run_minutes[m, d]),
+                "shots": int(shots_total[m, d]),
+                "unplanned_shots": int(shots_total[m, d] - shots_in_plan[m, d]),
+                "planned_quantity": round(float(plan_quantity[m, d]), 1),
+                "actual_quantity": int(actual_quantity[m, d]),
+                "availability": availability,
+                "performance": performance,
+                "attainment": _ratio(actual_quantity[m, d], plan_quantity[m, d]),
+                "oee": round(availability * performance, 4) if availability is not None and performance is not None else None,
+            })
+        results[day] = entries
+    return results
+
+
+def compute_press_oee(
+    db: Session,
+    start_date: date,
+    end_date: date,
+    working_hours: int = 8,
+    machine_list_ids: Optional[List[int]] = None
+) -> List[Dict]:
+    """
+    機械ごと・日（シフト）ごとの計画と実績
+
+    Raises: ValueError 期間が不正な場合
+    """
+    if end_date < start_date:
+        raise ValueError("end_date must be on or after start_date")
+    if (end_date - start_date).days + 1 > OEE_MAX_DAYS:
+        raise ValueError(f"Period must be {OEE_MAX_DAYS} days or less")
+
+    today = datetime.now(VIETNAM_TZ).date()
+    version, _ = get_table_versions(db, OEE_TABLES)
+    days = [start_date + timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+    shot_totals = _day_shot_totals(db, days)
+
+    def cache_key(day: date) -> Tuple[date, int, str, int]:
+        return (day, working_hours, version, shot_totals[day])
+
+    by_day: Dict[date, List[Dict]] = {}
+    with _cache_lock:
+        for day in days:
+            cached = _day_cache.get(cache_key(day))
+            if cached is not None and day < today:
+                _day_cache.move_to_end(cache_key(day))
+                by_day[day] = cached
+
+    missing = [day for day in days if day not in by_day]
+    if missing:
+        computed = _compute_days(db, missing[0], missing[-1], working_hours)
+        with _cache_lock:
+            for day in missing:
+                by_day[day] = computed[day]
+                # 当日以降は実績が増えるためキャッシュしない
+                if day < today:
+                    _day_cache[cache_key(day)] = computed[day]
+            while len(_day_cache) > OEE_CACHE_SIZE:
+                _day_cache.popitem(last=False)
+
+    return [
+        entry
+        for day in days
+        for entry in by_day[day]
+        if not machine_list_ids or entry["machine_list_id"] in machine_list_ids
+    ]
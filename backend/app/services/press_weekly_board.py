@@ -0,0 +1,293 @@
+"""
+プレス週間予定表
+
+production_schedule のPRESS工程を機械ごと・日付ごとにまとめた予定表を作成する
+（日をまたぐタスクの分割、日ごとの生産数・累積生産数、生産締切日）
+
+計画公開時に press_weekly_boards へ保存し、画面表示時は1回の読込で返す
+予定表は計画バージョン単位で保存されるため、新しい計画が公開されると古い予定表は使われない
+PO・製品・顧客・機械などのマスタは計画を公開せずに変更されるため、作成時の変更カウンター（source_version）も保存し、
+表示時にカウンターが変わっていれば作り直す
+"""
+
+from datetime import datetime, timedelta, date
+from typing import Dict, List, Optional
+import logging
+
+from sqlalchemy import func, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..models import (
+    PO, Process, ProcessNameType, Product, Customer, ProductionSchedule,
+    ProductionPlanVersion, PressWeeklyBoard
+)
+from ..models.factory import MachineList, MachineType
+from .production_scheduler import ProductionScheduler, VIETNAM_TZ
+from .deadline_service import get_plan_deadlines, DEADLINE_TABLES
+from ..utils.conditional_get import get_table_versions
+
+logger = logging.getLogger(__name__)
+
+BOARD_DAYS = 7
+
+# 予定表の内容に使うマスタ（締切日の計算対象 + 顧客名・機械一覧）
+BOARD_SOURCE_TABLES = DEADLINE_TABLES + (
+    Customer.__tablename__,
+    MachineList.__tablename__,
+    MachineType.__tablename__,
+)
+
+
+def get_board_source_version(db: Session) -> str:
+    """予定表の元になるマスタの変更カウンター"""
+    version, _ = get_table_versions(db, BOARD_SOURCE_TABLES)
+    return version
+
+
+def build_press_weekly_board(db: Session, working_hours: int = 8) -> Dict:
+    """
+    production_schedule からプレス週間予定表を作成
+
+    Returns: {'dates': [...], 'machines': [...], 'schedule': {machine_no: {date: [task, ...]}}}
+    """
+    # スケジュールが存在する場合は最も早い日付を開始日とする
+    earliest_schedule = db.query(func.min(ProductionSchedule.planned_start_datetime)).scalar()
+    if earliest_schedule:
+        today = earliest_schedule.date()
+    else:
+        today = datetime.now(VIETNAM_TZ).date()
+
+    dates = [(today + timedelta(days=i)).isoformat() for i in range(BOARD_DAYS)]
+    end_date = today + timedelta(days=BOARD_DAYS)
+
+    press_machines = db.query(MachineList).join(MachineType).filter(
+        MachineType.machine_type_name == 'PRESS'
+    ).order_by(MachineList.machine_no).all()
+
+    # PRESS工程のスケジュールと表示項目を1クエリで取得
+    rows = db.query(
+        ProductionSchedule,
+        MachineList.machine_no,
+        PO,
+        Product,
+        Customer.customer_name,
+        ProcessNameType.process_name,
+        Process.process_no
+    )\
+        .join(MachineList, ProductionSchedule.machine_list_id == MachineList.machine_list_id)\
+        .join(MachineType, MachineList.machine_type_id == MachineType.machine_type_id)\
+        .join(PO, ProductionSchedule.po_id == PO.po_id)\
+        .join(Product, PO.product_id == Product.product_id)\
+        .outerjoin(Customer, Product.customer_id == Customer.customer_id)\
+        .join(Process, ProductionSchedule.process_id == Process.process_id)\
+        .outerjoin(ProcessNameType, Process.process_name_id == ProcessNameType.process_name_id)\
+        .filter(
+            and_(
+                MachineType.machine_type_name == 'PRESS',
+                ProductionSchedule.planned_start_datetime >= today,
+                ProductionSchedule.planned_start_datetime < end_date
+            )
+        )\
+        .order_by(ProductionSchedule.planned_start_datetime.asc())\
+        .all()
+
+    scheduler = ProductionScheduler(db, working_hours=working_hours)
+
+    # 製品ごとのPO数合計と生産締切日は締切日サービスから取得
+    deadlines = get_plan_deadlines(db)
+
+    schedule_dict: Dict[str, Dict[str, List[Dict]]] = {
+        machine.machine_no: {date_str: [] for date_str in dates}
+        for machine in press_machines
+    }
+    work_end_hour = 6 + working_hours
+
+    for row in rows:
+        schedule = row.ProductionSchedule
+        po = row.PO
+        product = row.Product
+
+        demand = deadlines.demand.get(product.product_id)
+        total_po_quantity = demand['total_po_quantity'] if demand else 0
+        if total_po_quantity == 0:
+            total_po_quantity = po.po_quantity
+
+        production_deadline = deadlines.deadline_for(
+            product.product_id, po.delivery_date, total_po_quantity, working_hours
+        )
+
+        # タイムゾーン情報を統一（タイムゾーン非対応に変換）
+        planned_start_naive = schedule.planned_start_datetime.replace(tzinfo=None)
+        planned_end_naive = schedule.planned_end_datetime.replace(tzinfo=None)
+        start_date = planned_start_naive.date()
+        last_date = planned_end_naive.date()
+
+        total_duration_minutes = scheduler.calculate_working_minutes_in_range(planned_start_naive, planned_end_naive)
+        schedule_quantity = schedule.po_quantity
+        schedule_processing_time = float(schedule.processing_time or 0)
+        setup_time = float(schedule.setup_time or 0)
+
+        machine_days = schedule_dict.setdefault(row.machine_no, {date_str: [] for date_str in dates})
+
+        # 日をまたぐ場合は各日ごとに分割
+        current_date = start_date
+        cumulative_quantity = 0
+
+        while current_date <= last_date:
+            date_str = current_date.isoformat()
+            if date_str not in machine_days:
+                current_date = current_date + timedelta(days=1)
+                continue
+
+            if current_date == start_date:
+                day_start = planned_start_naive
+            else:
+                day_start = datetime.combine(current_date, datetime.min.time().replace(hour=6, minute=0))
+
+            if current_date == last_date:
+                day_end = planned_end_naive
+            else:
+                day_end = datetime.combine(current_date, datetime.min.time().replace(hour=work_end_hour, minute=0))
+
+            day_duration_minutes = scheduler.calculate_working_minutes_in_range(day_start, day_end)
+
+            # 1日で完了する場合はそのまま、複数日にまたがる場合は作業時間の比率で按分
+            if start_date == last_date:
+                day_quantity = schedule_quantity
+                day_processing_time = schedule_processing_time
+            elif total_duration_minutes > 0:
+                ratio = day_duration_minutes / total_duration_minutes
+                day_quantity = int(ratio * schedule_quantity)
+                day_processing_time = ratio * schedule_processing_time
+            else:
+                day_quantity = 0
+                day_processing_time = 0
+
+            cumulative_quantity += day_quantity
+            # 最終日は端数調整（累積がスケジュール数量と一致するように）
+            if current_date == last_date:
+                cumulative_quantity = schedule_quantity
+
+            # 段取り時間の表示（初日に開始段取り80%、最終日に終了段取り20%）
+            initial_setup_range = None
+            final_setup_range = None
+            if current_date == start_date and setup_time > 0:
+                initial_setup_end = day_start + timedelta(minutes=setup_time * 0.8)
+                initial_setup_range = f"{day_start.strftime('%H:%M')}-{initial_setup_end.strftime('%H:%M')}"
+                if current_date == last_date:
+                    final_setup_start = day_end - timedelta(minutes=setup_time * 0.2)
+                    final_setup_range = f"{final_setup_start.strftime('%H:%M')}-{day_end.strftime('%H:%M')}"
+
+            machine_days[date_str].append({
+                "product_code": product.product_code,
+                "customer_name": row.customer_name or "-",
+                "process_name": row.process_name or "-",
+                "process_no": row.process_no if row.process_no is not None else 999,
+                "po_quantity": total_po_quantity,
+                "day_quantity": day_quantity,
+                "cumulative_quantity": cumulative_quantity,
+                "delivery_date": po.delivery_date.strftime("%d/%m/%Y") if po.delivery_date else "-",
+                "production_deadline": production_deadline.strftime("%d/%m/%Y"),
+                "planned_end_datetime": planned_end_naive.strftime("%d/%m/%Y %H:%M"),
+                "start_time": day_start.strftime("%H:%M"),
+                "end_time": day_end.strftime("%H:%M"),
+                "setup_time": setup_time if current_date == start_date else 0,
+                "processing_time": float(day_processing_time),
+                "is_split": start_date != last_date,
+                "split_info": f"{(current_date - start_date).days + 1}/{(last_date - start_date).days + 1}" if start_date != last_date else None,
+                "initial_setup_range": initial_setup_range,
+                "final_setup_range": final_setup_range
+            })
+
+            current_date = current_date + timedelta(days=1)
+
+    return {
+        "dates": dates,
+        "machines": [
+            {
+                "machine_no": m.machine_no,
+                "machine_list_id": m.machine_list_id
+            }
+            for m in press_machines
+        ],
+        "schedule": schedule_dict
+    }
+
+
+def materialize_press_weekly_board(
+    db: Session,
+    plan_version_id: int,
+    working_hours: int = 8
+) -> Dict:
+    """
+    予定表を作成して計画バージョンに紐づけて保存（既存があれば置き換え）
+
+    Raises: IntegrityError 同じ予定表が同時に作成された場合（ロールバック済み）
+    """
+    # 作成前にカウンターを読む（作成中のマスタ変更は次回の表示で作り直される）
+    source_version = get_board_source_version(db)
+    board = build_press_weekly_board(db, working_hours)
+
+    db.query(PressWeeklyBoard).filter(
+        and_(
+            PressWeeklyBoard.plan_version_id == plan_version_id,
+            PressWeeklyBoard.working_hours == working_hours
+        )
+    ).delete(synchronize_session=False)
+    db.add(PressWeeklyBoard(
+        plan_version_id=plan_version_id,
+        working_hours=working_hours,
+        start_date=date.fromisoformat(board["dates"][0]),
+        source_version=source_version,
+        board=board
+    ))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise
+
+    return board
+
+
+def get_press_weekly_board(db: Session, working_hours: int = 8) -> Dict:
+    """
+    現在の計画バージョンの予定表を取得
+
+    保存済みの予定表があり、マスタが変更されていなければ1回の読込で返す
+    未作成（別の稼働時間での表示、公開時の作成失敗など）やマスタ変更後の場合はここで作成して保存する
+    """
+    latest_version_id = db.query(func.max(ProductionPlanVersion.plan_version_id)).scalar_subquery()
+    stored = db.query(
+        PressWeeklyBoard.plan_version_id,
+        PressWeeklyBoard.source_version,
+        PressWeeklyBoard.board
+    ).filter(
+        and_(
+            PressWeeklyBoard.plan_version_id == latest_version_id,
+            PressWeeklyBoard.working_hours == working_hours
+        )
+    ).first()
+
+    if stored and stored.source_version == get_board_source_version(db):
+        return {**stored.board, "plan_version_id": stored.plan_version_id}
+
+    plan_version_id: Optional[int] = db.query(func.max(ProductionPlanVersion.plan_version_id)).scalar()
+    if plan_version_id is None:
+        # 計画バージョン導入前に生成された計画 → 保存せずに作成して返す
+        return {**build_press_weekly_board(db, working_hours), "plan_version_id": None}
+
+    try:
+        board = materialize_press_weekly_board(db, plan_version_id, working_hours)
+    except IntegrityError:
+        # 同時に表示された別のリクエストが先に保存した → 保存された予定表を返す
+        logger.info(f"プレス週間予定表は別のリクエストで作成済み (plan_version_id: {plan_version_id})")
+        stored = db.query(PressWeeklyBoard.board).filter(
+            and_(
+                PressWeeklyBoard.plan_version_id == plan_version_id,
+                PressWeeklyBoard.working_hours == working_hours
+            )
+        ).first()
+        board = stored.board if stored else build_press_weekly_board(db, working_hours)
+    return {**board, "plan_version_id": plan_version_id}
@@ -19,17 +19,31 @@ import time
 
 # ロガー設定
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
-logger.setLevel(logging.DEBUG)
 
 from ..models import (
     PO, Process, ProcessNameType, MachineList, MachineType,
-    Calendar, Product, ProductionSchedule, FinishedProduct
+    Calendar, Product, ProductionSchedule, FinishedProduct, Cycletime,
+    BrokenMold
 )
+from .decision_trace import DecisionTrace
+from .deadline_service import WORKING_MINUTES_MAP, estimate_process_minutes, get_plan_deadlines
 
 # ベトナム時間（UTC+7）のタイムゾーン
 VIETNAM_TZ = pytz.timezone('Asia/Ho_Chi_Minh')
 
+# スケジューリング戦略の登録（戦略名: (メソッド名, 説明)）
+# generate_constrained_schedule は v2 のフェーズ1のため単独では登録しない
+SCHEDULING_STRATEGIES: Dict[str, Tuple[str, str]] = {
+    'by_deadline': ('generate_schedule_by_deadline', '生産締切日優先（製品単位 + PO数合計方式）'),
+    'v2': ('generate_schedule_v2', '2段階構成（日次の制約工程 → 制約なし工程）'),
+    'old': ('generate_schedule_old', '旧アルゴリズム（プレス機の早期充填）'),
+}
+DEFAULT_STRATEGY = 'by_deadline'
+
+# 修理完了日が未定の金型を割当不可とする期間（date_broken からの日数）
+# これより古い記録は修理済みで日付が入力されていないものとみなし、計画では無視する
+UNDATED_MOLD_BLOCK_DAYS = 30
+
 
 class ProductionScheduler:
     """生産計画スケジューラー"""
@@ -37,17 +51,8 @@ class ProductionScheduler:
     def __init__(self, db: Session, working_hours: int = 8, resource_constraints: Dict = None):
         self.db = db
         self.working_hours = working_hours
-        # 実稼働分数マップ（休憩時間を除いた実作業時間）
-        # 休憩時間帯は add_working_time メソッドで自動的にスキップされる
-        # - 昼休憩: 10:00-10:40（40分）- 全稼働時間
-        # - 追加休憩: 14:00-14:30（30分）- 11時間以上稼働の場合のみ
-        self.working_minutes_map = {
-            8: 440,   # 8時間稼働（6:00-14:00）、実稼働440分（昼休憩40分除く）
-            9: 500,   # 9時間稼働（6:00-15:00）、実稼働500分（昼休憩40分除く）
-            10: 560,  # 10時間稼働（6:00-16:00）、実稼働560分（昼休憩40分除く）
-            11: 590,  # 11時間稼働（6:00-17:00）、実稼働590分（昼休憩40分+追加休憩30分除く）
-            12: 650,  # 12時間稼働（6:00-18:00）、実稼働650分（昼休憩40分+追加休憩30分除く）
-        }
+        # 実稼働分数マップ（休憩時間を除いた実作業時間、締切日サービスと共通）
+        self.working_minutes_map = dict(WORKING_MINUTES_MAP)
 
         # リソース制約のデフォルト設定
         if resource_constraints is None:
@@ -82,6 +87,28 @@ class ProductionScheduler:
         self._process_type_cache: Dict[str, Optional[bool]] = {}
         self._load_process_type_cache()
 
+        # 休日キャッシュ（is_working_dayのDBクエリ削減のため）
+        self._holiday_cache: set = set()
+        self._load_holiday_cache()
+
+        # 機械別サイクルタイムキャッシュ（cycletimesテーブル）
+        self._cycletime_cache: Dict[Tuple[int, int], Decimal] = {}
+        # {(process_id, machine_list_id): cycle_time}
+        self._cycletime_process_ids: set = set()
+        self._load_cycletime_cache()
+
+        # 金型修理期間インデックス（broken_moldテーブル）
+        self._mold_downtime: Dict[int, List[Tuple[datetime, datetime]]] = {}
+        # {process_id: [(修理開始, 使用可能になる日時), ...]}（開始時刻順）
+        self._mold_blocked_process_ids: set = set()
+        # 修理予定日が未定の工程（今回の計画では割当不可）
+        self._load_mold_downtime_cache()
+
+        # 判断トレース（Noneの場合は記録しない）
+        self.trace: Optional[DecisionTrace] = None
+        # 記録時に付与する呼び出し元の情報（製品コード・締切日順位・締切日）
+        self._trace_context: Dict = {}
+
         # 工程のスケジュール状態
         self.process_schedule_status: Dict[Tuple[int, int], str] = {}
         # {(product_id, process_no): 'pending'|'in_progress'|'completed'}
@@ -112,16 +139,149 @@ class ProductionScheduler:
         """キャッシュからProcessTypeを取得"""
         return self._process_type_cache.get(process_name)
 
+    def _load_holiday_cache(self):
+        """休日カレンダーをキャッシュにロード（初期化時に1回だけ実行）"""
+        holidays = self.db.query(Calendar.date_holiday).all()
+        self._holiday_cache = {h.date_holiday for h in holidays}
+        logger.debug(f"休日キャッシュロード完了: {len(self._holiday_cache)}件")
+
+    def _load_cycletime_cache(self):
+        """
+        機械別サイクルタイムをキャッシュにロード（初期化時に1回だけ実行）
+
+        cycletimesテーブルは (product_id, process_name, press_no) 単位のため、
+        工程マスターと機械リストに結合して (process_id, machine_list_id) に変換する
+        """
+        rows = self.db.query(
+            Process.process_id,
+            MachineList.machine_list_id,
+            Cycletime.cycle_time
+        ).select_from(Process).join(
+            ProcessNameType, Process.process_name_id == ProcessNameType.process_name_id
+        ).join(
+            Cycletime, and_(
+                Cycletime.product_id == Process.product_id,
+                Cycletime.process_name == ProcessNameType.process_name
+            )
+        ).join(
+            MachineList, MachineList.machine_no == Cycletime.press_no
+        ).all()
+
+        for row in rows:
+            if row.cycle_time and row.cycle_time > 0:
+                self._cycletime_cache[(row.process_id, row.machine_list_id)] = row.cycle_time
+                self._cycletime_process_ids.add(row.process_id)
+        logger.debug(f"サイクルタイムキャッシュロード完了: {len(self._cycletime_cache)}件")
+
+    def _load_mold_downtime_cache(self):
+        """
+        金型修理期間をキャッシュにロード（初期化時に1回だけ実行）
+
+        修理予定日（date_schedule_repaired）、なければ修理希望日（date_hope_repaired）を
+        修理完了日とし、date_broken 0:00 から修理完了日の翌日 0:00 までを使用不可とする
+        修理完了日が未定の工程は今回の計画では割当不可として扱う
+        （date_broken から UNDATED_MOLD_BLOCK_DAYS 日以内の記録のみ、古い記録はログに出して無視）
+        """
+        today = self.get_vietnam_today()
+        undated_cutoff = today - timedelta(days=UNDATED_MOLD_BLOCK_DAYS)
+        broken_molds = self.db.query(BrokenMold).all()
+
+        for bm in broken_molds:
+            repaired_date = bm.date_schedule_repaired or bm.date_hope_repaired
+
+            if repaired_date is None:
+                if bm.date_broken < undated_cutoff:
+                    logger.warning(
+                        f"修理完了日が未定の古い金型故障記録を無視 "
+                        f"(broken_mold_id: {bm.broken_mold_id}, process_id: {bm.process_id}, "
+                        f"date_broken: {bm.date_broken})"
+                    )
+                    continue
+                self._mold_blocked_process_ids.add(bm.process_id)
+                continue
+
+            # 既に修理が完了している期間は対象外
+            if repaired_date < today or repaired_date < bm.date_broken:
+                continue
+
+            window_start = datetime.combine(bm.date_broken, datetime.min.time())
+            window_end = datetime.combine(repaired_date + timedelta(days=1), datetime.min.time())
+            self._mold_downtime.setdefault(bm.process_id, []).append((window_start, window_end))
+
+        for windows in self._mold_downtime.values():
+            windows.sort()
+
+        logger.debug(
+            f"金型修理期間ロード完了: {len(self._mold_downtime)}工程, "
+            f"修理日未定: {len(self._mold_blocked_process_ids)}工程"
+        )
+
+    def is_mold_blocked(self, process_id: int) -> bool:
+        """修理完了日が未定の金型を使う工程か"""
+        return process_id in self._mold_blocked_process_ids
+
+    def get_mold_available_time(self, process_id: int, start_dt: datetime) -> datetime:
+        """start_dt以降で金型が使用可能になる最初の日時を取得"""
+        current = start_dt
+        for window_start, window_end in self._mold_downtime.get(process_id, []):
+            if window_start <= current < window_end:
+                current = window_end
+        return current
+
+    def get_mold_conflict_end(
+        self,
+        process_id: int,
+        start_dt: datetime,
+        end_dt: datetime
+    ) -> Optional[datetime]:
+        """
+        [start_dt, end_dt) が金型修理期間と重なる場合、その修理期間の終了日時を返す
+        重ならなければNone
+        """
+        for window_start, window_end in self._mold_downtime.get(process_id, []):
+            if window_start < end_dt and start_dt < window_end:
+                return window_end
+        return None
+
+    def get_mold_downtime_start(
+        self,
+        process_id: int,
+        start_dt: datetime,
+        end_dt: datetime
+    ) -> Optional[datetime]:
+        """
+        (start_dt, end_dt) の途中で金型修理期間が始まる場合、その開始日時を返す
+        始まらなければNone
+        """
+        for window_start, _ in self._mold_downtime.get(process_id, []):
+            if start_dt < window_start < end_dt:
+                return window_start
+        return None
+
+    def get_cycle_rate(self, process: Process, machine_id: Optional[int] = None):
+        """
+        工程の生産レートを取得
+
+        機械が指定され、cycletimesに機械別の値があればそれを優先
+        なければ工程マスターのrough_cycletimeを使用
+        """
+        if machine_id is not None:
+            rate = self._cycletime_cache.get((process.process_id, machine_id))
+            if rate:
+                return rate
+        return process.rough_cycletime
+
+    def has_machine_cycletimes(self, process: Process) -> bool:
+        """工程に機械別サイクルタイムが登録されているか"""
+        return process.process_id in self._cycletime_process_ids
+
     def get_working_minutes(self, hours: int) -> int:
         """稼働時間から実稼働分数を計算（休憩時間を除く）"""
         return self.working_minutes_map.get(hours, hours * 60)
 
     def is_working_day(self, date_to_check: date) -> bool:
         """指定された日が稼働日（休日でない）かチェック"""
-        holiday = self.db.query(Calendar).filter(
-            Calendar.date_holiday == date_to_check
-        ).first()
-        return holiday is None
+        return date_to_check not in self._holiday_cache
 
     def skip_break_times(self, current_dt: datetime) -> datetime:
         """
@@ -313,71 +473,49 @@ class ProductionScheduler:
     def calculate_process_time(
         self,
         process: Process,
-        po_quantity: int
+        po_quantity: int,
+        machine_id: Optional[int] = None
     ) -> Tuple[float, float]:
         """
         工程の所要時間を計算
+        machine_idを指定した場合、SPM工程は機械別サイクルタイムを使用
         Returns: (setup_time分, processing_time分)
         """
         # 工程タイプをキャッシュから取得
         process_type = self._get_process_type(process.process_name)
 
-        setup_time = float(process.setup_time or 0)
-
-        if process_type is True:  # SPM
-            # SPM: 1分間あたりの生産数（例: SPM60 = 1分間に60個）
-            # 処理時間（分） = 数量 ÷ (SPM × 安全係数)
-            if not process.rough_cycletime or process.rough_cycletime == 0:
-                return setup_time, 0
-
-            safety_factor = Decimal("0.7")
-            # effective_spm = 1分間あたりの実効生産数
-            effective_spm = process.rough_cycletime * safety_factor
-
-            # 総生産時間（分） = 数量 ÷ 実効SPM
-            processing_minutes = float(Decimal(po_quantity) / effective_spm)
-
-            return setup_time, processing_minutes
-
-        elif process_type is False:  # DAY
-            # DAY: rough_cycletime日で production_limit 個生産できる
-            if not process.production_limit or process.production_limit == 0:
-                return setup_time, 0
-
-            import math
-            cycles_needed = math.ceil(po_quantity / process.production_limit)
-            days_per_cycle = float(process.rough_cycletime) if process.rough_cycletime else 1
-            total_days = cycles_needed * days_per_cycle
-
-            # 日数を分に変換（1日 = 稼働時間 × 60分）
-            daily_minutes = self.get_working_minutes(self.working_hours)
-            processing_minutes = total_days * daily_minutes
-
-            return setup_time, processing_minutes
-
-        else:
-            # タイプが不明な場合
-            return setup_time, 0
+        return estimate_process_minutes(
+            process_type,
+            po_quantity,
+            process.setup_time,
+            self.get_cycle_rate(process, machine_id),
+            process.production_limit,
+            process.rough_cycletime,
+            self.get_working_minutes(self.working_hours)
+        )
 
     def calculate_quantity_per_time(
         self,
         process: Process,
-        minutes: float
+        minutes: float,
+        machine_id: Optional[int] = None
     ) -> int:
         """
         指定された時間で処理できる数量を計算
+        machine_idを指定した場合、SPM工程は機械別サイクルタイムを使用
         Returns: 数量
         """
         # 工程タイプをキャッシュから取得
         process_type = self._get_process_type(process.process_name)
 
         if process_type is True:  # SPM
-            if not process.rough_cycletime or process.rough_cycletime == 0:
+            spm = self.get_cycle_rate(process, machine_id)
+            if not spm or spm == 0:
                 return 0
 
             safety_factor = Decimal("0.7")
             # effective_spm = 1分間あたりの実効生産数
-            effective_spm = process.rough_cycletime * safety_factor
+            effective_spm = spm * safety_factor
 
             # 指定時間で処理できる数量 = 時間（分） × 実効SPM
             quantity = int(float(effective_spm) * minutes)
@@ -755,72 +893,28 @@ class ProductionScheduler:
         today = self.get_vietnam_today()
         six_days_before = today - timedelta(days=6)
 
-        # アクティブな製品を取得
-        products = self.db.query(Product).filter(
-            Product.is_active == True
-        ).all()
-
-        target_products = []
-
-        for product in products:
-            # この製品の未配送POを取得
-            earliest_po = self.db.query(PO).filter(
-                and_(
-                    PO.product_id == product.product_id,
-                    PO.is_delivered == False
-                )
-            ).order_by(PO.delivery_date.asc()).first()
-
-            if not earliest_po:
-                continue
-
-            # 基準納期から+28日以内のPOを取得
-            date_limit = earliest_po.delivery_date + timedelta(days=28)
-            relevant_pos = self.db.query(PO).filter(
-                and_(
-                    PO.product_id == product.product_id,
-                    PO.is_delivered == False,
-                    PO.delivery_date >= earliest_po.delivery_date,
-                    PO.delivery_date <= date_limit
-                )
-            ).all()
-
-            # PO数量合計を計算
-            total_po_quantity = sum(po.po_quantity for po in relevant_pos)
+        # 需要・生産数・締切日は締切日サービスから取得（全製品まとめて計算済み）
+        deadlines = get_plan_deadlines(self.db)
+        product_deadlines = deadlines.product_deadlines(self.working_hours)
 
-            # 未出荷の完成品在庫を取得
-            unshipped_finished = self.db.query(
-                func.sum(FinishedProduct.finished_quantity)
-            ).filter(
-                FinishedProduct.product_id == product.product_id,
-                FinishedProduct.is_shipped == False
-            ).scalar() or 0
+        # アクティブで生産数があり、工程が存在する製品
+        candidate_ids = [
+            product_id for product_id, demand in deadlines.demand.items()
+            if demand['is_active'] and demand['production_quantity'] > 0 and deadlines.chains.get(product_id)
+        ]
+        products, pos_by_id, processes_by_product = self._load_target_entities(deadlines, candidate_ids)
 
-            # 生産数 = PO数合計 - 未出荷在庫（0以上を保証）
-            production_quantity = max(0, total_po_quantity - unshipped_finished)
-
-            # 生産数が0の場合はスキップ（在庫で賄える）
-            if production_quantity == 0:
-                continue
-
-            # 工程が存在するか確認
-            processes = self.db.query(Process).filter(
-                Process.product_id == product.product_id
-            ).order_by(Process.process_no.asc()).all()
+        target_products = []
 
-            if not processes:
+        for product_id in candidate_ids:
+            product = products.get(product_id)
+            processes = processes_by_product.get(product_id)
+            if product is None or not processes:
                 continue
 
-            # 総加工日数を計算（小数点あり）- 生産数を使用
-            total_days = self.calculate_total_processing_days(
-                product, production_quantity
-            )
-
-            # 生産締切日を計算（端数切り上げ）
-            production_deadline = self.calculate_production_deadline(
-                earliest_po.delivery_date,
-                total_days
-            )
+            demand = deadlines.demand[product_id]
+            total_days = product_deadlines[product_id]['total_days']
+            production_deadline = product_deadlines[product_id]['deadline']
 
             # 表示用文字列を生成（互換性のため）
             import math
@@ -832,11 +926,11 @@ class ProductionScheduler:
             if production_deadline <= today or production_deadline >= six_days_before:
                 target_products.append({
                     'product': product,
-                    'earliest_po': earliest_po,
-                    'relevant_pos': relevant_pos,
-                    'total_quantity': total_po_quantity,  # PO数合計
-                    'production_quantity': production_quantity,  # 生産数（在庫引き後）
-                    'unshipped_finished': unshipped_finished,  # 未出荷在庫
+                    'earliest_po': pos_by_id[demand['earliest_po_id']],
+                    'relevant_pos': [pos_by_id[po_id] for po_id in demand['po_ids']],
+                    'total_quantity': demand['total_po_quantity'],  # PO数合計
+                    'production_quantity': demand['production_quantity'],  # 生産数（在庫引き後）
+                    'unshipped_finished': demand['unshipped_finished'],  # 未出荷在庫
                     'production_deadline': production_deadline,
                     'total_days': total_days,
                     'remaining_hours': remaining_hours,
@@ -849,6 +943,30 @@ class ProductionScheduler:
 
         return target_products
 
+    def _load_target_entities(self, deadlines, product_ids: List[int]) -> Tuple[Dict, Dict, Dict]:
+        """
+        対象製品の製品・PO・工程をまとめて取得
+
+        Returns: ({product_id: Product}, {po_id: PO}, {product_id: [Process, ...]}（工程番号順）)
+        """
+        if not product_ids:
+            return {}, {}, {}
+
+        products = {
+            p.product_id: p
+            for p in self.db.query(Product).filter(Product.product_id.in_(product_ids)).all()
+        }
+        po_ids = [po_id for product_id in product_ids for po_id in deadlines.demand[product_id]['po_ids']]
+        pos_by_id = {po.po_id: po for po in self.db.query(PO).filter(PO.po_id.in_(po_ids)).all()}
+
+        processes_by_product: Dict[int, List[Process]] = {}
+        for process in self.db.query(Process).filter(
+            Process.product_id.in_(product_ids)
+        ).order_by(Process.product_id, Process.process_no.asc()).all():
+            processes_by_product.setdefault(process.product_id, []).append(process)
+
+        return products, pos_by_id, processes_by_product
+
     def get_target_pos_sorted_by_deadline(self) -> List[Dict]:
         """
         生産締切日の早い順に製品をリスト化（製品単位 + PO数合計方式）
@@ -874,65 +992,55 @@ class ProductionScheduler:
                 'process_details': List[Dict]  # 各工程の詳細
             }
         """
-        # アクティブな製品を取得
-        products = self.db.query(Product).filter(
-            Product.is_active == True
-        ).all()
-
-        target_products_list = []
-
-        for product in products:
-            # === 1. PO数合計を計算（納期から28日後まで） ===
-            po_data = self.calculate_po_total_with_28days(product.product_id)
-            
-            if not po_data['earliest_po']:
-                continue  # POがない製品はスキップ
-
-            # === 2. 生産数を計算（PO数合計 - 在庫） ===
-            production_quantity = self.calculate_production_quantity(
-                product.product_id,
-                po_data['po_total']
-            )
+        # 需要・生産数・締切日は締切日サービスから取得（全製品まとめて計算済み）
+        deadlines = get_plan_deadlines(self.db)
+        product_deadlines = deadlines.product_deadlines(self.working_hours)
 
+        # === 1-3. アクティブで生産数（PO数合計 - 在庫）があり、プレス工程を含む製品 ===
+        candidate_ids = []
+        press_process_ids: Dict[int, set] = {}
+        for product_id, demand in deadlines.demand.items():
             # 生産数が0の場合はスキップ（在庫で賄える）
-            if production_quantity == 0:
+            if not demand['is_active'] or demand['production_quantity'] == 0:
                 continue
 
-            # === 3. 工程を確認 ===
-            processes = self.db.query(Process).filter(
-                Process.product_id == product.product_id
-            ).order_by(Process.process_no.asc()).all()
-
-            if not processes:
+            # プレス工程がない製品はスキップ（プレス優先スケジューリングの対象外）
+            press_ids = {
+                spec.process_id for spec in deadlines.chains.get(product_id, [])
+                if self.is_press_process(spec.process_name)
+            }
+            if not press_ids:
                 continue
 
-            # プレス工程が存在するかチェック
-            press_processes = [p for p in processes if self.is_press_process(p.process_name)]
+            candidate_ids.append(product_id)
+            press_process_ids[product_id] = press_ids
+
+        products, pos_by_id, processes_by_product = self._load_target_entities(deadlines, candidate_ids)
+
+        target_products_list = []
 
-            if not press_processes:
-                # プレス工程がない製品はスキップ（プレス優先スケジューリングの対象外）
+        for product_id in candidate_ids:
+            product = products.get(product_id)
+            processes = processes_by_product.get(product_id)
+            if product is None or not processes:
                 continue
 
-            # === 4. 全工程の加工時間を計算し、締切日を決定 ===
-            deadline_data = self.calculate_all_processes_deadline(
-                product,
-                production_quantity,
-                po_data['earliest_po'].delivery_date
-            )
+            demand = deadlines.demand[product_id]
+            press_processes = [p for p in processes if p.process_id in press_process_ids[product_id]]
 
-            # === 5. データ構造を構築 ===
+            # === 4-5. 締切日（締切日サービスで計算済み）とデータ構造 ===
             target_products_list.append({
                 'product': product,
-                'earliest_po': po_data['earliest_po'],
-                'relevant_pos': po_data['relevant_pos'],
-                'po_total': po_data['po_total'],
-                'production_quantity': production_quantity,
-                'deadline': deadline_data['deadline'],
+                'earliest_po': pos_by_id[demand['earliest_po_id']],
+                'relevant_pos': [pos_by_id[po_id] for po_id in demand['po_ids']],
+                'po_total': demand['total_po_quantity'],
+                'production_quantity': demand['production_quantity'],
+                'deadline': product_deadlines[product_id]['deadline'],
                 'processes': processes,
                 'press_processes': press_processes,
                 'current_process_no': press_processes[0].process_no if press_processes else 0,  # 最初のプレス工程
-                'total_days': deadline_data['total_days'],
-                'process_details': deadline_data['process_details']
+                'total_days': product_deadlines[product_id]['total_days'],
+                'process_details': product_deadlines[product_id]['process_details']
             })
 
         # === 6. 締切日でソート（締切日の早い順） ===
@@ -1151,38 +1259,147 @@ class ProductionScheduler:
         start_time: datetime,
         duration_minutes: float,
         process_id: int,
-        setup_time: float
+        setup_time: float,
+        process: Optional[Process] = None,
+        quantity: Optional[int] = None
     ) -> Tuple[int, datetime, datetime, float]:
         """
         最も早く空くPRESS機を割当
         同じ機械で違う工程の場合は段取り時間を追加
 
+        process と quantity を指定し、その工程に機械別サイクルタイムがある場合は
+        機械ごとの加工時間で終了時刻を比較し、最も早く終わる機械を選ぶ
+
+        金型修理期間と重なる場合は、修理完了後の最初の空きに割り当てる
+
         Returns: (machine_list_id, planned_start, planned_end, actual_setup_time)
         """
-        # 最も早く空く機械を探す
+        if self.is_mold_blocked(process_id):
+            raise ValueError(f"金型の修理完了日が未定のため割当できません (process_id: {process_id})")
+
+        # 金型修理中なら修理完了後から探す
+        start_time = self.get_mold_available_time(process_id, start_time)
+
+        while True:
+            candidates = [] if self.trace is not None else None
+            machine_list_id, planned_start, machine_duration = self._select_press_machine(
+                start_time, duration_minutes, process, quantity, candidates
+            )
+
+            planned_start, additional_setup_time, setup_postponed = self._apply_setup_time(
+                machine_list_id, planned_start, process_id, setup_time
+            )
+
+            # 終了時刻を計算（稼働時間を考慮、段取り時間は既に考慮済み）
+            planned_end = self.add_working_time(planned_start, machine_duration)
+
+            # 加工途中で金型修理期間に入る場合は修理完了後にずらして再探索
+            conflict_end = self.get_mold_conflict_end(process_id, planned_start, planned_end)
+            if conflict_end is None:
+                break
+            start_time = self.get_mold_available_time(process_id, conflict_end)
+
+        # この機械の次の空き時間と最後の工程を更新
+        self.machine_availability[machine_list_id] = planned_end
+        self.machine_last_process[machine_list_id] = process_id
+
+        if self.trace is not None:
+            self.trace.record(
+                'press_assign',
+                self._trace_context.get('product_code'),
+                process_id,
+                process.process_name if process is not None else None,
+                self._trace_context.get('deadline_rank'),
+                self._trace_context.get('deadline'),
+                candidates,
+                machine_list_id,
+                planned_start,
+                planned_end,
+                additional_setup_time,
+                setup_postponed
+            )
+
+        return machine_list_id, planned_start, planned_end, additional_setup_time
+
+    def _select_press_machine(
+        self,
+        start_time: datetime,
+        duration_minutes: float,
+        process: Optional[Process] = None,
+        quantity: Optional[int] = None,
+        candidates: Optional[List[Tuple]] = None
+    ) -> Tuple[int, datetime, float]:
+        """
+        割当先のPRESS機を選択（machine_availabilityは更新しない）
+
+        candidates にリストを渡すと、比較した機械を
+        (machine_list_id, 開始可能時刻, 終了見込み時刻) で追加する（トレース用）
+
+        Returns: (machine_list_id, 開始可能時刻, この機械での加工時間)
+        """
         earliest_machine_list_id = None
         earliest_available_time = None
 
-        for machine_list_id, available_time in self.machine_availability.items():
-            # この機械がいつから使えるか
-            actual_start = max(start_time, available_time)
+        use_machine_rates = (
+            process is not None and
+            quantity is not None and
+            self.has_machine_cycletimes(process)
+        )
 
-            if earliest_available_time is None or actual_start < earliest_available_time:
-                earliest_available_time = actual_start
-                earliest_machine_list_id = machine_list_id
+        if use_machine_rates:
+            # 機械別サイクルタイムで終了時刻が最も早い機械を選ぶ
+            earliest_finish_time = None
+            machine_durations: Dict[int, float] = {}
+
+            for machine_list_id, available_time in self.machine_availability.items():
+                actual_start = max(start_time, available_time)
+                _, machine_duration = self.calculate_process_time(process, quantity, machine_list_id)
+                finish_time = self.add_working_time(actual_start, machine_duration)
+                if candidates is not None:
+                    candidates.append((machine_list_id, actual_start, finish_time))
+
+                if earliest_finish_time is None or finish_time < earliest_finish_time:
+                    earliest_finish_time = finish_time
+                    earliest_available_time = actual_start
+                    earliest_machine_list_id = machine_list_id
+                machine_durations[machine_list_id] = machine_duration
+
+            if earliest_machine_list_id is not None:
+                duration_minutes = machine_durations[earliest_machine_list_id]
+        else:
+            for machine_list_id, available_time in self.machine_availability.items():
+                # この機械がいつから使えるか
+                actual_start = max(start_time, available_time)
+                if candidates is not None:
+                    candidates.append((machine_list_id, actual_start, None))
+
+                if earliest_available_time is None or actual_start < earliest_available_time:
+                    earliest_available_time = actual_start
+                    earliest_machine_list_id = machine_list_id
 
         if earliest_machine_list_id is None:
             raise ValueError("利用可能なPRESS機が見つかりません")
 
-        # 実際の開始時刻
-        planned_start = earliest_available_time
+        return earliest_machine_list_id, earliest_available_time, duration_minutes
+
+    def _apply_setup_time(
+        self,
+        machine_list_id: int,
+        planned_start: datetime,
+        process_id: int,
+        setup_time: float
+    ) -> Tuple[datetime, float, bool]:
+        """
+        前回と異なる工程の場合に段取り時間を反映した開始時刻を計算
 
-        # 段取り時間を確認
+        Returns: (段取り後の開始時刻, 段取り時間, 翌日に持ち越したか)
+        """
         additional_setup_time = 0
-        if (earliest_machine_list_id in self.machine_last_process and
-            self.machine_last_process[earliest_machine_list_id] is not None):
+        should_postpone = False
+        if (machine_list_id in self.machine_last_process and
+            self.machine_last_process[machine_list_id] is not None):
             # 前回の工程と今回の工程が異なる場合、段取り時間を追加
-            if self.machine_last_process[earliest_machine_list_id] != process_id:
+            if self.machine_last_process[machine_list_id] != process_id:
                 additional_setup_time = setup_time
 
                 # 段取り替え30分ルールを適用
@@ -1204,17 +1421,7 @@ class ProductionScheduler:
                 # 段取り時間を考慮して開始時刻を調整
                 planned_start = self.add_working_time(planned_start, additional_setup_time)
 
-        # 総作業時間を計算（段取り時間は既に考慮済み）
-        total_time = duration_minutes
-
-        # 終了時刻を計算（稼働時間を考慮）
-        planned_end = self.add_working_time(planned_start, total_time)
-
-        # この機械の次の空き時間と最後の工程を更新
-        self.machine_availability[earliest_machine_list_id] = planned_end
-        self.machine_last_process[earliest_machine_list_id] = process_id
-
-        return earliest_machine_list_id, planned_start, planned_end, additional_setup_time
+        return planned_start, additional_setup_time, should_postpone
 
     def generate_schedule_old(self, user_id: Optional[int] = None) -> List[Dict]:
         """
@@ -1717,10 +1924,24 @@ class ProductionScheduler:
             # 残り時間を計算
             remaining_minutes = task_info['remaining_minutes']
 
-            # タスク開始時刻（今日の開始時刻）
+            # タスク開始時刻（今日の開始時刻、金型修理中なら修理完了後）
             task_start = day_start
+            available_minutes = daily_minutes
+            process_id = task_info['process_id']
+            mold_available = self.get_mold_available_time(process_id, day_start)
+            if mold_available > day_start:
+                task_start = self.add_working_time(mold_available, 0)
+                if task_start >= day_end:
+                    # 今日は終日金型修理中 → 継続タスクを中断し、翌稼働日以降に再開
+                    continue
+            # 途中で金型修理に入る場合は修理開始までで中断
+            task_limit = self.get_mold_downtime_start(process_id, task_start, day_end) or day_end
+            if task_start != day_start or task_limit != day_end:
+                available_minutes = self.calculate_working_minutes_in_range(task_start, task_limit)
+                if available_minutes <= 0:
+                    continue
 
-            if remaining_minutes <= daily_minutes:
+            if remaining_minutes <= available_minutes:
                 # 今日中に完了
                 actual_minutes = remaining_minutes
                 task_end = self.add_working_time(task_start, actual_minutes)
@@ -1759,6 +1980,7 @@ class ProductionScheduler:
 
                 # 機械のスケジュールを更新
                 self.update_machine_schedule(machine_id, current_date, task_start, task_end)
+                self._trace_ongoing_task(process, product, machine_id, task_start, task_end)
 
                 # 工程を完了としてマーク
                 product_id = task_info['product_id']
@@ -1772,12 +1994,12 @@ class ProductionScheduler:
 
             else:
                 # 今日中に終わらない → 継続
-                task_end = day_end
+                task_end = task_limit
 
                 # 今日処理できる数量を計算
                 quantity_today = self.calculate_quantity_per_time(
                     self.db.query(Process).filter(Process.process_id == task_info['process_id']).first(),
-                    daily_minutes
+                    available_minutes
                 )
 
                 # スケジュール保存
@@ -1789,7 +2011,7 @@ class ProductionScheduler:
                     planned_end_datetime=task_end,
                     po_quantity=quantity_today,
                     setup_time=0,  # 継続タスクは段取り不要
-                    processing_time=daily_minutes,
+                    processing_time=available_minutes,
                     user=user_id
                 )
 
@@ -1814,11 +2036,38 @@ class ProductionScheduler:
 
                 # 機械のスケジュールを更新
                 self.update_machine_schedule(machine_id, current_date, task_start, task_end)
+                self._trace_ongoing_task(process, product, machine_id, task_start, task_end)
 
                 # 残り時間と数量を更新
-                self.machine_ongoing_task[machine_id]['remaining_minutes'] -= daily_minutes
+                self.machine_ongoing_task[machine_id]['remaining_minutes'] -= available_minutes
                 self.machine_ongoing_task[machine_id]['remaining_quantity'] -= quantity_today
 
+    def _trace_ongoing_task(
+        self,
+        process: Optional[Process],
+        product: Optional[Product],
+        machine_id: int,
+        task_start: datetime,
+        task_end: datetime
+    ):
+        """継続タスクの割当をトレースに記録（段取りなし）"""
+        if self.trace is None:
+            return
+        self.trace.record(
+            'constrained_continue',
+            product.product_code if product else None,
+            process.process_id if process else None,
+            process.process_name if process else None,
+            None,
+            None,
+            None,
+            machine_id,
+            task_start,
+            task_end,
+            0,
+            False
+        )
+
     def find_best_press_machine(self, process: Process, current_date: date) -> Optional[int]:
         """最適なPRESS機を選択（空き時間が最も多い機械）"""
         # 全PRESS機を取得
@@ -1889,7 +2138,10 @@ class ProductionScheduler:
         user_id: Optional[int] = None,
         min_start_time: Optional[datetime] = None
     ) -> bool:
-        """機械にタスクを割り当て"""
+        """機械にタスクを割り当て（金型修理期間は避ける）"""
+        if self.is_mold_blocked(process.process_id):
+            return False
+
         # 全ての空きスロットを取得
         free_slots = self.get_all_free_slots(machine_id, current_date)
         
@@ -1927,13 +2179,23 @@ class ProductionScheduler:
                         continue
                         
                     current_slot_start = temp_start
+
+            # 金型修理中なら修理完了後から開始
+            mold_available = self.get_mold_available_time(process.process_id, current_slot_start)
+            if mold_available > current_slot_start:
+                current_slot_start = self.add_working_time(mold_available, 0)
+                if current_slot_start >= end:
+                    continue
+
+            # スロットの途中で金型修理に入る場合は修理開始までに制限
+            slot_end = self.get_mold_downtime_start(process.process_id, current_slot_start, end) or end
             
             # 再度長さをチェック（実稼働時間で）
-            current_available = self.calculate_working_minutes_in_range(current_slot_start, end)
+            current_available = self.calculate_working_minutes_in_range(current_slot_start, slot_end)
             
             if current_available >= 10:
                 # 使用可能なスロットが見つかった
-                selected_slot = (current_slot_start, end)
+                selected_slot = (current_slot_start, slot_end)
                 adjusted_start = current_slot_start
                 available_minutes = current_available
                 break
@@ -1944,10 +2206,11 @@ class ProductionScheduler:
         free_start = adjusted_start
         free_minutes = available_minutes
 
-        # 工程の所要時間を計算
+        # 工程の所要時間を計算（機械別サイクルタイムを使用）
         setup_time, processing_time = self.calculate_process_time(
             process,
-            product_data['total_quantity']
+            product_data['total_quantity'],
+            machine_id
         )
 
         # 段取り時間判定
@@ -1970,7 +2233,11 @@ class ProductionScheduler:
             if available_time < 10:  # 段取り後の時間が不足
                 return False
 
-            task_quantity = self.calculate_quantity_per_time(process, available_time)
+            # 継続タスクは機械ごとに1つまで（金型修理で中断中のタスクを上書きしない）
+            if machine_id in self.machine_ongoing_task:
+                return False
+
+            task_quantity = self.calculate_quantity_per_time(process, available_time, machine_id)
             if task_quantity <= 0:
                 return False
 
@@ -2043,6 +2310,22 @@ class ProductionScheduler:
         # 機械の最後の工程を更新
         self.machine_last_process[machine_id] = process.process_id
 
+        if self.trace is not None:
+            self.trace.record(
+                'constrained_assign',
+                product_data['product'].product_code,
+                process.process_id,
+                process.process_name,
+                self._trace_context.get('deadline_rank'),
+                self._trace_context.get('deadline'),
+                self._trace_context.get('candidates'),
+                machine_id,
+                task_start,
+                task_end,
+                actual_setup,
+                False
+            )
+
         if not is_completed:
             # 継続タスクとして登録
             remaining_quantity = product_data['total_quantity'] - task_quantity
@@ -2164,20 +2447,36 @@ class ProductionScheduler:
             if not assigned:
                 break  # これ以上割り当てできない
 
-    def generate_schedule(self, user_id: Optional[int] = None) -> Dict:
+    def generate_schedule(self, user_id: Optional[int] = None, strategy: str = DEFAULT_STRATEGY) -> Dict:
         """
-        生産計画を生成（締切日優先方式）
-        
-        PO単位で生産締切日を計算し、締切日の早い順にプレス工程を割り当て
-        空き時間を最大限活用し、効率的なスケジューリングを実現
+        生産計画を生成
+
+        SCHEDULING_STRATEGIES に登録された戦略を実行する（デフォルト: 締切日優先方式）
         
         Returns: {
             'constrained_schedules': [...],
             'unconstrained_schedules': [...],
-            'all_schedules': [...]
+            'all_schedules': [...],
+            'unscheduled_processes': [...]  # 金型修理中で割当できなかった工程（締切日優先方式のみ）
         }
         """
-        return self.generate_schedule_by_deadline(user_id)
+        if strategy not in SCHEDULING_STRATEGIES:
+            raise ValueError(f"未登録のスケジューリング戦略です: {strategy}")
+
+        method_name, _ = SCHEDULING_STRATEGIES[strategy]
+        result = getattr(self, method_name)(user_id)
+
+        if isinstance(result, list):
+            # 旧アルゴリズムはリストを返すため、共通の形式に揃える
+            constrained = [s for s in result if s['machine_list_id'] is not None]
+            unconstrained = [s for s in result if s['machine_list_id'] is None]
+            result = {
+                'constrained_schedules': constrained,
+                'unconstrained_schedules': unconstrained,
+                'all_schedules': result
+            }
+
+        return result
 
     def generate_schedule_v2(self, user_id: Optional[int] = None) -> Dict:
         """
@@ -2242,7 +2541,8 @@ class ProductionScheduler:
         Returns: {
             'constrained_schedules': [...],  # プレス工程のスケジュール
             'unconstrained_schedules': [...],  # その他工程のスケジュール
-            'all_schedules': [...]  # 全スケジュール
+            'all_schedules': [...],  # 全スケジュール
+            'unscheduled_processes': [...]  # 金型修理中で割当できなかった工程
         }
         """
         total_start_time = time.time()
@@ -2271,6 +2571,9 @@ class ProductionScheduler:
         # === フェーズ1: 1工程ごとに締切日を再計算しながらスケジューリング ===
         # 各製品のスケジュール済み工程を追跡: {product_id: set(process_id)}
         scheduled_product_processes: Dict[int, set] = {}
+        # 金型修理中で割当できなかった製品と工程
+        mold_blocked_products: set = set()
+        unscheduled_processes: List[Dict] = []
 
         # 全製品の全プレス工程がスケジュールされるまでループ
         max_iterations = 10000  # 無限ループ防止
@@ -2301,7 +2604,7 @@ class ProductionScheduler:
             # 次にスケジュールする工程を探す
             scheduled_this_iteration = False
 
-            for product_data in target_products_list:
+            for deadline_rank, product_data in enumerate(target_products_list):
                 product = product_data['product']
                 product_id = product.product_id
 
@@ -2309,11 +2612,38 @@ class ProductionScheduler:
                 if product_id not in scheduled_product_processes:
                     scheduled_product_processes[product_id] = set()
 
+                if self.trace is not None:
+                    self._trace_context = {
+                        'product_code': product.product_code,
+                        'deadline_rank': deadline_rank,
+                        'deadline': product_data['deadline'],
+                    }
+
                 # まだスケジュールされていないプレス工程を探す
                 for press_process in product_data['press_processes']:
                     if press_process.process_id in scheduled_product_processes[product_id]:
                         continue  # 既にスケジュール済み
 
+                    if self.is_mold_blocked(press_process.process_id):
+                        # 金型の修理完了日が未定 → この工程以降のプレス工程は今回は割当対象外
+                        logger.warning(f"金型修理中のため割当をスキップ (Product: {product.product_code}, Process: {press_process.process_name})")
+                        if self.trace is not None:
+                            self.trace.record(
+                                'mold_blocked', product.product_code, press_process.process_id,
+                                press_process.process_name, deadline_rank, product_data['deadline'],
+                                None, None, None, None, 0, False
+                            )
+                        for remaining_process in product_data['press_processes']:
+                            if remaining_process.process_id in scheduled_product_processes[product_id]:
+                                continue
+                            scheduled_product_processes[product_id].add(remaining_process.process_id)
+                            unscheduled_processes.append(
+                                self._unscheduled_entry(product_data, remaining_process, 'mold_blocked')
+                            )
+                        mold_blocked_products.add(product_id)
+                        scheduled_this_iteration = True
+                        break
+
                     # この工程の加工時間を計算
                     setup_time, processing_time = self.calculate_process_time(
                         press_process,
@@ -2326,7 +2656,9 @@ class ProductionScheduler:
                         self.get_vietnam_now(),
                         processing_time,  # 加工時間（分）
                         press_process.process_id,
-                        float(press_process.setup_time or 0)
+                        float(press_process.setup_time or 0),
+                        process=press_process,
+                        quantity=product_data['production_quantity']
                     )
 
                     # スケジュールを保存
@@ -2405,8 +2737,21 @@ class ProductionScheduler:
         unconstrained_schedules = self._schedule_unconstrained_processes(
             target_products_list,
             product_schedules_map,
-            user_id
+            user_id,
+            excluded_product_ids=mold_blocked_products
         )
+
+        # プレス工程が組めなかった製品の後工程も未割当として返す
+        for product_data in target_products_list:
+            if product_data['product'].product_id not in mold_blocked_products:
+                continue
+            for process in product_data['processes']:
+                if not self.is_press_process(process.process_name):
+                    unscheduled_processes.append(
+                        self._unscheduled_entry(product_data, process, 'mold_blocked')
+                    )
+        if unscheduled_processes:
+            logger.warning(f"金型修理中のため未割当の工程: {len(unscheduled_processes)}件 ({len(mold_blocked_products)}製品)")
         logger.info(f"[PHASE 3 完了] 制約なしスケジュール数: {len(unconstrained_schedules)}, 経過時間: {time.time() - phase3_start:.2f}秒")
 
         # 統合
@@ -2426,7 +2771,20 @@ class ProductionScheduler:
         return {
             'constrained_schedules': press_schedules,
             'unconstrained_schedules': unconstrained_schedules,
-            'all_schedules': all_schedules
+            'all_schedules': all_schedules,
+            'unscheduled_processes': unscheduled_processes
+        }
+
+    def _unscheduled_entry(self, product_data: Dict, process: Process, reason: str) -> Dict:
+        """未割当工程の返却用エントリ"""
+        return {
+            'po_id': product_data['earliest_po'].po_id,
+            'po_number': product_data['earliest_po'].po_number,
+            'product_code': product_data['product'].product_code,
+            'process_id': process.process_id,
+            'process_name': process.process_name,
+            'po_quantity': product_data['production_quantity'],
+            'reason': reason
         }
 
     def _schedule_press_process(
@@ -2693,13 +3051,20 @@ class ProductionScheduler:
             # 締切日順に製品を走査して、空き時間に入るものを探す
             added_schedule = False
             
-            for product_data in target_products_list:
+            for deadline_rank, product_data in enumerate(target_products_list):
                 product = product_data['product']
                 product_id = product.product_id
                 
                 # 既に全工程スケジュール済みならスキップ
                 if product_id in fully_scheduled_products:
                     continue
+
+                if self.trace is not None:
+                    self._trace_context = {
+                        'product_code': product.product_code,
+                        'deadline_rank': deadline_rank,
+                        'deadline': product_data['deadline'],
+                    }
                 
                 # この製品のスケジュール済み工程IDセット
                 if product_id not in scheduled_product_processes:
@@ -2709,6 +3074,9 @@ class ProductionScheduler:
                 for press_process in product_data['press_processes']:
                     if press_process.process_id in scheduled_product_processes[product_id]:
                         continue
+
+                    if self.is_mold_blocked(press_process.process_id):
+                        continue
                         
                     try:
                         # 加工時間を計算
@@ -2723,7 +3091,9 @@ class ProductionScheduler:
                             self.get_vietnam_now(),
                             processing_time,
                             press_process.process_id,
-                            float(press_process.setup_time or 0)
+                            float(press_process.setup_time or 0),
+                            process=press_process,
+                            quantity=product_data['production_quantity']
                         )
                         
                         # スケジュール保存
@@ -2776,18 +3146,23 @@ class ProductionScheduler:
         self,
         target_products_list: List[Dict],
         product_schedules_map: Dict[str, List[Dict]],
-        user_id: Optional[int] = None
+        user_id: Optional[int] = None,
+        excluded_product_ids: Optional[set] = None
     ) -> List[Dict]:
         """
         制約のない工程（TAP, BARREL, PACKING等）をスケジューリング
         
         製品単位で処理
+        excluded_product_ids の製品（プレス工程が組めなかった製品）は対象外
         """
         unconstrained_schedules = []
         
         for product_data in target_products_list:
             product = product_data['product']
             product_code = product.product_code
+
+            if excluded_product_ids and product.product_id in excluded_product_ids:
+                continue
             
             # この製品のスケジュール済み工程（プレス工程）
             existing_schedules = product_schedules_map.get(product_code, [])
@@ -2940,13 +3315,17 @@ class ProductionScheduler:
             assigned = False
 
             # 生産締切日順に製品を処理
-            for product_data in target_products:
+            for deadline_rank, product_data in enumerate(target_products):
                 # 次の制約のある工程を探す
                 next_process = self.find_next_constrained_process(product_data)
 
                 if not next_process:
                     continue
 
+                # 金型の修理完了日が未定の工程は割当対象外
+                if self.is_mold_blocked(next_process.process_id):
+                    continue
+
                 # 工程タイプを取得
                 process_type = self.get_machine_type_from_process_name(next_process.process_name)
                 
@@ -2954,12 +3333,22 @@ class ProductionScheduler:
                     continue
 
                 # 最適な機械を探す
+                candidates = [] if self.trace is not None else None
                 best_machine_id = self.find_best_machine(
                     next_process,
                     current_date,
-                    process_type
+                    process_type,
+                    candidates
                 )
 
+                if self.trace is not None:
+                    self._trace_context = {
+                        'product_code': product_data['product'].product_code,
+                        'deadline_rank': deadline_rank,
+                        'deadline': product_data.get('production_deadline'),
+                        'candidates': candidates,
+                    }
+
                 if best_machine_id:
                     # 割り当て試行
                     success = self.assign_task_to_machine(
@@ -3087,9 +3476,15 @@ class ProductionScheduler:
         self,
         process: Process,
         current_date: date,
-        process_type: str
+        process_type: str,
+        candidates: Optional[List[Tuple]] = None
     ) -> Optional[int]:
-        """指定された工程タイプの最適な機械を選択"""
+        """
+        指定された工程タイプの最適な機械を選択
+
+        candidates にリストを渡すと、比較した機械を
+        (machine_list_id, 最初の空き時刻, None) で追加する（トレース用）
+        """
         # 該当する機械タイプを取得
         machines = self.db.query(MachineList).join(MachineType).filter(
             MachineType.machine_type_name == process_type
@@ -3101,6 +3496,10 @@ class ProductionScheduler:
         for machine in machines:
             free_minutes = self.calculate_free_time(machine.machine_list_id, current_date)
 
+            if candidates is not None and free_minutes > 0:
+                free_slots = self.get_all_free_slots(machine.machine_list_id, current_date)
+                candidates.append((machine.machine_list_id, free_slots[0][0] if free_slots else None, None))
+
             if free_minutes > max_free_time:
                 max_free_time = free_minutes
                 best_machine_id = machine.machine_list_id
@@ -0,0 +1,94 @@
+"""
+生産計画のエクスポート（CSV / XLSX）
+
+公開済みの production_schedule を表示項目付きでサーバーサイドカーソルから読み、
+CSVは行を順に送信、XLSXは openpyxl の write-only モードで一時ファイルに書き出す
+どちらも件数に関係なくメモリ使用量は一定
+
+レスポンス送信中も読込が続くため、リクエストのセッションではなく専用のセッションを使う
+"""
+
+from datetime import datetime
+from typing import Iterator
+import csv
+import io
+
+from openpyxl import Workbook
+
+from ..database import SessionLocal
+from .schedule_reader import iter_schedule_details
+
+EXPORT_BATCH_SIZE = 1000
+
+# (見出し, 行から値を取り出す関数)
+EXPORT_COLUMNS = [
+    ("schedule_id", lambda r: r.schedule_id),
+    ("po_number", lambda r: r.po_number),
+    ("customer_name", lambda r: r.customer_name),
+    ("product_code", lambda r: r.product_code),
+    ("process_no", lambda r: r.process_no),
+    ("process_name", lambda r: r.process_name),
+    ("machine_no", lambda r: r.machine_no),
+    ("planned_start_datetime", lambda r: r.planned_start_datetime),
+    ("planned_end_datetime", lambda r: r.planned_end_datetime),
+    ("po_quantity", lambda r: r.po_quantity),
+    ("setup_time", lambda r: float(r.setup_time or 0)),
+    ("processing_time", lambda r: float(r.processing_time or 0)),
+    ("delivery_date", lambda r: r.delivery_date),
+]
+
+
+def export_filename(extension: str) -> str:
+    """ダウンロード時のファイル名"""
+    return f"production_schedule_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+
+def iter_schedule_csv(batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """スケジュールをCSVとして batch_size 行ずつ返す（Excelで開けるようBOM付きUTF-8）"""
+    db = SessionLocal()
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffer.write("\ufeff")
+        writer.writerow([header for header, _ in EXPORT_COLUMNS])
+
+        rows_in_buffer = 0
+        for row in iter_schedule_details(db, batch_size=batch_size):
+            writer.writerow([
+                value.strftime("%Y-%m-%d %H:%M") if isinstance(value, datetime) else value
+                for value in (getter(row) for _, getter in EXPORT_COLUMNS)
+            ])
+            rows_in_buffer += 1
+
+            if rows_in_buffer >= batch_size:
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+                rows_in_buffer = 0
+
+        yield buffer.getvalue().encode("utf-8")
+    finally:
+        db.close()
+
+
+def write_schedule_xlsx(path: str, batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """
+    スケジュールをXLSXファイルに書き出す（write-only モード）
+
+    Returns: 書き出した行数
+    """
+    db = SessionLocal()
+    try:
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("production_schedule")
+        sheet.append([header for header, _ in EXPORT_COLUMNS])
+
+        count = 0
+        for row in iter_schedule_details(db, batch_size=batch_size):
+            sheet.append([getter(row) for _, getter in EXPORT_COLUMNS])
+            count += 1
+
+        workbook.save(path)
+        return count
+    finally:
+        db.close()
@@ -0,0 +1,461 @@
+"""
+実績（IoTショット数）による生産計画の補正
+
+ラズパイと機械の対応（iot_raspi_machines）がある機械について、加工中のタスク
+（計画開始が現在以前で最も遅いSPM工程。計画終了を過ぎても数量に達していなければ加工中とする）の進捗をショット数から求め、
+計画とのずれが閾値以上の機械だけ後続タスクを置き直す（計画全体は作り直さない）
+
+- 実績数 = 計画開始以降のショット数（分単位ロールアップ）× キャビティ数
+- 残り時間 = 残り数量の加工時間（スケジューラーと同じ見積り: SPM × 安全係数、機械別サイクルタイム優先）
+  まだショットがなければ、段取り時間のうち経過していない分を加える
+- 終了見込み = 現在から残り時間を稼働時間で加算した日時
+- ずれ（稼働分）= 終了見込み − 計画終了（正: 遅れ、負: 進み）
+- ずれが閾値（SCHEDULE_FEEDBACK_DRIFT_MINUTES）以上の機械は
+  1. 加工中タスクの終了を終了見込みに変更
+  2. 同じ機械の後続タスクを計画順に詰め直す（ProductionScheduler の稼働時間加算・金型修理期間の判定を使う）
+     - 各タスクの稼働分（段取り込み）は変えない
+     - 現在時刻・前のタスクの終了・同じPOの前工程の終了（計画上で前工程の終了後に始まっていたもの）より前には置かない
+  3. 他の機械の後工程と重なった場合は conflicts として返す（他の機械の計画は変えない）
+- 補正した場合は計画バージョンを公開する（プレス週間予定表を作り直す）
+
+遅れている加工中タスクは、補正しなかった場合も計画終了を過ぎて数量に達するまで加工中として扱う
+アプリ起動中は定期的に実行し（start_feedback_task）、/api/schedule/production-schedule/feedback から手動でも実行できる
+複数ワーカーで同時に補正しないよう、計算から適用まで MySQL の GET_LOCK で排他する
+適用時は最新の計画バージョンをロック付きで読み直し（SELECT ... FOR UPDATE）、計画の作り直しと重ならないようにする
+"""
+
+import asyncio
+import calendar
+import logging
+from collections import defaultdict
+from datetime import datetime, time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, text
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+from ..config import settings
+from ..database import SessionLocal, engine
+from ..models import Process, ProcessNameType, ProductionPlanVersion, ProductionSchedule
+from ..models.iot_press_event import IotPressShotRollup, IotRaspiMachine
+from .deadline_service import estimate_process_minutes
+from .gantt import build_working_minute_prefix
+from .iot_rollup import LOCAL_OFFSET_MS, ROLLUP_RESOLUTIONS, bucket_start
+from .plan_inputs import load_holiday_set
+from .plan_version import get_current_plan_version_id, publish_plan_version
+from .production_scheduler import ProductionScheduler
+
+logger = logging.getLogger(__name__)
+
+# 補正で公開する計画バージョンの戦略名・登録者
+FEEDBACK_STRATEGY = "iot_feedback"
+FEEDBACK_USER = "iot-feedback"
+# 定期実行の間隔（秒）と起動後の初回実行までの待ち時間（秒）
+FEEDBACK_INTERVAL_SECONDS = 10 * 60
+FEEDBACK_INITIAL_DELAY_SECONDS = 120
+# 複数ワーカーでの同時実行を防ぐロック名
+FEEDBACK_LOCK_NAME = "production_schedule_feedback"
+
+MINUTE_MS = dict(ROLLUP_RESOLUTIONS)["minute"]
+
+
+class FeedbackConflict(Exception):
+    """補正の計算中に計画が作り直された"""
+
+
+class FeedbackBusy(FeedbackConflict):
+    """別のプロセスで補正を実行中"""
+
+
+def local_datetime_ms(dt: datetime) -> int:
+    """ベトナム時間（タイムゾーンなし）の日時を ms に変換"""
+    return calendar.timegm(dt.timetuple()) * 1000 - LOCAL_OFFSET_MS
+
+
+class _WorkingClock:
+    """稼働分の時間軸（build_working_minute_prefix、範囲外は必要に応じて延ばす）"""
+
+    def __init__(self, start: datetime, working_hours: int, holidays: set):
+        self.origin = datetime.combine(start.date(), time())
+        self.working_hours = working_hours
+        self.holidays = holidays
+        self.prefix = build_working_minute_prefix(self.origin, 1, working_hours, holidays)
+
+    def at(self, dt: datetime) -> int:
+        """基準日0:00から dt までの稼働分"""
+        minute = max(0, int((dt - self.origin).total_seconds() // 60))
+        if minute >= len(self.prefix):
+            days = minute // 1440 + 8
+            self.prefix = build_working_minute_prefix(self.origin, days, self.working_hours, self.holidays)
+        return self.prefix[minute]
+
+    def between(self, start: datetime, end: datetime) -> int:
+        return self.at(end) - self.at(start)
+
+
+def _task_entry(task: ProductionSchedule) -> Dict:
+    return {
+        "schedule_id": task.schedule_id,
+        "machine_list_id": task.machine_list_id,
+        "po_id": task.po_id,
+        "process_id": task.process_id,
+        "planned_start": task.planned_start_datetime.isoformat(),
+        "planned_end": task.planned_end_datetime.isoformat(),
+    }
+
+
+def _load_shots(db: Session, raspi_machine: Dict[str, int], since_ms: int) -> Dict[int, List]:
+    """機械ごとの分単位ショット数 {machine_list_id: [(bucket_start_ms, shot_count), ...]}"""
+    rows = db.query(
+        IotPressShotRollup.raspi_no,
+        IotPressShotRollup.bucket_start_ms,
+        IotPressShotRollup.shot_count
+    ).filter(
+        IotPressShotRollup.resolution == "minute",
+        IotPressShotRollup.raspi_no.in_(list(raspi_machine)),
+        IotPressShotRollup.bucket_start_ms >= since_ms
+    ).all()
+
+    shots = defaultdict(list)
+    for row in rows:
+        shots[raspi_machine[row.raspi_no]].append((row.bucket_start_ms, row.shot_count))
+    return shots
+
+
+def _replan_machine(
+    scheduler: ProductionScheduler,
+    clock: _WorkingClock,
+    downstream: List[ProductionSchedule],
+    first_start: datetime,
+    chain_preds: Dict[int, List[int]],
+    ends: Dict[int, datetime]
+) -> List[Tuple[ProductionSchedule, datetime, datetime]]:
+    """
+    後続タスクを計画順に first_start から詰め直す
+
+    ends: {schedule_id: 終了日時}（補正後の値で更新される）
+
+    Returns: 開始・終了が変わるタスク [(タスク, 開始, 終了), ...]
+    """
+    moved = []
+    available = first_start
+    for task in downstream:
+        span = clock.between(task.planned_start_datetime, task.planned_end_datetime)
+        start = max([available] + [ends[j] for j in chain_preds.get(task.schedule_id, [])])
+
+        # 金型修理期間と重なる場合は修理完了後にずらす（assign_press_machine と同じ）
+        start = scheduler.get_mold_available_time(task.process_id, start)
+        end = scheduler.add_working_time(start, span)
+        while True:
+            conflict_end = scheduler.get_mold_conflict_end(task.process_id, start, end)
+            if conflict_end is None:
+                break
+            start = scheduler.get_mold_available_time(task.process_id, conflict_end)
+            end = scheduler.add_working_time(start, span)
+
+        if start != task.planned_start_datetime or end != task.planned_end_datetime:
+            moved.append((task, start, end))
+        ends[task.schedule_id] = end
+        available = end
+    return moved
+
+
+def run_schedule_feedback(
+    db: Session,
+    drift_threshold_minutes: Optional[int] = None,
+    machine_list_ids: Optional[List[int]] = None,
+    dry_run: bool = False,
+    user: Optional[str] = None,
+    now: Optional[datetime] = None
+) -> Dict:
+    """
+    加工中タスクの進捗を求め、ずれが閾値以上の機械の後続タスクを置き直す
+
+    Args:
+        drift_threshold_minutes: 補正する最小のずれ（稼働分、省略時は SCHEDULE_FEEDBACK_DRIFT_MINUTES）
+        machine_list_ids: 対象の機械（省略時はラズパイと対応付けられた全機械）
+        dry_run: True の場合は進捗と置き直し案を返すだけで変更しない
+        now: 現在日時（ベトナム時間、タイムゾーンなし）
+
+    Raises: ValueError 閾値が不正な場合、FeedbackConflict 計算中に計画が作り直された場合、
+            FeedbackBusy 別のプロセスで補正を実行中の場合
+    """
+    if dry_run:
+        return _run_feedback(db, drift_threshold_minutes, machine_list_ids, dry_run, user, now)
+
+    # ロックは専用の接続で持つ（セッションのコミットで接続を手放してもロックが残らないように）
+    with engine.connect() as conn:
+        if not conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": FEEDBACK_LOCK_NAME}).scalar():
+            raise FeedbackBusy("Schedule feedback is already running")
+        try:
+            return _run_feedback(db, drift_threshold_minutes, machine_list_ids, dry_run, user, now)
+        finally:
+            conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": FEEDBACK_LOCK_NAME})
+
+
+def _run_feedback(
+    db: Session,
+    drift_threshold_minutes: Optional[int] = None,
+    machine_list_ids: Optional[List[int]] = None,
+    dry_run: bool = False,
+    user: Optional[str] = None,
+    now: Optional[datetime] = None
+) -> Dict:
+    """run_schedule_feedback の本体（適用する場合は GET_LOCK を取得済み）"""
+    threshold = settings.SCHEDULE_FEEDBACK_DRIFT_MINUTES if drift_threshold_minutes is None else drift_threshold_minutes
+    if threshold < 1:
+        raise ValueError("drift_threshold_minutes must be 1 or more")
+
+    plan_version_id = get_current_plan_version_id(db)
+    working_hours = db.query(ProductionPlanVersion.working_hours).filter(
+        ProductionPlanVersion.plan_version_id == plan_version_id
+    ).scalar() or 8
+
+    now = now or ProductionScheduler.get_vietnam_now()
+    result = {
+        "now": now.isoformat(),
+        "plan_version_id": plan_version_id,
+        "working_hours": working_hours,
+        "drift_threshold_minutes": threshold,
+        "dry_run": dry_run,
+        "applied": False,
+        "tasks": [],
+        "moved": [],
+        "conflicts": [],
+    }
+
+    mappings = db.query(IotRaspiMachine.raspi_no, IotRaspiMachine.machine_list_id)
+    if machine_list_ids:
+        mappings = mappings.filter(IotRaspiMachine.machine_list_id.in_(machine_list_ids))
+    raspi_machine = {m.raspi_no: m.machine_list_id for m in mappings.all()}
+    if not raspi_machine:
+        return result
+
+    machine_ids = set(raspi_machine.values())
+
+    def task_query():
+        return db.query(
+            ProductionSchedule, Process, ProcessNameType.day_or_spm
+        ).join(
+            Process, Process.process_id == ProductionSchedule.process_id
+        ).outerjoin(
+            ProcessNameType, Process.process_name_id == ProcessNameType.process_name_id
+        )
+
+    # 機械ごとの加工中タスクの候補（計画開始が現在以前で最も遅いもの、計画終了は問わない）
+    latest_start = db.query(
+        ProductionSchedule.machine_list_id,
+        func.max(ProductionSchedule.planned_start_datetime).label("planned_start")
+    ).filter(
+        ProductionSchedule.machine_list_id.in_(machine_ids),
+        ProductionSchedule.planned_start_datetime <= now
+    ).group_by(ProductionSchedule.machine_list_id).subquery()
+    started_rows = task_query().join(
+        latest_start,
+        and_(
+            ProductionSchedule.machine_list_id == latest_start.c.machine_list_id,
+            ProductionSchedule.planned_start_datetime == latest_start.c.planned_start
+        )
+    ).order_by(ProductionSchedule.machine_list_id, ProductionSchedule.schedule_id).all()
+
+    # 後続タスク（計画開始が現在より後）
+    rows = task_query().filter(
+        ProductionSchedule.machine_list_id.in_(machine_ids),
+        ProductionSchedule.planned_start_datetime > now
+    ).order_by(
+        ProductionSchedule.machine_list_id,
+        ProductionSchedule.planned_start_datetime,
+        ProductionSchedule.schedule_id
+    ).all()
+
+    by_machine = defaultdict(list)
+    for row in rows:
+        by_machine[row.ProductionSchedule.machine_list_id].append(row.ProductionSchedule)
+
+    latest = {row.ProductionSchedule.machine_list_id: row for row in started_rows}
+    current = {machine_id: row for machine_id, row in latest.items() if row.day_or_spm is True}
+    downstream = {machine_id: by_machine[machine_id] for machine_id in current}
+    if not current:
+        return result
+
+    # 稼働時間の加算・サイクルタイム・金型修理期間はスケジューラーのものを使う
+    scheduler = ProductionScheduler(db, working_hours=working_hours)
+    clock = _WorkingClock(
+        min(r.ProductionSchedule.planned_start_datetime for r in current.values()), working_hours, load_holiday_set(db)
+    )
+    shots_by_machine = _load_shots(db, raspi_machine, bucket_start(
+        min(local_datetime_ms(r.ProductionSchedule.planned_start_datetime) for r in current.values()), MINUTE_MS
+    ))
+    daily_minutes = scheduler.get_working_minutes(working_hours)
+
+    drifted = {}
+    for machine_id, row in sorted(current.items()):
+        task, process = row.ProductionSchedule, row.Process
+        since_ms = bucket_start(local_datetime_ms(task.planned_start_datetime), MINUTE_MS)
+        shots = sum(count for ts, count in shots_by_machine.get(machine_id, []) if ts >= since_ms)
+        actual_quantity = shots * (process.cavity or 1)
+        remaining_quantity = max(0, task.po_quantity - actual_quantity)
+        if remaining_quantity == 0 and task.planned_end_datetime <= now:
+            # 計画終了を過ぎて数量に達したタスクは加工済み
+            continue
+
+        _, remaining_minutes = estimate_process_minutes(
+            True, remaining_quantity, 0, scheduler.get_cycle_rate(process, machine_id),
+            process.production_limit, process.rough_cycletime, daily_minutes
+        )
+        if shots == 0:
+            remaining_minutes += max(0, float(task.setup_time or 0) - clock.between(task.planned_start_datetime, now))
+        projected_end = scheduler.add_working_time(now, remaining_minutes) if remaining_minutes > 0 else now
+        drift = clock.between(task.planned_end_datetime, projected_end)
+
+        reschedule = abs(drift) >= threshold
+        if reschedule:
+            drifted[machine_id] = projected_end
+        result["tasks"].append({
+            **_task_entry(task),
+            "po_quantity": task.po_quantity,
+            "shots": shots,
+            "actual_quantity": actual_quantity,
+            "remaining_quantity": remaining_quantity,
+            "remaining_minutes": round(float(remaining_minutes), 1),
+            "projected_end": projected_end.isoformat(),
+            "drift_minutes": drift,
+            "rescheduled": reschedule,
+        })
+    if not drifted:
+        return result
+
+    # 同じPOの工程順の依存関係（plan_simulator と同じく、計画上で前工程の終了後に始まっているもの）
+    po_ids = {t.po_id for m in drifted for t in downstream[m]} | {current[m].ProductionSchedule.po_id for m in drifted}
+    chain_rows = db.query(
+        ProductionSchedule.schedule_id,
+        ProductionSchedule.po_id,
+        ProductionSchedule.machine_list_id,
+        ProductionSchedule.process_id,
+        ProductionSchedule.planned_start_datetime,
+        ProductionSchedule.planned_end_datetime,
+        Process.process_no
+    ).join(Process, Process.process_id == ProductionSchedule.process_id).filter(
+        ProductionSchedule.po_id.in_(po_ids)
+    ).all()
+    by_po = defaultdict(list)
+    for r in chain_rows:
+        by_po[r.po_id].append(r)
+
+    def predecessors(schedule_id: int, po_id: int, process_no: int, start: datetime) -> List[int]:
+        return [
+            r.schedule_id for r in by_po[po_id]
+            if r.schedule_id != schedule_id and r.process_no < process_no and r.planned_end_datetime <= start
+        ]
+
+    process_nos = {r.schedule_id: r.process_no for r in chain_rows}
+    ends = {r.schedule_id: r.planned_end_datetime for r in chain_rows}
+    chain_preds = {
+        task.schedule_id: predecessors(task.schedule_id, task.po_id, process_nos[task.schedule_id], task.planned_start_datetime)
+        for machine_id in drifted for task in downstream[machine_id]
+    }
+
+    # {schedule_id: (タスク, 補正後の開始, 補正後の終了)}
+    changes = {}
+    for machine_id, projected_end in drifted.items():
+        task = current[machine_id].ProductionSchedule
+        ends[task.schedule_id] = projected_end
+        changes[task.schedule_id] = (task, task.planned_start_datetime, projected_end)
+    for machine_id, projected_end in drifted.items():
+        for moved_task, start, end in _replan_machine(
+            scheduler, clock, downstream[machine_id], projected_end, chain_preds, ends
+        ):
+            changes[moved_task.schedule_id] = (moved_task, start, end)
+            result["moved"].append({**_task_entry(moved_task), "new_start": start.isoformat(), "new_end": end.isoformat()})
+
+    # 他の機械の後工程が補正後の終了より前に始まる場合（他の機械は置き直さない）
+    for schedule_id, (task, _, new_end) in changes.items():
+        for r in by_po[task.po_id]:
+            if (r.schedule_id not in changes and r.process_no > process_nos[schedule_id]
+                    and r.planned_start_datetime >= task.planned_end_datetime and r.planned_start_datetime < new_end):
+                result["conflicts"].append({
+                    "schedule_id": r.schedule_id,
+                    "machine_list_id": r.machine_list_id,
+                    "po_id": r.po_id,
+                    "process_id": r.process_id,
+                    "planned_start": r.planned_start_datetime.isoformat(),
+                    "predecessor_schedule_id": schedule_id,
+                    "predecessor_end": new_end.isoformat(),
+                })
+
+    if dry_run:
+        return result
+
+    # 最新の計画バージョンをロック付きで読み直す（コミットまで新しいバージョンの公開を待たせる）
+    locked_version_id = db.query(ProductionPlanVersion.plan_version_id).order_by(
+        ProductionPlanVersion.plan_version_id.desc()
+    ).limit(1).with_for_update().scalar()
+    if locked_version_id != plan_version_id:
+        db.rollback()
+        raise FeedbackConflict("The production schedule was regenerated during feedback")
+
+    for task, new_start, new_end in changes.values():
+        task.processing_time = max(0, clock.between(new_start, new_end) - float(task.setup_time or 0))
+        task.planned_start_datetime = new_start
+        task.planned_end_datetime = new_end
+    try:
+        db.flush()
+    except StaleDataError:
+        # 計画の作り直しでタスクが削除された（バージョンの公開前）
+        db.rollback()
+        raise FeedbackConflict("The production schedule was regenerated during feedback")
+
+    schedules_count = db.query(func.count(ProductionSchedule.schedule_id)).scalar()
+    version = publish_plan_version(db, FEEDBACK_STRATEGY, working_hours, schedules_count, user or FEEDBACK_USER)
+    result["applied"] = True
+    result["plan_version_id"] = version.plan_version_id
+    logger.info(
+        f"実績による計画補正: {len(drifted)}機械, 変更 {len(changes)}件, "
+        f"他機械との重なり {len(result['conflicts'])}件 (plan_version_id: {version.plan_version_id})"
+    )
+    return result
+
+
+def _run_once():
+    db = SessionLocal()
+    try:
+        run_schedule_feedback(db)
+    finally:
+        db.close()
+
+
+async def _run_periodically():
+    await asyncio.sleep(FEEDBACK_INITIAL_DELAY_SECONDS)
+    while True:
+        try:
+            await asyncio.to_thread(_run_once)
+        except FeedbackBusy:
+            logger.info("実績による計画補正は別のプロセスで実行中")
+        except FeedbackConflict:
+            logger.info("実績による計画補正: 計画が作り直されたため今回は補正しない")
+        except Exception:
+            logger.exception("実績による計画補正に失敗")
+        await asyncio.sleep(FEEDBACK_INTERVAL_SECONDS)
+
+
+_feedback_task: Optional[asyncio.Task] = None
+
+
+def start_feedback_task():
+    """実績による計画補正の定期実行を開始（アプリ起動時）"""
+    global _feedback_task
+    if settings.SCHEDULE_FEEDBACK_ENABLED and _feedback_task is None:
+        _feedback_task = asyncio.create_task(_run_periodically())
+
+
+async def stop_feedback_task():
+    """定期実行を停止（アプリ終了時）"""
+    global _feedback_task
+    if _feedback_task is not None:
+        _feedback_task.cancel()
+        try:
+            await _feedback_task
+        except asyncio.CancelledError:
+            pass
+        _feedback_task = None
@@ -0,0 +1,137 @@
+"""
+生産計画スケジュールの読込
+
+production_schedule と表示に必要な項目（PO、製品、顧客、工程、工程タイプ、機械）を
+1回のJOINクエリで取得する（行ごとの追加クエリをなくすため）
+
+ページングは (planned_start_datetime, schedule_id) のキーセット方式
+InnoDBのセカンダリインデックスは主キーを含むため、idx_planned_start がそのまま使える
+"""
+
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, tuple_
+from sqlalchemy.orm import Session
+
+from ..models import PO, Product, Customer, Process, ProcessNameType, ProductionSchedule
+from ..models.factory import MachineList
+
+ScheduleCursor = Tuple[datetime, int]
+
+
+def encode_cursor(planned_start: datetime, schedule_id: int) -> str:
+    """キーセットページングのカーソルを文字列化"""
+    return f"{planned_start.isoformat()},{schedule_id}"
+
+
+def decode_cursor(cursor: str) -> ScheduleCursor:
+    """
+    カーソル文字列を (planned_start_datetime, schedule_id) に変換
+
+    Raises: ValueError 形式が不正な場合
+    """
+    planned_start, schedule_id = cursor.rsplit(",", 1)
+    return datetime.fromisoformat(planned_start), int(schedule_id)
+
+
+def _schedule_details_query(
+    db: Session,
+    start_from=None,
+    start_before=None,
+    machine_assigned_only: bool = False,
+    after: Optional[ScheduleCursor] = None
+):
+    """表示項目付きのスケジュール取得クエリ（planned_start_datetime, schedule_id の昇順）"""
+    query = db.query(
+        ProductionSchedule.schedule_id,
+        ProductionSchedule.po_id,
+        ProductionSchedule.process_id,
+        ProductionSchedule.machine_list_id,
+        ProductionSchedule.planned_start_datetime,
+        ProductionSchedule.planned_end_datetime,
+        ProductionSchedule.po_quantity,
+        ProductionSchedule.setup_time,
+        ProductionSchedule.processing_time,
+        PO.po_number,
+        PO.delivery_date,
+        Product.product_id,
+        Product.product_code,
+        Customer.customer_name,
+        ProcessNameType.process_name,
+        Process.process_no,
+        ProcessNameType.day_or_spm,
+        MachineList.machine_no
+    )\
+        .join(PO, ProductionSchedule.po_id == PO.po_id)\
+        .join(Product, PO.product_id == Product.product_id)\
+        .outerjoin(Customer, Product.customer_id == Customer.customer_id)\
+        .join(Process, ProductionSchedule.process_id == Process.process_id)\
+        .outerjoin(ProcessNameType, Process.process_name_id == ProcessNameType.process_name_id)\
+        .outerjoin(MachineList, ProductionSchedule.machine_list_id == MachineList.machine_list_id)
+
+    conditions = []
+    if start_from is not None:
+        conditions.append(ProductionSchedule.planned_start_datetime >= start_from)
+    if start_before is not None:
+        conditions.append(ProductionSchedule.planned_start_datetime < start_before)
+    if machine_assigned_only:
+        conditions.append(ProductionSchedule.machine_list_id.isnot(None))
+    if after is not None:
+        conditions.append(
+            tuple_(ProductionSchedule.planned_start_datetime, ProductionSchedule.schedule_id) > tuple_(*after)
+        )
+    if conditions:
+        query = query.filter(and_(*conditions))
+
+    return query.order_by(
+        ProductionSchedule.planned_start_datetime.asc(),
+        ProductionSchedule.schedule_id.asc()
+    )
+
+
+def query_schedule_details(
+    db: Session,
+    start_from=None,
+    start_before=None,
+    machine_assigned_only: bool = False,
+    after: Optional[ScheduleCursor] = None,
+    limit: Optional[int] = None,
+    offset: int = 0
+) -> List:
+    """
+    スケジュールを表示項目付きで取得（planned_start_datetime, schedule_id の昇順）
+
+    Args:
+        start_from: planned_start_datetime の下限（含む）
+        start_before: planned_start_datetime の上限（含まない）
+        machine_assigned_only: 機械が割り当てられたスケジュールのみ
+        after: このカーソルより後の行のみ（キーセットページング）
+        limit: 最大件数
+        offset: 先頭から読み飛ばす件数
+
+    Returns: Rowのリスト（ProductionScheduleの各列 + po_number, delivery_date, product_id,
+             product_code, customer_name, process_name, process_no, day_or_spm, machine_no）
+    """
+    query = _schedule_details_query(db, start_from, start_before, machine_assigned_only, after)
+    if offset:
+        query = query.offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def iter_schedule_details(
+    db: Session,
+    start_from=None,
+    start_before=None,
+    machine_assigned_only: bool = False,
+    batch_size: int = 1000
+) -> Iterator:
+    """
+    query_schedule_details と同じ行をサーバーサイドカーソルで順に返す
+
+    batch_size 件ずつ取得するため、件数が多くてもメモリ使用量は一定
+    """
+    query = _schedule_details_query(db, start_from, start_before, machine_assigned_only)
+    yield from query.yield_per(batch_size)
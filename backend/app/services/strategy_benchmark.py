@@ -0,0 +1,194 @@
+"""
+スケジューリング戦略の比較
+
+登録済みの全戦略を同じデータ（スナップショット）で実行し、
+実行時間・メモリ・makespan・納期遅れを比較する
+
+各戦略は production_schedule を削除・再作成してコミットするため、
+専用の接続上に同名の一時テーブル（TEMPORARY TABLE）を作って実テーブルを隠し、
+その一時テーブルに対して実行する。一時テーブルは接続ごとに独立しているため、
+公開済みの計画は変更されず、/generate 等の実テーブルへの書き込みもブロックしない
+
+tracemalloc は割り当てごとに記録するため実行時間が大きく伸びる
+実行時間は tracemalloc なしの1回目、ピークメモリは tracemalloc ありの2回目で計測する
+"""
+
+from datetime import datetime, date
+from typing import Dict, List, Optional
+import logging
+import time
+import tracemalloc
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..database import engine
+from ..models import PO, ProductionSchedule
+from .production_scheduler import ProductionScheduler, SCHEDULING_STRATEGIES
+
+logger = logging.getLogger(__name__)
+
+
+def _summarize_tardiness(schedules: List[Dict], delivery_dates: Dict[int, date]) -> Dict:
+    """POごとの完了時刻と納期から納期遅れを集計"""
+    po_finish: Dict[int, datetime] = {}
+    for s in schedules:
+        end = s['planned_end']
+        if s['po_id'] not in po_finish or end > po_finish[s['po_id']]:
+            po_finish[s['po_id']] = end
+
+    late_po_count = 0
+    total_tardiness_days = 0.0
+    max_tardiness_days = 0.0
+    for po_id, finish in po_finish.items():
+        delivery_date = delivery_dates.get(po_id)
+        if delivery_date is None:
+            continue
+        # 納期当日の0:00までに完了していれば納期内とする
+        tardiness_days = (finish - datetime.combine(delivery_date, datetime.min.time())).total_seconds() / 86400
+        if tardiness_days > 0:
+            late_po_count += 1
+            total_tardiness_days += tardiness_days
+            max_tardiness_days = max(max_tardiness_days, tardiness_days)
+
+    return {
+        'po_count': len(po_finish),
+        'late_po_count': late_po_count,
+        'total_tardiness_days': round(total_tardiness_days, 2),
+        'max_tardiness_days': round(max_tardiness_days, 2),
+    }
+
+
+def _run_in_snapshot(
+    strategy: str,
+    working_hours: int,
+    resource_constraints: Optional[Dict],
+    measure_memory: bool
+):
+    """
+    戦略を production_schedule の一時テーブル上で1回実行
+
+    Returns: (結果の要約, 実行時間（秒）, ピークメモリ（バイト、measure_memory=False の場合はNone）)
+    """
+    table_name = ProductionSchedule.__tablename__
+    scratch_name = f"{table_name}_scratch"
+    connection = engine.connect()
+
+    try:
+        # 同名の一時テーブルはこの接続でのみ実テーブルを隠す
+        # （CREATE ... LIKE は同名を指定できないため別名で作ってから改名する）
+        connection.execute(text(f"CREATE TEMPORARY TABLE {scratch_name} LIKE {table_name}"))
+        connection.execute(text(f"ALTER TABLE {scratch_name} RENAME TO {table_name}"))
+        connection.commit()
+    except Exception:
+        # 一時テーブルが残った接続をプールに戻さない
+        connection.invalidate()
+        connection.close()
+        raise
+
+    # 戦略内の commit() は一時テーブルへの書き込みを確定するだけ
+    db = Session(bind=connection)
+
+    try:
+        if measure_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+
+        scheduler = ProductionScheduler(db, working_hours, resource_constraints)
+        result = scheduler.generate_schedule(strategy=strategy)
+
+        runtime = time.perf_counter() - start
+        peak_memory = None
+        if measure_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        all_schedules = result['all_schedules']
+        po_ids = {s['po_id'] for s in all_schedules}
+        delivery_dates = {
+            po.po_id: po.delivery_date
+            for po in db.query(PO.po_id, PO.delivery_date).filter(PO.po_id.in_(po_ids)).all()
+        } if po_ids else {}
+
+        makespan = max((s['planned_end'] for s in all_schedules), default=None)
+
+        summary = {
+            'schedules_count': len(all_schedules),
+            'makespan': makespan.isoformat() if makespan else None,
+            **_summarize_tardiness(all_schedules, delivery_dates),
+        }
+        return summary, runtime, peak_memory
+    finally:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        db.close()
+        try:
+            connection.rollback()
+            # TEMPORARY を付けて実テーブルを誤って削除しないようにする
+            connection.execute(text(f"DROP TEMPORARY TABLE IF EXISTS {table_name}"))
+            connection.commit()
+        except Exception as e:
+            # 一時テーブルが残った接続をプールに戻すと実テーブルが隠れたままになるため破棄する
+            logger.warning(f"戦略比較の一時テーブル削除に失敗 (strategy: {strategy}): {str(e)}")
+            connection.invalidate()
+        connection.close()
+
+
+def run_strategy_on_snapshot(
+    strategy: str,
+    working_hours: int = 8,
+    resource_constraints: Optional[Dict] = None
+) -> Dict:
+    """
+    1つの戦略を production_schedule の一時テーブル上で実行して計測
+
+    実行時間と結果は tracemalloc なしの実行、ピークメモリは tracemalloc ありの別の実行で計測する
+
+    Returns: {'strategy', 'success', 'runtime_seconds', 'peak_memory_mb', 'makespan', ...}
+    """
+    try:
+        summary, runtime, _ = _run_in_snapshot(strategy, working_hours, resource_constraints, measure_memory=False)
+        _, _, peak_memory = _run_in_snapshot(strategy, working_hours, resource_constraints, measure_memory=True)
+
+        return {
+            'strategy': strategy,
+            'success': True,
+            'runtime_seconds': round(runtime, 3),
+            'peak_memory_mb': round(peak_memory / 1024 / 1024, 2),
+            **summary,
+        }
+    except Exception as e:
+        logger.warning(f"戦略比較の実行に失敗 (strategy: {strategy}): {str(e)}")
+        return {
+            'strategy': strategy,
+            'success': False,
+            'error': str(e),
+        }
+
+
+def compare_scheduling_strategies(
+    working_hours: int = 8,
+    resource_constraints: Optional[Dict] = None,
+    strategies: Optional[List[str]] = None
+) -> List[Dict]:
+    """
+    登録済みの戦略（または指定された戦略）を順に実行して比較結果を返す
+
+    Returns: 戦略ごとの計測結果のリスト（納期遅れPO数 → makespan → 実行時間の順）
+    """
+    strategies = strategies or list(SCHEDULING_STRATEGIES.keys())
+
+    results = []
+    for strategy in strategies:
+        logger.info(f"戦略比較: {strategy} 実行中")
+        result = run_strategy_on_snapshot(strategy, working_hours, resource_constraints)
+        result['description'] = SCHEDULING_STRATEGIES[strategy][1]
+        results.append(result)
+
+    results.sort(key=lambda r: (
+        not r['success'],
+        r.get('late_po_count', 0),
+        r.get('makespan') or '',
+        r.get('runtime_seconds', 0),
+    ))
+    return results
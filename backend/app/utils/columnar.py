@@ -0,0 +1,110 @@
+"""
+一覧APIの列形式（columnar）レスポンス
+
+行ごとの辞書ではなく列ごとの配列で返し、繰り返しの多い文字列（製品コード、機械番号、顧客名など）は
+辞書エンコード（値の一覧 + 各行のインデックス）にする
+response_model による行ごとの検証を通さず、標準のJSONエンコーダーで直接シリアライズする
+
+レスポンス形式:
+{
+    "format": "columnar",
+    "count": 行数,
+    "columns": {列名: [値, ...], ...},          # 辞書エンコード列はインデックス（NULLはnull）
+    "dictionaries": {列名: [値, ...], ...}      # 辞書エンコード列の値の一覧
+}
+"""
+
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Iterable, List, Sequence, Tuple
+import json
+
+from fastapi import HTTPException, Response, status
+
+RESPONSE_FORMATS = ("json", "columnar")
+
+# (列名, 行から値を取り出す関数)
+Column = Tuple[str, Callable[[Any], Any]]
+
+
+def validate_response_format(format: str) -> bool:
+    """
+    format パラメータを検証
+
+    Returns: 列形式の場合 True
+    Raises: HTTPException(400) 不明な形式の場合
+    """
+    if format not in RESPONSE_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported format: {format} (use {' or '.join(RESPONSE_FORMATS)})"
+        )
+    return format == "columnar"
+
+
+def _json_default(value):
+    """標準のJSONエンコーダーで扱えない型の変換"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def build_columnar(
+    rows: Iterable,
+    columns: Sequence[Column],
+    dictionary_columns: Sequence[str] = ()
+) -> dict:
+    """行の一覧を列形式の辞書に変換"""
+    names = [name for name, _ in columns]
+    getters = [getter for _, getter in columns]
+    values: List[list] = [[] for _ in columns]
+
+    for row in rows:
+        for column_values, getter in zip(values, getters):
+            column_values.append(getter(row))
+
+    result_columns = dict(zip(names, values))
+    dictionaries = {}
+    for name in dictionary_columns:
+        index = {}
+        result_columns[name] = [
+            None if value is None else index.setdefault(value, len(index))
+            for value in result_columns[name]
+        ]
+        dictionaries[name] = list(index)
+
+    return {
+        "format": "columnar",
+        "count": len(values[0]) if values else 0,
+        "columns": result_columns,
+        "dictionaries": dictionaries,
+    }
+
+
+def columnar_response(
+    rows: Iterable,
+    columns: Sequence[Column],
+    dictionary_columns: Sequence[str] = (),
+    response: Response = None
+) -> Response:
+    """
+    行の一覧を列形式のJSONレスポンスにする（response_model の検証を通さない）
+
+    Args:
+        response: エンドポイントの Response 引数（設定済みのヘッダー（ETagなど）を引き継ぐ）
+    """
+    content = json.dumps(
+        build_columnar(rows, columns, dictionary_columns),
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=_json_default,
+    )
+    headers = None
+    if response is not None:
+        headers = {
+            key: value for key, value in response.headers.items()
+            if key not in ("content-length", "content-type")
+        }
+    return Response(content=content, media_type="application/json", headers=headers)
@@ -0,0 +1,178 @@
+"""
+条件付きGET（ETag / Last-Modified / 304）
+
+- コミット時に、変更のあったテーブルの table_change_counters.version を同じトランザクション内で加算する
+  （ORMのflushと、query().delete() などの一括更新の両方を対象）
+- 読込エンドポイントは対象テーブルのカウンターからETagを作り、
+  If-None-Match / If-Modified-Since と一致すれば本体のクエリを実行せずに304を返す
+
+カウンターはDBに持つため、複数ワーカー構成でも一致する
+IoTイベントのように高頻度で書き込まれるテーブルは対象外（TRACKED_TABLES に含めない、ラズパイと機械の対応は対象）
+"""
+
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterable, Optional, Tuple
+import hashlib
+
+from fastapi import Request, Response
+from sqlalchemy import event, func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.orm import Session
+
+from ..models import (
+    Calendar, Customer, Cycletime, BrokenMold, Employee, FinishedProduct, MaterialRate,
+    MachineList, MachineType, Factory, PO, Process, ProcessNameType, Product,
+    ProductionSchedule, ProductionPlanVersion, PressWeeklyBoard, Supplier, TableChangeCounter
+)
+from ..models.iot_press_event import IotRaspiMachine
+
+# 変更カウンターの対象テーブル
+TRACKED_TABLES = {
+    model.__tablename__
+    for model in (
+        Calendar, Customer, Cycletime, BrokenMold, Employee, FinishedProduct, MaterialRate,
+        MachineList, MachineType, Factory, PO, Process, ProcessNameType, Product,
+        ProductionSchedule, ProductionPlanVersion, PressWeeklyBoard, Supplier, IotRaspiMachine,
+    )
+}
+
+# 生産計画の表示に使うテーブル
+PLAN_TABLES = (
+    ProductionPlanVersion.__tablename__,
+    ProductionSchedule.__tablename__,
+    PO.__tablename__,
+    Product.__tablename__,
+    Customer.__tablename__,
+    Process.__tablename__,
+    ProcessNameType.__tablename__,
+    MachineList.__tablename__,
+    Cycletime.__tablename__,
+    Calendar.__tablename__,
+)
+
+_CHANGED_TABLES_KEY = "changed_tables"
+
+
+def _mark_changed(session: Session, table_name: str):
+    if table_name in TRACKED_TABLES:
+        session.info.setdefault(_CHANGED_TABLES_KEY, set()).add(table_name)
+
+
+def _after_flush(session: Session, flush_context):
+    """flushで追加・更新・削除されたオブジェクトのテーブルを記録"""
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, "__table__", None)
+        if table is not None:
+            _mark_changed(session, table.name)
+
+
+def _do_orm_execute(orm_execute_state):
+    """query().delete() / update() などの一括更新のテーブルを記録"""
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is not None:
+            _mark_changed(orm_execute_state.session, table.name)
+
+
+def _before_commit(session: Session):
+    """変更のあったテーブルのカウンターを加算（コミットと同じトランザクション）"""
+    # before_commit はコミット時のflushより前に呼ばれるため、未flushの変更をここで反映する
+    session.flush()
+    changed = session.info.pop(_CHANGED_TABLES_KEY, None)
+    if not changed:
+        return
+
+    stmt = mysql_insert(TableChangeCounter).values([
+        {"table_name": table_name, "version": 1, "updated_at": func.utc_timestamp()}
+        for table_name in sorted(changed)
+    ])
+    stmt = stmt.on_duplicate_key_update(
+        version=TableChangeCounter.version + 1,
+        updated_at=func.utc_timestamp()
+    )
+    session.execute(stmt)
+
+
+def _after_soft_rollback(session: Session, previous_transaction):
+    """ロールバックされた変更は記録から外す"""
+    session.info.pop(_CHANGED_TABLES_KEY, None)
+
+
+def register_change_tracking(session_factory):
+    """セッション（sessionmaker）に変更カウンターのイベントを登録"""
+    event.listen(session_factory, "after_flush", _after_flush)
+    event.listen(session_factory, "do_orm_execute", _do_orm_execute)
+    event.listen(session_factory, "before_commit", _before_commit)
+    event.listen(session_factory, "after_soft_rollback", _after_soft_rollback)
+
+
+def get_table_versions(db: Session, tables: Iterable[str]) -> Tuple[str, Optional[datetime]]:
+    """
+    対象テーブルのカウンターを1クエリで取得
+
+    Returns: (バージョン文字列, 最終更新日時（UTC）)
+    """
+    tables = sorted(set(tables))
+    rows = db.query(
+        TableChangeCounter.table_name,
+        TableChangeCounter.version,
+        TableChangeCounter.updated_at
+    ).filter(TableChangeCounter.table_name.in_(tables)).all()
+
+    versions = {row.table_name: row.version for row in rows}
+    last_modified = max((row.updated_at for row in rows), default=None)
+    version_str = ",".join(f"{table}:{versions.get(table, 0)}" for table in tables)
+    return version_str, last_modified
+
+
+def check_not_modified(
+    request: Request,
+    response: Response,
+    db: Session,
+    tables: Iterable[str],
+    extra: str = "",
+    max_age: int = 0
+) -> Optional[Response]:
+    """
+    条件付きGETの判定
+
+    変更がなければ304のレスポンスを返す
+    変更があれば response に ETag / Last-Modified / Cache-Control を設定して None を返す
+
+    Args:
+        tables: レスポンスの内容が依存するテーブル
+        extra: テーブル以外に内容が依存する値（日付など）
+        max_age: 再検証なしでキャッシュを使ってよい秒数
+    """
+    version_str, last_modified = get_table_versions(db, tables)
+
+    digest = hashlib.sha1(
+        f"{request.url.path}?{request.url.query}|{version_str}|{extra}".encode("utf-8")
+    ).hexdigest()[:20]
+    etag = f'W/"{digest}"'
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={max_age}, must-revalidate",
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.replace(tzinfo=timezone.utc), usegmt=True)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+    elif last_modified is not None and not extra:
+        # If-Modified-Since はETagがない場合のみ判定（日付など、テーブル以外の依存がある場合は使わない）
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                since = None
+            if since is not None and last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since:
+                return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,113 @@
+"""
+プレスショットイベントのバイナリ形式（Content-Type: application/x-press-events）
+
+JSON（{"ts_ms": ...} を1ショットずつ）の代わりに、基準時刻からの差分を固定長の整数配列で送る
+サーバーは array でまとめて読み込むため、1ショットごとのオブジェクトを作らない
+
+形式（リトルエンディアン）:
+    magic       4バイト  b"PEV1"
+    raspi_len   uint8    ラズパイ番号のバイト数（0 は "unknown"）
+    raspi_no    UTF-8    raspi_len バイト
+    width       uint8    差分のバイト数（2: uint16, 4: uint32）
+    base_ts_ms  int64    基準時刻（ms）
+    count       uint32   イベント数
+    deltas      width × count  直前のイベント（最初は base_ts_ms）からの差分（ms、時刻順）
+
+60SPM程度なら差分は uint16 に収まり、1ショット2バイトになる
+"""
+
+from array import array
+from itertools import accumulate
+from typing import List, Tuple
+import struct
+import sys
+
+PRESS_BATCH_CONTENT_TYPE = "application/x-press-events"
+PRESS_BATCH_MAGIC = b"PEV1"
+
+# 1回の送信の最大イベント数
+MAX_BATCH_EVENTS = 100_000
+# ラズパイ番号の最大長（iot_press_events.raspi_no）
+MAX_RASPI_NO_LENGTH = 50
+# ts_ms の上限（iot_press_events.ts_ms は BIGINT）
+MAX_TS_MS = 2**63 - 1
+
+_ARRAY_TYPES = {2: "H", 4: "I"}
+_HEADER_TAIL = struct.Struct("<BqI")
+
+
+def decode_press_batch(data: bytes) -> Tuple[str, List[int]]:
+    """
+    バイナリ形式を (raspi_no, [ts_ms, ...]) に変換
+
+    Raises: ValueError 形式が不正な場合
+    """
+    if data[:4] != PRESS_BATCH_MAGIC:
+        raise ValueError("Invalid press batch: bad magic")
+    if len(data) < 5:
+        raise ValueError("Invalid press batch: truncated header")
+
+    raspi_len = data[4]
+    if raspi_len > MAX_RASPI_NO_LENGTH:
+        raise ValueError(f"Invalid press batch: raspi_no longer than {MAX_RASPI_NO_LENGTH} bytes")
+    offset = 5 + raspi_len
+    if len(data) < offset + _HEADER_TAIL.size:
+        raise ValueError("Invalid press batch: truncated header")
+    try:
+        raspi_no = data[5:offset].decode("utf-8") or "unknown"
+    except UnicodeDecodeError:
+        raise ValueError("Invalid press batch: raspi_no is not UTF-8")
+
+    width, base_ts_ms, count = _HEADER_TAIL.unpack_from(data, offset)
+    offset += _HEADER_TAIL.size
+    type_code = _ARRAY_TYPES.get(width)
+    if type_code is None:
+        raise ValueError(f"Invalid press batch: unsupported delta width {width}")
+    if count > MAX_BATCH_EVENTS:
+        raise ValueError(f"Invalid press batch: more than {MAX_BATCH_EVENTS} events")
+    if len(data) - offset != width * count:
+        raise ValueError(f"Invalid press batch: expected {width * count} bytes of deltas, got {len(data) - offset}")
+
+    deltas = array(type_code)
+    if deltas.itemsize != width:
+        raise ValueError(f"Unsupported delta width on this platform: {width}")
+    deltas.frombytes(data[offset:])
+    if sys.byteorder != "little":
+        deltas.byteswap()
+
+    if base_ts_ms < 0:
+        raise ValueError("Invalid press batch: negative base_ts_ms")
+    ts_list = list(accumulate(deltas, initial=base_ts_ms))[1:]
+    if ts_list and ts_list[-1] > MAX_TS_MS:
+        raise ValueError("Invalid press batch: ts_ms exceeds the BIGINT range")
+    return raspi_no, ts_list
+
+
+def encode_press_batch(raspi_no: str, ts_list: List[int]) -> bytes:
+    """
+    (raspi_no, [ts_ms, ...]) をバイナリ形式に変換（ラズパイ側の送信用、時刻順に並べ替える）
+
+    Raises: ValueError ラズパイ番号が長すぎる場合、イベントが多すぎる場合
+    """
+    raspi_bytes = raspi_no.encode("utf-8")
+    if len(raspi_bytes) > MAX_RASPI_NO_LENGTH:
+        raise ValueError(f"raspi_no longer than {MAX_RASPI_NO_LENGTH} bytes")
+    if len(ts_list) > MAX_BATCH_EVENTS:
+        raise ValueError(f"more than {MAX_BATCH_EVENTS} events")
+
+    ts_sorted = sorted(ts_list)
+    base_ts_ms = ts_sorted[0] if ts_sorted else 0
+    deltas = [b - a for a, b in zip([base_ts_ms] + ts_sorted[:-1], ts_sorted)]
+    width = 2 if all(d <= 0xFFFF for d in deltas) else 4
+    if any(d > 0xFFFFFFFF for d in deltas):
+        raise ValueError("gap between events exceeds the uint32 delta range; split the batch")
+
+    packed = array(_ARRAY_TYPES[width], deltas)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return (
+        PRESS_BATCH_MAGIC
+        + bytes([len(raspi_bytes)]) + raspi_bytes
+        + _HEADER_TAIL.pack(width, base_ts_ms, len(ts_sorted))
+        + packed.tobytes()
+    )
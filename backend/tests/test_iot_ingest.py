@@ -0,0 +1,199 @@
+import asyncio
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app.services import iot_ingest
+from app.services.iot_ingest import PressEventIngestor
+
+
+def _rows(n, raspi_no="R1", start=1000):
+    return [{"ts_ms": start + i, "raspi_no": raspi_no} for i in range(n)]
+
+
+def _connection_error():
+    return OperationalError("INSERT", {}, Exception("Lost connection to MySQL server"))
+
+
+def _bad_value_error():
+    return IntegrityError("INSERT", {}, Exception("Column 'ts_ms' cannot be null"))
+
+
+class FakeStore:
+    """_write の代わり（書き込んだ行を保持し、指定した条件で失敗する）"""
+
+    def __init__(self, bad_ts=(), fail_connection=0):
+        self.bad_ts = set(bad_ts)
+        self.fail_connection = fail_connection
+        self.written = []
+        self.calls = 0
+
+    def write(self, rows):
+        self.calls += 1
+        if self.fail_connection:
+            self.fail_connection -= 1
+            raise _connection_error()
+        if any(row["ts_ms"] in self.bad_ts for row in rows):
+            raise _bad_value_error()
+        self.written.extend(rows)
+        return len(self.written)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    fake = FakeStore()
+    monkeypatch.setattr(PressEventIngestor, "_write", staticmethod(fake.write))
+    monkeypatch.setattr(PressEventIngestor, "_read_stored_total", staticmethod(lambda: 0))
+    monkeypatch.setattr(iot_ingest, "INGEST_RETRY_SECONDS", 0.01)
+    return fake
+
+
+def test_write_isolating_writes_all_rows(store):
+    rows = _rows(10)
+
+    stored_total, retry_rows, dropped = PressEventIngestor._write_isolating(rows)
+
+    assert stored_total == 10
+    assert retry_rows == []
+    assert dropped == 0
+    assert store.written == rows
+    assert store.calls == 1
+
+
+def test_write_isolating_keeps_rows_on_connection_error(store):
+    store.fail_connection = 1
+    rows = _rows(10)
+
+    stored_total, retry_rows, dropped = PressEventIngestor._write_isolating(rows)
+
+    assert stored_total is None
+    assert retry_rows == rows
+    assert dropped == 0
+    assert store.written == []
+
+
+def test_write_isolating_drops_only_the_bad_row(store):
+    rows = _rows(10)
+    store.bad_ts = {rows[6]["ts_ms"]}
+
+    stored_total, retry_rows, dropped = PressEventIngestor._write_isolating(rows)
+
+    assert dropped == 1
+    assert retry_rows == []
+    assert stored_total == 9
+    assert sorted(r["ts_ms"] for r in store.written) == sorted(r["ts_ms"] for r in rows if r is not rows[6])
+
+
+def test_write_isolating_keeps_remaining_rows_when_connection_fails_while_splitting(store, monkeypatch):
+    rows = _rows(8)
+    store.bad_ts = {rows[0]["ts_ms"]}
+
+    def write(chunk):
+        # 最初のまとめ書きは不正な行で失敗し、分割後の書き込みで接続が切れる
+        if store.calls == 1:
+            store.fail_connection = 1
+        return FakeStore.write(store, chunk)
+
+    monkeypatch.setattr(PressEventIngestor, "_write", staticmethod(write))
+
+    stored_total, retry_rows, dropped = PressEventIngestor._write_isolating(rows)
+
+    assert stored_total is None
+    assert dropped == 0
+    assert sorted(r["ts_ms"] for r in retry_rows) == sorted(r["ts_ms"] for r in rows)
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_run_writes_events_and_pending_returns_to_zero(store):
+    async def scenario():
+        ingestor = PressEventIngestor(flush_events=5, flush_interval=0.01)
+        await ingestor.start()
+        total = ingestor.enqueue("R1", [1, 2, 3])
+        assert total == 3
+        ingestor.enqueue("R2", [4, 5])
+        await asyncio.sleep(0.1)
+        stats = ingestor.stats()
+        await ingestor.stop()
+        return stats
+
+    stats = _run(scenario())
+
+    assert stats["pending_events"] == 0
+    assert stats["stored_total"] == 5
+    assert sorted(r["ts_ms"] for r in store.written) == [1, 2, 3, 4, 5]
+
+
+def test_run_retries_rows_after_connection_error(store):
+    store.fail_connection = 2
+
+    async def scenario():
+        ingestor = PressEventIngestor(flush_events=10, flush_interval=0.01)
+        await ingestor.start()
+        ingestor.enqueue("R1", [1, 2, 3])
+        await asyncio.sleep(0.02)
+        pending_while_failing = ingestor.stats()["pending_events"]
+        for _ in range(100):
+            if ingestor.stats()["pending_events"] == 0:
+                break
+            await asyncio.sleep(0.01)
+        stats = ingestor.stats()
+        await ingestor.stop()
+        return pending_while_failing, stats
+
+    pending_while_failing, stats = _run(scenario())
+
+    assert pending_while_failing == 3
+    assert stats["pending_events"] == 0
+    assert sorted(r["ts_ms"] for r in store.written) == [1, 2, 3]
+
+
+def test_run_drops_bad_row_and_writes_the_rest(store):
+    store.bad_ts = {2}
+
+    async def scenario():
+        ingestor = PressEventIngestor(flush_events=10, flush_interval=0.01)
+        await ingestor.start()
+        ingestor.enqueue("R1", [1, 2, 3, 4])
+        await asyncio.sleep(0.1)
+        stats = ingestor.stats()
+        await ingestor.stop()
+        return stats
+
+    stats = _run(scenario())
+
+    assert stats["pending_events"] == 0
+    assert sorted(r["ts_ms"] for r in store.written) == [1, 3, 4]
+
+
+def test_stop_flushes_queued_events(store):
+    async def scenario():
+        # 閾値・時間切れでは書き込まれない設定にして、stop() で書き込まれることを確認する
+        ingestor = PressEventIngestor(flush_events=1000, flush_interval=60)
+        await ingestor.start()
+        ingestor.enqueue("R1", [1, 2])
+        ingestor.enqueue("R2", [3])
+        await asyncio.sleep(0.01)
+        assert store.written == []
+        await ingestor.stop()
+        return ingestor
+
+    ingestor = _run(scenario())
+
+    assert not ingestor.running
+    assert ingestor.stats()["pending_events"] == 0
+    assert sorted(r["ts_ms"] for r in store.written) == [1, 2, 3]
+
+
+def test_enqueue_rejects_when_queue_is_full(store):
+    async def scenario():
+        ingestor = PressEventIngestor(max_pending=3, flush_events=1000, flush_interval=60)
+        await ingestor.start()
+        ingestor.enqueue("R1", [1, 2])
+        with pytest.raises(iot_ingest.IngestQueueFull):
+            ingestor.enqueue("R1", [3, 4])
+        await ingestor.stop()
+
+    _run(scenario())
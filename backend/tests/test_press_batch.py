@@ -0,0 +1,131 @@
+import struct
+
+import pytest
+
+from app.utils.press_batch import (
+    MAX_RASPI_NO_LENGTH,
+    MAX_TS_MS,
+    PRESS_BATCH_MAGIC,
+    decode_press_batch,
+    encode_press_batch,
+)
+
+
+def _batch(raspi_no: bytes, width: int, base_ts_ms: int, deltas, count=None) -> bytes:
+    """ヘッダーと差分を直接組み立てる（encode_press_batch が作らない不正な値の確認用）"""
+    code = {2: "H", 4: "I"}[width]
+    return (
+        PRESS_BATCH_MAGIC
+        + bytes([len(raspi_no)]) + raspi_no
+        + struct.pack("<BqI", width, base_ts_ms, len(deltas) if count is None else count)
+        + struct.pack(f"<{len(deltas)}{code}", *deltas)
+    )
+
+
+def test_round_trip_sorts_events():
+    ts_list = [1_700_000_000_500, 1_700_000_000_000, 1_700_000_001_000, 1_700_000_001_000]
+
+    raspi_no, decoded = decode_press_batch(encode_press_batch("raspi-01", ts_list))
+
+    assert raspi_no == "raspi-01"
+    assert decoded == sorted(ts_list)
+
+
+def test_round_trip_empty_batch():
+    assert decode_press_batch(encode_press_batch("raspi-01", [])) == ("raspi-01", [])
+
+
+def test_empty_raspi_no_decodes_as_unknown():
+    assert decode_press_batch(encode_press_batch("", [5]))[0] == "unknown"
+
+
+def test_small_gaps_use_two_byte_deltas():
+    ts_list = [1000, 1000 + 0xFFFF]
+    data = encode_press_batch("R1", ts_list)
+
+    width = data[4 + 1 + 2]
+    assert width == 2
+    assert len(data) == 4 + 1 + 2 + 13 + 2 * len(ts_list)
+    assert decode_press_batch(data)[1] == ts_list
+
+
+def test_large_gaps_use_four_byte_deltas():
+    ts_list = [1000, 1000 + 0x10000, 1000 + 0x10000 + 1]
+    data = encode_press_batch("R1", ts_list)
+
+    width = data[4 + 1 + 2]
+    assert width == 4
+    assert len(data) == 4 + 1 + 2 + 13 + 4 * len(ts_list)
+    assert decode_press_batch(data)[1] == ts_list
+
+
+def test_decode_hand_built_batch():
+    assert decode_press_batch(_batch(b"R1", 4, 100, [0, 10, 70000])) == ("R1", [100, 110, 70110])
+
+
+def test_bad_magic():
+    data = b"XXXX" + encode_press_batch("R1", [1, 2])[4:]
+
+    with pytest.raises(ValueError, match="bad magic"):
+        decode_press_batch(data)
+
+
+@pytest.mark.parametrize("length", [4, 5, 4 + 1 + 2, 4 + 1 + 2 + 12])
+def test_truncated_header(length):
+    data = encode_press_batch("R1", [1, 2])
+
+    with pytest.raises(ValueError, match="truncated header"):
+        decode_press_batch(data[:length])
+
+
+def test_too_long_raspi_no():
+    data = PRESS_BATCH_MAGIC + bytes([MAX_RASPI_NO_LENGTH + 1]) + b"x" * 80
+
+    with pytest.raises(ValueError, match="raspi_no longer than"):
+        decode_press_batch(data)
+
+
+def test_encode_rejects_too_long_raspi_no():
+    with pytest.raises(ValueError):
+        encode_press_batch("x" * (MAX_RASPI_NO_LENGTH + 1), [1])
+
+
+def test_unsupported_width():
+    data = bytearray(encode_press_batch("R1", [1, 2]))
+    data[4 + 1 + 2] = 3
+
+    with pytest.raises(ValueError, match="unsupported delta width"):
+        decode_press_batch(bytes(data))
+
+
+@pytest.mark.parametrize("trim", [-1, 1])
+def test_length_mismatch(trim):
+    data = encode_press_batch("R1", [1, 2, 3])
+    data = data[:trim] if trim < 0 else data + b"\x00" * trim
+
+    with pytest.raises(ValueError, match="bytes of deltas"):
+        decode_press_batch(data)
+
+
+def test_count_larger_than_payload():
+    with pytest.raises(ValueError, match="bytes of deltas"):
+        decode_press_batch(_batch(b"R1", 2, 100, [1, 2], count=5))
+
+
+def test_negative_base():
+    with pytest.raises(ValueError, match="negative base_ts_ms"):
+        decode_press_batch(_batch(b"R1", 2, -1, [0, 1]))
+
+
+def test_bigint_overflow():
+    with pytest.raises(ValueError, match="BIGINT"):
+        decode_press_batch(_batch(b"R1", 4, MAX_TS_MS - 10, [0, 0xFFFFFFFF]))
+
+
+def test_max_bigint_is_accepted():
+    assert decode_press_batch(_batch(b"R1", 2, MAX_TS_MS - 1, [0, 1]))[1] == [MAX_TS_MS - 1, MAX_TS_MS]
+
+
+def test_encode_rejects_gap_beyond_uint32():
+    with pytest.raises(ValueError, match="uint32"):
+        encode_press_batch("R1", [0, 0x100000000])
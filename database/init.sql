@@ -412,20 +412,156 @@ CREATE TABLE `iot_button_events` (
   `raspi_no` VARCHAR(100) NULL,
   `pressed_at` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
   `note` TEXT,
-  `user` VARCHAR(100) DEFAULT 'raspi'
+  `user` VARCHAR(100) DEFAULT 'raspi',
+  `dedupe_key` CHAR(40) NULL COMMENT '重複排除キー（SHA-1、バッチ受信のみ）',
+  UNIQUE KEY `uq_iot_button_events_dedupe` (`dedupe_key`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- ================================================
 -- 23. iot_press_events (プレスショットイベント)
 -- ================================================
 DROP TABLE IF EXISTS `iot_press_events`;
+-- ts_ms（ベトナム時間の月初）で月ごとにパーティション化（古い月は iot_retention でアーカイブして削除）
 CREATE TABLE `iot_press_events` (
-  `id` INT AUTO_INCREMENT PRIMARY KEY,
+  `id` INT AUTO_INCREMENT,
   `ts_ms` BIGINT NOT NULL,
   `raspi_no` VARCHAR(50) NOT NULL DEFAULT 'unknown',
+  PRIMARY KEY (`id`, `ts_ms`),
   INDEX `idx_iot_press_ts_ms` (`ts_ms`),
-  INDEX `idx_iot_press_raspi_no` (`raspi_no`)
-) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='プレスショットイベント (Press-raspi互換)';
+  INDEX `idx_iot_press_raspi_ts` (`raspi_no`, `ts_ms`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='プレスショットイベント (Press-raspi互換)'
+PARTITION BY RANGE (`ts_ms`) (
+  PARTITION `p_history` VALUES LESS THAN (1735664400000),
+  PARTITION `p202501` VALUES LESS THAN (1738342800000),
+  PARTITION `p202502` VALUES LESS THAN (1740762000000),
+  PARTITION `p202503` VALUES LESS THAN (1743440400000),
+  PARTITION `p202504` VALUES LESS THAN (1746032400000),
+  PARTITION `p202505` VALUES LESS THAN (1748710800000),
+  PARTITION `p202506` VALUES LESS THAN (1751302800000),
+  PARTITION `p202507` VALUES LESS THAN (1753981200000),
+  PARTITION `p202508` VALUES LESS THAN (1756659600000),
+  PARTITION `p202509` VALUES LESS THAN (1759251600000),
+  PARTITION `p202510` VALUES LESS THAN (1761930000000),
+  PARTITION `p202511` VALUES LESS THAN (1764522000000),
+  PARTITION `p202512` VALUES LESS THAN (1767200400000),
+  PARTITION `p202601` VALUES LESS THAN (1769878800000),
+  PARTITION `p202602` VALUES LESS THAN (1772298000000),
+  PARTITION `p202603` VALUES LESS THAN (1774976400000),
+  PARTITION `p202604` VALUES LESS THAN (1777568400000),
+  PARTITION `p202605` VALUES LESS THAN (1780246800000),
+  PARTITION `p202606` VALUES LESS THAN (1782838800000),
+  PARTITION `p202607` VALUES LESS THAN (1785517200000),
+  PARTITION `p202608` VALUES LESS THAN (1788195600000),
+  PARTITION `p202609` VALUES LESS THAN (1790787600000),
+  PARTITION `p202610` VALUES LESS THAN (1793466000000),
+  PARTITION `p202611` VALUES LESS THAN (1796058000000),
+  PARTITION `p202612` VALUES LESS THAN (1798736400000),
+  PARTITION `p_future` VALUES LESS THAN MAXVALUE
+);
+
+-- ================================================
+-- 24. production_plan_versions (生産計画の公開履歴)
+-- ================================================
+DROP TABLE IF EXISTS `press_weekly_boards`;
+DROP TABLE IF EXISTS `production_plan_versions`;
+CREATE TABLE `production_plan_versions` (
+  `plan_version_id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '計画バージョンID',
+  `strategy` VARCHAR(50) NULL COMMENT 'スケジューリング戦略',
+  `working_hours` INT NOT NULL DEFAULT 8 COMMENT '工場稼働時間',
+  `schedules_count` INT NOT NULL DEFAULT 0 COMMENT 'スケジュール件数',
+  `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '公開日時',
+  `user` VARCHAR(100) NULL COMMENT '公開ユーザー'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='生産計画の公開履歴';
+
+-- ================================================
+-- 25. press_weekly_boards (プレス週間予定表)
+-- ================================================
+CREATE TABLE `press_weekly_boards` (
+  `board_id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '予定表ID',
+  `plan_version_id` INT NOT NULL COMMENT '計画バージョンID',
+  `working_hours` INT NOT NULL COMMENT '工場稼働時間',
+  `start_date` DATE NOT NULL COMMENT '表示開始日',
+  `source_version` VARCHAR(500) NULL COMMENT '作成時のマスタの変更カウンター',
+  `board` JSON NOT NULL COMMENT '機械×日付のタスク一覧',
+  `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '作成日時',
+  FOREIGN KEY (`plan_version_id`) REFERENCES `production_plan_versions`(`plan_version_id`) ON DELETE CASCADE,
+  UNIQUE KEY `uq_press_weekly_board_version_hours` (`plan_version_id`, `working_hours`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='プレス週間予定表（計画公開時に作成）';
+
+-- ================================================
+-- 26. table_change_counters (テーブルごとの変更カウンター)
+-- ================================================
+DROP TABLE IF EXISTS `table_change_counters`;
+CREATE TABLE `table_change_counters` (
+  `table_name` VARCHAR(64) PRIMARY KEY COMMENT 'テーブル名',
+  `version` BIGINT NOT NULL DEFAULT 0 COMMENT '変更回数',
+  `updated_at` DATETIME NOT NULL COMMENT '最終更新日時（UTC）'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='テーブルごとの変更カウンター';
+
+-- ================================================
+-- 27. iot_press_counters (ラズパイごとのプレスイベント件数)
+-- ================================================
+DROP TABLE IF EXISTS `iot_press_counters`;
+CREATE TABLE `iot_press_counters` (
+  `raspi_no` VARCHAR(50) PRIMARY KEY COMMENT 'ラズパイ番号',
+  `event_count` BIGINT NOT NULL DEFAULT 0 COMMENT 'イベント件数',
+  `last_ts_ms` BIGINT NULL COMMENT '最新イベントのタイムスタンプ (ms)'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='ラズパイごとのプレスイベント件数';
+
+-- ================================================
+-- 28. iot_press_shot_rollups (プレスショット数のロールアップ)
+-- ================================================
+DROP TABLE IF EXISTS `iot_press_shot_rollups`;
+CREATE TABLE `iot_press_shot_rollups` (
+  `resolution` VARCHAR(10) NOT NULL COMMENT 'minute, hour, day',
+  `raspi_no` VARCHAR(50) NOT NULL COMMENT 'ラズパイ番号',
+  `bucket_start_ms` BIGINT NOT NULL COMMENT '時間帯の開始 (ms)',
+  `shot_count` INT NOT NULL DEFAULT 0 COMMENT 'ショット数',
+  PRIMARY KEY (`resolution`, `raspi_no`, `bucket_start_ms`),
+  INDEX `idx_iot_rollup_resolution_bucket` (`resolution`, `bucket_start_ms`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='プレスショット数のロールアップ';
+
+-- ================================================
+-- 29. iot_raspi_machines (ラズパイと機械の対応)
+-- ================================================
+DROP TABLE IF EXISTS `iot_raspi_machines`;
+CREATE TABLE `iot_raspi_machines` (
+  `raspi_no` VARCHAR(50) PRIMARY KEY COMMENT 'ラズパイ番号',
+  `machine_list_id` INT NOT NULL COMMENT '機械ID',
+  `timestamp` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  `user` VARCHAR(100),
+  FOREIGN KEY (`machine_list_id`) REFERENCES `machine_list`(`machine_list_id`) ON DELETE CASCADE,
+  INDEX `idx_iot_raspi_machines_machine` (`machine_list_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='ラズパイと機械の対応';
+
+-- ================================================
+-- 30. iot_press_states (プレスの稼働状態の変化)
+-- ================================================
+DROP TABLE IF EXISTS `iot_press_states`;
+CREATE TABLE `iot_press_states` (
+  `state_id` BIGINT AUTO_INCREMENT PRIMARY KEY,
+  `raspi_no` VARCHAR(50) NOT NULL COMMENT 'ラズパイ番号',
+  `state` VARCHAR(10) NOT NULL COMMENT 'running, slow, stopped',
+  `started_ts_ms` BIGINT NOT NULL COMMENT '状態の開始 (ms)',
+  `ended_ts_ms` BIGINT NULL COMMENT '状態の終了 (ms、継続中は NULL)',
+  `spm` INT NULL COMMENT '変化時の直近1分間のショット数',
+  `planned_spm` DECIMAL(10,2) NULL COMMENT '計画工程のSPM',
+  `schedule_id` INT NULL COMMENT '変化時の計画 (production_schedule)',
+  INDEX `idx_iot_press_states_raspi_started` (`raspi_no`, `started_ts_ms`),
+  INDEX `idx_iot_press_states_ended` (`ended_ts_ms`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='プレスの稼働状態の変化';
+
+-- ================================================
+-- 31. iot_button_counters (ラズパイ・ボタンごとの押下件数)
+-- ================================================
+DROP TABLE IF EXISTS `iot_button_counters`;
+CREATE TABLE `iot_button_counters` (
+  `raspi_no` VARCHAR(100) NOT NULL DEFAULT '' COMMENT 'ラズパイ番号（なしは空文字）',
+  `button_name` VARCHAR(100) NOT NULL COMMENT 'ボタン名',
+  `event_count` BIGINT NOT NULL DEFAULT 0 COMMENT '押下件数',
+  `last_pressed_at` DATETIME NULL COMMENT '最新の押下日時',
+  PRIMARY KEY (`raspi_no`, `button_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='ラズパイ・ボタンごとの押下件数';
 
 SET FOREIGN_KEY_CHECKS = 1;
 
@@ -0,0 +1,24 @@
+-- マイグレーション: iot_button_events の重複排除キーと iot_button_counters テーブル追加
+-- バッチ受信（/api/iot/events/batch）は再送されたイベントを dedupe_key（UNIQUE）で無視する
+-- ダッシュボードの件数は全件COUNTではなく、受信時に加算する iot_button_counters から取得する
+-- 既存のイベントは dedupe_key なし（NULL）のまま、件数は既存のイベントで初期化する
+
+ALTER TABLE `iot_button_events`
+  ADD COLUMN `dedupe_key` CHAR(40) NULL COMMENT '重複排除キー（SHA-1、バッチ受信のみ）',
+  ADD UNIQUE KEY `uq_iot_button_events_dedupe` (`dedupe_key`);
+
+CREATE TABLE IF NOT EXISTS `iot_button_counters` (
+  `raspi_no` VARCHAR(100) NOT NULL DEFAULT '' COMMENT 'ラズパイ番号（なしは空文字）',
+  `button_name` VARCHAR(100) NOT NULL COMMENT 'ボタン名',
+  `event_count` BIGINT NOT NULL DEFAULT 0 COMMENT '押下件数',
+  `last_pressed_at` DATETIME NULL COMMENT '最新の押下日時',
+  PRIMARY KEY (`raspi_no`, `button_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='ラズパイ・ボタンごとの押下件数';
+
+INSERT INTO `iot_button_counters` (`raspi_no`, `button_name`, `event_count`, `last_pressed_at`)
+SELECT COALESCE(`raspi_no`, ''), `button_name`, COUNT(*), MAX(`pressed_at`)
+FROM `iot_button_events`
+GROUP BY COALESCE(`raspi_no`, ''), `button_name`
+ON DUPLICATE KEY UPDATE
+  `event_count` = VALUES(`event_count`),
+  `last_pressed_at` = VALUES(`last_pressed_at`);
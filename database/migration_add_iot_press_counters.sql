@@ -0,0 +1,17 @@
+-- マイグレーション: iot_press_counters テーブル追加
+-- ラズパイごとのプレスイベント件数（/api/iot/events/press の total 用）
+-- 受信時に加算するため、既存のイベント件数で初期化する
+
+CREATE TABLE IF NOT EXISTS `iot_press_counters` (
+  `raspi_no` VARCHAR(50) PRIMARY KEY COMMENT 'ラズパイ番号',
+  `event_count` BIGINT NOT NULL DEFAULT 0 COMMENT 'イベント件数',
+  `last_ts_ms` BIGINT NULL COMMENT '最新イベントのタイムスタンプ (ms)'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='ラズパイごとのプレスイベント件数';
+
+INSERT INTO `iot_press_counters` (`raspi_no`, `event_count`, `last_ts_ms`)
+SELECT `raspi_no`, COUNT(*), MAX(`ts_ms`)
+FROM `iot_press_events`
+GROUP BY `raspi_no`
+ON DUPLICATE KEY UPDATE
+  `event_count` = VALUES(`event_count`),
+  `last_ts_ms` = VALUES(`last_ts_ms`);
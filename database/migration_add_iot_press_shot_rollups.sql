@@ -0,0 +1,28 @@
+-- マイグレーション: iot_press_shot_rollups テーブル追加
+-- ラズパイごと・分/時/日ごとのショット数（/api/iot/events/rollup 用）
+-- 受信時に加算するため、既存のイベントから初期化する
+-- 日の区切りはベトナム時間（UTC+7、25200000ms）の0:00
+
+CREATE TABLE IF NOT EXISTS `iot_press_shot_rollups` (
+  `resolution` VARCHAR(10) NOT NULL COMMENT 'minute, hour, day',
+  `raspi_no` VARCHAR(50) NOT NULL COMMENT 'ラズパイ番号',
+  `bucket_start_ms` BIGINT NOT NULL COMMENT '時間帯の開始 (ms)',
+  `shot_count` INT NOT NULL DEFAULT 0 COMMENT 'ショット数',
+  PRIMARY KEY (`resolution`, `raspi_no`, `bucket_start_ms`),
+  INDEX `idx_iot_rollup_resolution_bucket` (`resolution`, `bucket_start_ms`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='プレスショット数のロールアップ';
+
+INSERT INTO `iot_press_shot_rollups` (`resolution`, `raspi_no`, `bucket_start_ms`, `shot_count`)
+SELECT 'minute', `raspi_no`, (`ts_ms` + 25200000) DIV 60000 * 60000 - 25200000 AS `bucket`, COUNT(*)
+FROM `iot_press_events` GROUP BY `raspi_no`, `bucket`
+ON DUPLICATE KEY UPDATE `shot_count` = VALUES(`shot_count`);
+
+INSERT INTO `iot_press_shot_rollups` (`resolution`, `raspi_no`, `bucket_start_ms`, `shot_count`)
+SELECT 'hour', `raspi_no`, (`ts_ms` + 25200000) DIV 3600000 * 3600000 - 25200000 AS `bucket`, COUNT(*)
+FROM `iot_press_events` GROUP BY `raspi_no`, `bucket`
+ON DUPLICATE KEY UPDATE `shot_count` = VALUES(`shot_count`);
+
+INSERT INTO `iot_press_shot_rollups` (`resolution`, `raspi_no`, `bucket_start_ms`, `shot_count`)
+SELECT 'day', `raspi_no`, (`ts_ms` + 25200000) DIV 86400000 * 86400000 - 25200000 AS `bucket`, COUNT(*)
+FROM `iot_press_events` GROUP BY `raspi_no`, `bucket`
+ON DUPLICATE KEY UPDATE `shot_count` = VALUES(`shot_count`);
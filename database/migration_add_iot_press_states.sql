@@ -0,0 +1,25 @@
+-- マイグレーション: iot_raspi_machines / iot_press_states テーブル追加
+-- ラズパイと機械の対応と、プレスの稼働状態（running / slow / stopped）の変化の記録
+-- 状態は受信時のSPMと無受信時間から iot_press_monitor が判定し、変化した時だけ1行追加する
+
+CREATE TABLE IF NOT EXISTS `iot_raspi_machines` (
+  `raspi_no` VARCHAR(50) PRIMARY KEY COMMENT 'ラズパイ番号',
+  `machine_list_id` INT NOT NULL COMMENT '機械ID',
+  `timestamp` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  `user` VARCHAR(100),
+  FOREIGN KEY (`machine_list_id`) REFERENCES `machine_list`(`machine_list_id`) ON DELETE CASCADE,
+  INDEX `idx_iot_raspi_machines_machine` (`machine_list_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='ラズパイと機械の対応';
+
+CREATE TABLE IF NOT EXISTS `iot_press_states` (
+  `state_id` BIGINT AUTO_INCREMENT PRIMARY KEY,
+  `raspi_no` VARCHAR(50) NOT NULL COMMENT 'ラズパイ番号',
+  `state` VARCHAR(10) NOT NULL COMMENT 'running, slow, stopped',
+  `started_ts_ms` BIGINT NOT NULL COMMENT '状態の開始 (ms)',
+  `ended_ts_ms` BIGINT NULL COMMENT '状態の終了 (ms、継続中は NULL)',
+  `spm` INT NULL COMMENT '変化時の直近1分間のショット数',
+  `planned_spm` DECIMAL(10,2) NULL COMMENT '計画工程のSPM',
+  `schedule_id` INT NULL COMMENT '変化時の計画 (production_schedule)',
+  INDEX `idx_iot_press_states_raspi_started` (`raspi_no`, `started_ts_ms`),
+  INDEX `idx_iot_press_states_ended` (`ended_ts_ms`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='プレスの稼働状態の変化';
@@ -0,0 +1,7 @@
+-- マイグレーション: press_weekly_boards に source_version 追加
+-- PO・製品・顧客・機械などのマスタは計画を公開せずに変更されるため、
+-- 予定表の作成時の変更カウンターを保存し、表示時に変わっていれば作り直す
+-- 既存の予定表は NULL のまま（次回の表示で作り直される）
+
+ALTER TABLE `press_weekly_boards`
+  ADD COLUMN `source_version` VARCHAR(500) NULL COMMENT '作成時のマスタの変更カウンター' AFTER `start_date`;
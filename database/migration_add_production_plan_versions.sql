@@ -0,0 +1,23 @@
+-- マイグレーション: production_plan_versions / press_weekly_boards テーブル追加
+-- 生産計画の公開履歴と、公開時に作成するプレス週間予定表
+
+CREATE TABLE IF NOT EXISTS `production_plan_versions` (
+  `plan_version_id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '計画バージョンID',
+  `strategy` VARCHAR(50) NULL COMMENT 'スケジューリング戦略',
+  `working_hours` INT NOT NULL DEFAULT 8 COMMENT '工場稼働時間',
+  `schedules_count` INT NOT NULL DEFAULT 0 COMMENT 'スケジュール件数',
+  `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '公開日時',
+  `user` VARCHAR(100) NULL COMMENT '公開ユーザー'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='生産計画の公開履歴';
+
+CREATE TABLE IF NOT EXISTS `press_weekly_boards` (
+  `board_id` INT AUTO_INCREMENT PRIMARY KEY COMMENT '予定表ID',
+  `plan_version_id` INT NOT NULL COMMENT '計画バージョンID',
+  `working_hours` INT NOT NULL COMMENT '工場稼働時間',
+  `start_date` DATE NOT NULL COMMENT '表示開始日',
+  `board` JSON NOT NULL COMMENT '機械×日付のタスク一覧',
+  `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT '作成日時',
+
+  FOREIGN KEY (`plan_version_id`) REFERENCES `production_plan_versions`(`plan_version_id`) ON DELETE CASCADE,
+  UNIQUE KEY `uq_press_weekly_board_version_hours` (`plan_version_id`, `working_hours`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='プレス週間予定表（計画公開時に作成）';
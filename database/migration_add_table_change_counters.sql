@@ -0,0 +1,9 @@
+-- マイグレーション: table_change_counters テーブル追加
+-- テーブルごとの変更カウンター（条件付きGETのETag / Last-Modified 用）
+-- アプリケーションのコミット時に、変更のあったテーブルの version を加算する
+
+CREATE TABLE IF NOT EXISTS `table_change_counters` (
+  `table_name` VARCHAR(64) PRIMARY KEY COMMENT 'テーブル名',
+  `version` BIGINT NOT NULL DEFAULT 0 COMMENT '変更回数',
+  `updated_at` DATETIME NOT NULL COMMENT '最終更新日時（UTC）'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='テーブルごとの変更カウンター';
@@ -0,0 +1,43 @@
+-- マイグレーション: iot_press_events を月ごとのパーティションに変更
+-- ts_ms（ベトナム時間の月初 0:00）で RANGE パーティション化し、古い月は iot_retention で
+-- 日ごとの gzip CSV にアーカイブしてからパーティションごと削除する
+-- パーティションのキー（ts_ms）を含まない一意キーは作れないため、主キーを (id, ts_ms) にする
+-- ラズパイ単体のインデックスは期間検索に使える (raspi_no, ts_ms) に置き換える
+-- p_future は以降の月をアプリが事前に分割する（REORGANIZE PARTITION）
+-- テーブルを作り直すため、件数が多い場合は受信を止めてから実行する
+
+ALTER TABLE `iot_press_events`
+  DROP PRIMARY KEY,
+  ADD PRIMARY KEY (`id`, `ts_ms`),
+  DROP INDEX `idx_iot_press_raspi_no`,
+  ADD INDEX `idx_iot_press_raspi_ts` (`raspi_no`, `ts_ms`);
+
+ALTER TABLE `iot_press_events`
+PARTITION BY RANGE (`ts_ms`) (
+  PARTITION `p_history` VALUES LESS THAN (1735664400000),
+  PARTITION `p202501` VALUES LESS THAN (1738342800000),
+  PARTITION `p202502` VALUES LESS THAN (1740762000000),
+  PARTITION `p202503` VALUES LESS THAN (1743440400000),
+  PARTITION `p202504` VALUES LESS THAN (1746032400000),
+  PARTITION `p202505` VALUES LESS THAN (1748710800000),
+  PARTITION `p202506` VALUES LESS THAN (1751302800000),
+  PARTITION `p202507` VALUES LESS THAN (1753981200000),
+  PARTITION `p202508` VALUES LESS THAN (1756659600000),
+  PARTITION `p202509` VALUES LESS THAN (1759251600000),
+  PARTITION `p202510` VALUES LESS THAN (1761930000000),
+  PARTITION `p202511` VALUES LESS THAN (1764522000000),
+  PARTITION `p202512` VALUES LESS THAN (1767200400000),
+  PARTITION `p202601` VALUES LESS THAN (1769878800000),
+  PARTITION `p202602` VALUES LESS THAN (1772298000000),
+  PARTITION `p202603` VALUES LESS THAN (1774976400000),
+  PARTITION `p202604` VALUES LESS THAN (1777568400000),
+  PARTITION `p202605` VALUES LESS THAN (1780246800000),
+  PARTITION `p202606` VALUES LESS THAN (1782838800000),
+  PARTITION `p202607` VALUES LESS THAN (1785517200000),
+  PARTITION `p202608` VALUES LESS THAN (1788195600000),
+  PARTITION `p202609` VALUES LESS THAN (1790787600000),
+  PARTITION `p202610` VALUES LESS THAN (1793466000000),
+  PARTITION `p202611` VALUES LESS THAN (1796058000000),
+  PARTITION `p202612` VALUES LESS THAN (1798736400000),
+  PARTITION `p_future` VALUES LESS THAN MAXVALUE
+);